@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Потоковая аналитика ответов из таблицы survey_responses.
+
+Строки читаются страницами с keyset-пагинацией (id > последний id), поэтому
+в памяти никогда не лежит вся таблица. Ответы раскладываются по колонкам:
+для вопросов с выбором хранится массив индексов вариантов, а для каждого
+варианта — байтовая маска по строкам. Маски превращаются в большие целые
+числа, и подсчеты, совместная встречаемость и кросс-таблицы сводятся к
+побитовому AND и int.bit_count() без циклов по строкам в Python.
+
+    python analytics.py --fixture fixtures/survey_responses.jsonl --crosstab city
+"""
+
+import argparse
+import json
+import os
+import sys
+from array import array
+
+PAGE_SIZE = int(os.getenv('ANALYTICS_PAGE_SIZE', 500))
+NO_ANSWER = -1
+OTHER_LABEL = "Інше (свій варіант)"
+
+
+def iter_responses(client, page_size=PAGE_SIZE, after_id=0, columns="id,user_id,created_at,answers",
+                   since=None):
+    """
+    Постранично читает survey_responses из Supabase по возрастанию id.
+    since дополнительно отбирает строки с created_at позже этого значения.
+    """
+    last_id = after_id or 0
+    while True:
+        query = client.table("survey_responses").select(columns).gt("id", last_id)
+        if since is not None:
+            query = query.gt("created_at", since)
+        rows = query.order("id").limit(page_size).execute().data or []
+        yield from rows
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1]["id"]
+
+
+def connect():
+    """Клиент Supabase из SUPABASE_URL и SUPABASE_KEY (библиотека импортируется только здесь)"""
+    from supabase import create_client
+    return create_client(os.environ['SUPABASE_URL'], os.environ['SUPABASE_KEY'])
+
+
+def iter_fixture(path):
+    """Читает ответы из локального JSONL файла в том же формате, что и таблица"""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def decode_answers(row):
+    """Колонка answers хранит JSON строку (или уже разобранный объект)"""
+    answers = row.get("answers") or {}
+    if isinstance(answers, str):
+        answers = json.loads(answers)
+    return answers
+
+
+def normalize_group(value):
+    return " ".join(str(value).split()).casefold() if value else ""
+
+
+class SurveyColumns:
+    def __init__(self, questions, group_fields=("city", "age")):
+        self.questions = {}  # Ключ вопроса -> (тип, варианты)
+        self.rows = 0
+        self.ids = array('q')
+        self.indices = {}  # Одиночный выбор: массив индексов варианта (-1 — нет ответа)
+        self.masks = {}  # Выбор: bytearray на каждый вариант (+ "Інше")
+        self.groups = {field: [] for field in group_fields}
+        self._bitmaps = {}
+
+        for question in questions:
+            if question['type'] not in ('single_choice', 'multiple_choice'):
+                continue
+            key = f"q{question['id']}"
+            options = question['options']
+            self.questions[key] = (question['type'], options)
+            self.masks[key] = [bytearray() for _ in range(len(options) + 1)]
+            if question['type'] == 'single_choice':
+                self.indices[key] = array('b')
+        self._lookup = {
+            key: {option: i for i, option in enumerate(options)}
+            for key, (_, options) in self.questions.items()
+        }
+
+    def add(self, row):
+        """Добавляет одну строку таблицы в колонки"""
+        answers = decode_answers(row)
+        self.ids.append(int(row.get("id", self.rows)))
+        for key, (question_type, options) in self.questions.items():
+            selected = self._option_indices(key, answers.get(key), len(options))
+            for i, mask in enumerate(self.masks[key]):
+                mask.append(1 if i in selected else 0)
+            if question_type == 'single_choice':
+                self.indices[key].append(next(iter(selected)) if selected else NO_ANSWER)
+        for field, values in self.groups.items():
+            values.append(normalize_group(answers.get(field)))
+        self.rows += 1
+        self._bitmaps.clear()
+
+    def _option_indices(self, key, value, other_index):
+        if value is None:
+            return set()
+        values = value if isinstance(value, list) else [value]
+        lookup = self._lookup[key]
+        selected = set()
+        for item in values:
+            if item in lookup:
+                selected.add(lookup[item])
+            elif isinstance(item, str) and item.startswith("Інше"):
+                selected.add(other_index)
+        return selected
+
+    def load(self, rows):
+        for row in rows:
+            self.add(row)
+        return self
+
+    def labels(self, key):
+        return list(self.questions[key][1]) + [OTHER_LABEL]
+
+    def bitmap(self, key, option):
+        """Битовая карта строк, где выбран вариант (байт на строку)"""
+        cache_key = (key, option)
+        if cache_key not in self._bitmaps:
+            self._bitmaps[cache_key] = int.from_bytes(self.masks[key][option], 'little')
+        return self._bitmaps[cache_key]
+
+    def group_bitmap(self, field, value):
+        cache_key = (field, value)
+        if cache_key not in self._bitmaps:
+            mask = bytes(1 if v == value else 0 for v in self.groups[field])
+            self._bitmaps[cache_key] = int.from_bytes(mask, 'little')
+        return self._bitmaps[cache_key]
+
+    def tally(self, key):
+        """Количество выборов каждого варианта"""
+        return {label: self.masks[key][i].count(1) for i, label in enumerate(self.labels(key))}
+
+    def answered(self, key):
+        """Сколько строк содержат хотя бы один вариант"""
+        combined = 0
+        for i in range(len(self.masks[key])):
+            combined |= self.bitmap(key, i)
+        return combined.bit_count()
+
+    def cooccurrence(self, key):
+        """Матрица: сколько раз варианты i и j выбраны вместе"""
+        bitmaps = [self.bitmap(key, i) for i in range(len(self.masks[key]))]
+        return [[(a & b).bit_count() for b in bitmaps] for a in bitmaps]
+
+    def top_groups(self, field, limit=10):
+        counts = {}
+        for value in self.groups[field]:
+            if value:
+                counts[value] = counts.get(value, 0) + 1
+        return sorted(counts, key=lambda value: (-counts[value], value))[:limit]
+
+    def crosstab(self, key, field, limit=10):
+        """Кросс-таблица: значение поля (город, возраст) -> распределение вариантов"""
+        labels = self.labels(key)
+        table = {}
+        for value in self.top_groups(field, limit):
+            group = self.group_bitmap(field, value)
+            table[value] = {
+                label: (self.bitmap(key, i) & group).bit_count() for i, label in enumerate(labels)
+            }
+        return table
+
+
+def summary(columns, crosstab_field=None, question=None):
+    """Итоги в виде словаря (для --json и API)"""
+    keys = [question] if question else list(columns.questions)
+    result = {"rows": columns.rows, "questions": {}}
+    for key in keys:
+        item = {"answered": columns.answered(key), "tally": columns.tally(key)}
+        if columns.questions[key][0] == 'multiple_choice':
+            item["cooccurrence"] = columns.cooccurrence(key)
+        if crosstab_field:
+            item["crosstab"] = columns.crosstab(key, crosstab_field)
+        result["questions"][key] = item
+    return result
+
+
+def format_report(columns, crosstab_field=None, question=None):
+    """Текстовый отчет для CLI и бота"""
+    data = summary(columns, crosstab_field, question)
+    lines = [f"📊 Відповідей: {data['rows']}"]
+    for key, item in data["questions"].items():
+        lines.append("")
+        lines.append(f"{key} (відповіли {item['answered']}):")
+        for label, count in item["tally"].items():
+            if count:
+                share = count / item['answered'] * 100 if item['answered'] else 0
+                lines.append(f"   {count:>5} ({share:4.0f}%)  {label}")
+        for value, tally in item.get("crosstab", {}).items():
+            top = max(tally, key=tally.get)
+            lines.append(f"   [{value}] найчастіше: {top} ({tally[top]})")
+    return "\n".join(lines)
+
+
+def load_columns(questions, fixture=None, client=None):
+    """Строит колонки из фикстуры или из Supabase"""
+    if fixture:
+        return SurveyColumns(questions).load(iter_fixture(fixture))
+    if client is None:
+        client = connect()
+    return SurveyColumns(questions).load(iter_responses(client))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Аналитика ответов опроса")
+    parser.add_argument("--fixture", help="JSONL файл вместо Supabase")
+    parser.add_argument("--question", help="Только один вопрос, например q2")
+    parser.add_argument("--crosstab", choices=["city", "age"], help="Разрез по полю")
+    parser.add_argument("--json", action="store_true", help="Вывод в JSON")
+    args = parser.parse_args()
+
+    from bot_simple import QUESTIONS
+    columns = load_columns(QUESTIONS, args.fixture)
+    if args.question and args.question not in columns.questions:
+        parser.error(f"Неизвестный вопрос с выбором: {args.question}")
+
+    if args.json:
+        json.dump(summary(columns, args.crosstab, args.question), sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print(format_report(columns, args.crosstab, args.question))
+
+
+if __name__ == "__main__":
+    main()
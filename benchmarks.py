@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Бенчмарки компонентов бота.
+
+    python benchmarks.py journal [--records 5000] [--threads 16]
+    python benchmarks.py logging [--updates 100000]
+    python benchmarks.py metrics [--events 200000] [--threads 8]
+    python benchmarks.py shards [--workers 1,2,4] [--chats 500] [--toggles 20]   (+ проверка защиты от флуда)
+    python benchmarks.py load [--respondents 1000] [--speed 20]   (см. loadtest.py)
+    python benchmarks.py startup [--runs 5]
+"""
+
+import argparse
+import logging
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from botlog import Sampler, setup_logging, stop_logging
+from metrics import Counter, Histogram
+from spool import ResponseJournal
+
+
+def _sample_row(user_id):
+    return {
+        "user_id": user_id,
+        "username": f"user_{user_id}",
+        "submission_id": uuid.uuid4().hex,
+        "created_at": "2024-01-01T12:00:00",
+        "answers": '{"q1": "У своєму місті", "q2": ["Через Google", "Через друзів/знайомих"], "city": "Київ"}',
+    }
+
+
+def bench_journal(records, threads):
+    """Пропускная способность журнала: последовательно и с групповым fsync"""
+    print(f"📒 Журнал ответов: {records} записей")
+    for label, fsync, workers in (
+        ("без fsync, 1 поток", False, 1),
+        ("fsync, 1 поток", True, 1),
+        (f"fsync, {threads} потоков", True, threads),
+    ):
+        with tempfile.TemporaryDirectory() as directory:
+            journal = ResponseJournal(os.path.join(directory, "responses.jsonl"), fsync=fsync)
+            per_worker = records // workers
+            rows = [[_sample_row(w * per_worker + i) for i in range(per_worker)] for w in range(workers)]
+
+            def write(chunk):
+                for row in chunk:
+                    journal.append(row)
+
+            started = time.perf_counter()
+            pool = [threading.Thread(target=write, args=(chunk,)) for chunk in rows]
+            for thread in pool:
+                thread.start()
+            for thread in pool:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            journal.close()
+
+        total = per_worker * workers
+        print(f"   {label:<22} {total / elapsed:>10.0f} записей/с   {elapsed / total * 1e6:>8.1f} мкс/запись")
+
+
+def bench_logging(updates):
+    """Накладные расходы логирования на одно обновление в потоке обработки"""
+    print(f"📜 Логирование: {updates} обновлений")
+    chat_id, text, option = 123456789, "2. Через Google", "Через Google"
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Было: два print на каждое обновление в небуферизованный stdout
+        with open(os.path.join(directory, "print.log"), "w", buffering=1) as out:
+            started = time.perf_counter()
+            for _ in range(updates):
+                print(f"📨 Получено сообщение от {chat_id}: {text}", file=out)
+                print(f"🔍 Обработка ответа: {text} -> {option}", file=out)
+            before = time.perf_counter() - started
+
+        # Стало: очередь логов, отладочные записи выключены, входящие — выборочно
+        with open(os.path.join(directory, "queue.log"), "w") as out:
+            setup_logging(level="INFO", stream=out)
+            log = logging.getLogger("bench")
+            sampler = Sampler()
+            started = time.perf_counter()
+            for _ in range(updates):
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug("📨 Получено сообщение от %s: %s", chat_id, text)
+                elif sampler():
+                    log.info("📨 Получено сообщение от %s (каждое %s-е)", chat_id, sampler.every)
+                log.debug("🔍 Обработка ответа: %s -> %s", text, option)
+            after = time.perf_counter() - started
+            stop_logging()
+
+    print(f"   {'print':<22} {before / updates * 1e6:>8.2f} мкс/обновление")
+    print(f"   {'очередь + уровни':<22} {after / updates * 1e6:>8.2f} мкс/обновление")
+
+
+def bench_metrics(events, threads):
+    """Счетчик под общей блокировкой против шардов по потокам"""
+    print(f"📈 Метрики: {events} событий в {threads} потоках")
+    per_thread = events // threads
+
+    class LockedCounter:
+        def __init__(self):
+            self.value = 0
+            self.lock = threading.Lock()
+
+        def inc(self):
+            with self.lock:
+                self.value += 1
+
+    locked = LockedCounter()
+    counter = Counter("bench_total", "")
+    histogram = Histogram("bench_seconds", "", ("handler",))
+    for label, record in (
+        ("блокировка", lambda: locked.inc()),
+        ("шарды, counter", lambda: counter.inc()),
+        ("шарды, histogram", lambda: histogram.observe(0.003, "process_answer")),
+    ):
+        def work():
+            for _ in range(per_thread):
+                record()
+
+        pool = [threading.Thread(target=work) for _ in range(threads)]
+        started = time.perf_counter()
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        print(f"   {label:<22} {elapsed / (per_thread * threads) * 1e9:>8.0f} нс/событие")
+    assert sum(counter.collect().values()) == per_thread * threads
+
+
+class _CountingSink:
+    """Заменяет OutboundScheduler/SurveyWriter: только считает вызовы"""
+
+    def __init__(self):
+        self.count = 0
+        self.target = None
+        self.done = threading.Event()
+
+    def submit(self, *args, **kwargs):
+        self.count += 1
+        if self.target is not None and self.count >= self.target:
+            self.done.set()
+        return True
+
+    def expect(self, target):
+        self.done.clear()
+        self.target = target
+        if self.count >= target:
+            self.done.set()
+
+
+def bench_shards(worker_counts, chats, toggles):
+    """Пропускная способность обработки обновлений в зависимости от числа процессов"""
+    # Дочерние процессы наследуют окружение: без базы и без файлов сессий
+    os.environ.update(SESSION_STORE="memory", SUPABASE_URL="", SUPABASE_KEY="", LOG_LEVEL="ERROR")
+    from bot_simple import SURVEY, FullTelegramBot
+    from shard import ShardSupervisor
+    from survey import START_BUTTON
+
+    first, second = SURVEY.questions[0], SURVEY.questions[1]
+    script = ["/start", START_BUTTON, f"1. {first.options[0]}"] + [f"1. {second.options[0]}"] * toggles
+    updates = [
+        {"update_id": 0, "message": {"chat": {"id": chat_id}, "from": {"id": chat_id}, "text": text}}
+        for step, text in enumerate(script)
+        for chat_id in range(1000, 1000 + chats)
+    ]
+    print(f"🧩 Процессы-обработчики: {chats} чатов, {len(updates)} обновлений (ядер: {os.cpu_count()})")
+
+    for workers in worker_counts:
+        outbound, writer = _CountingSink(), _CountingSink()
+        # Защита от флуда отключена: серия нажатий одного чата здесь — нагрузка, а не флуд
+        supervisor = ShardSupervisor("0:bench", FullTelegramBot, outbound, writer, workers, max_pending=10000,
+                                     guard_factory=None).start()
+        # Прогрев: каждый процесс обработал одно обновление
+        outbound.expect(workers)
+        for chat_id in range(workers):
+            supervisor.router.submit({"update_id": 0, "message": {"chat": {"id": chat_id}, "text": "/stats"}})
+        outbound.done.wait(60)
+
+        outbound.expect(workers + len(updates))
+        started = time.perf_counter()
+        for update in updates:
+            supervisor.router.submit(update)
+        outbound.done.wait(300)
+        elapsed = time.perf_counter() - started
+        supervisor.stop()
+        print(f"   {workers} процесс(ов)          {len(updates) / elapsed:>10.0f} обновлений/с")
+
+    check_shard_flood_guard(max(worker_counts))
+
+
+def check_shard_flood_guard(workers, limit=5, flood=30):
+    """
+    Проверка защиты от флуда в процессах-обработчиках: из чата, приславшего
+    flood сообщений подряд, обрабатывается ровно limit, соседний чат не страдает.
+    """
+    os.environ.update(FLOOD_LIMIT=str(limit), FLOOD_WINDOW="60")
+    from bot_simple import FullTelegramBot
+    from shard import ShardSupervisor
+
+    outbound = _CountingSink()
+    supervisor = ShardSupervisor("0:bench", FullTelegramBot, outbound, _CountingSink(), workers).start()
+    # Каждое принятое сообщение — ровно один ответ (приветствие или подсказка про кнопки)
+    texts = [(1000, "/start")] + [(1000, "спам")] * flood + [(1001, "/start"), (1001, "спам")]
+    expected = limit + 2
+    outbound.expect(expected)
+    for chat_id, text in texts:
+        supervisor.router.submit({"update_id": 0, "message": {"chat": {"id": chat_id}, "text": text}})
+    outbound.done.wait(30)
+    time.sleep(0.5)  # Лишние ответы, если защита не сработала, успели бы прийти
+    supervisor.stop()
+    if outbound.count != expected:
+        print(f"❌ Защита от флуда: ответов {outbound.count}, ожидалось {expected}")
+        sys.exit(1)
+    print(f"✅ Защита от флуда: из {flood + 1} сообщений чата обработано {limit}")
+
+
+def _import_seconds(module):
+    """Время импорта модуля в чистом интерпретаторе"""
+    code = f"import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port, deadline):
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return True
+        except OSError:
+            time.sleep(0.005)
+    return False
+
+
+def bench_startup(runs):
+    """Холодный старт: импорт, открытие порта health check, ответ на первое обновление"""
+    from fake_supabase import FakeSupabase
+    from fake_telegram import FakeTelegram
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot_simple.py")
+    print(f"🚀 Холодный старт: {runs} запусков (медианы)")
+    imports = [_import_seconds("bot_simple") for _ in range(runs)]
+    deferred = [_import_seconds("supabase") for _ in range(runs)]
+    print(f"   import bot_simple              {statistics.median(imports) * 1000:>8.0f} мс")
+    print(f"   import supabase (отложен)      {statistics.median(deferred) * 1000:>8.0f} мс")
+
+    telegram, supabase = FakeTelegram().start(), FakeSupabase().start()
+    port_times, reply_times = [], []
+    try:
+        for run in range(runs):
+            chat_id = 5000 + run
+            telegram.send_text(chat_id, "/start")  # Ждет бота в очереди getUpdates
+            port = _free_port()
+            env = dict(
+                os.environ, TELEGRAM_TOKEN="0:bench", TELEGRAM_API_URL=telegram.url,
+                SUPABASE_URL=supabase.url, SUPABASE_KEY="fake-key", PORT=str(port),
+                SESSION_STORE="memory", SHARD_WORKERS="1", WEBHOOK_URL="", LOG_LEVEL="ERROR",
+            )
+            with tempfile.TemporaryDirectory() as workdir:
+                started = time.monotonic()
+                process = subprocess.Popen([sys.executable, script], cwd=workdir, env=env)
+                try:
+                    if _wait_for_port(port, started + 30):
+                        port_times.append(time.monotonic() - started)
+                    telegram.wait_for_messages(chat_id, 1, timeout=30)
+                    reply_times.append(time.monotonic() - started)
+                finally:
+                    process.terminate()
+                    process.wait(10)
+    finally:
+        telegram.stop()
+        supabase.stop()
+    print(f"   порт health check слушает      {statistics.median(port_times) * 1000:>8.0f} мс")
+    print(f"   ответ на первое обновление     {statistics.median(reply_times) * 1000:>8.0f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки Telegram бота")
+    subparsers = parser.add_subparsers(dest="bench", required=True)
+
+    journal = subparsers.add_parser("journal", help="Запись в локальный журнал ответов")
+    journal.add_argument("--records", type=int, default=5000)
+    journal.add_argument("--threads", type=int, default=16)
+
+    logs = subparsers.add_parser("logging", help="Накладные расходы логирования на обновление")
+    logs.add_argument("--updates", type=int, default=100000)
+
+    counters = subparsers.add_parser("metrics", help="Стоимость обновления метрик")
+    counters.add_argument("--events", type=int, default=200000)
+    counters.add_argument("--threads", type=int, default=8)
+
+    shards = subparsers.add_parser("shards", help="Масштабирование по процессам-обработчикам")
+    shards.add_argument("--workers", default="1,2,4")
+    shards.add_argument("--chats", type=int, default=500)
+    shards.add_argument("--toggles", type=int, default=20)
+
+    load = subparsers.add_parser("load", help="Виртуальные респонденты на FakeTelegram и FakeSupabase")
+    load.add_argument("--respondents", type=int, default=1000)
+    load.add_argument("--speed", type=float, default=20.0)
+    load.add_argument("--seed", type=int, default=1)
+
+    startup = subparsers.add_parser("startup", help="Время импорта и ответа на первое обновление")
+    startup.add_argument("--runs", type=int, default=5)
+
+    args = parser.parse_args()
+    if args.bench == "journal":
+        bench_journal(args.records, args.threads)
+    elif args.bench == "logging":
+        bench_logging(args.updates)
+    elif args.bench == "metrics":
+        bench_metrics(args.events, args.threads)
+    elif args.bench == "shards":
+        bench_shards([int(n) for n in args.workers.split(",")], args.chats, args.toggles)
+    elif args.bench == "load":
+        from loadtest import run_loadtest
+        run_loadtest(args.respondents, args.speed, seed=args.seed)
+    elif args.bench == "startup":
+        bench_startup(args.runs)
+
+
+if __name__ == "__main__":
+    main()
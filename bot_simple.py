@@ -6,22 +6,85 @@
 import os
 import asyncio
 import sys
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 import threading
 import time
-import requests
+import hmac
 import json
+import logging
+import multiprocessing
 from datetime import datetime
-from supabase import create_client, Client
+import uuid
+from urllib.parse import parse_qs
+
+from analytics import SurveyColumns, iter_responses, format_report
+from botlog import Sampler, setup_logging
+from checkpoint import UpdateCheckpoint
+from db_async import AsyncDatabaseManager
+from db_writer import SUBMIT_LOCAL, SUBMIT_QUEUED, SurveyWriter
+from floodguard import FloodGuard
+from health import HealthState, flag_check, max_age_check, max_value_check
+import metrics
+from metrics import timed
+from profiling import PROFILER, sample_stacks
+from sessions import Session, create_session_store, reshard_sqlite_sessions, PHASE_MAIN, PHASE_ADDITIONAL
+from shard import ShardSupervisor, shard_for
+from spool import ResponseJournal
+from stats import AnswerTally, ResponseCounter, SurveyFunnel
+from survey import (
+    Survey, START_BUTTON, FINISH_CHOICE_BUTTON, BACK_BUTTON, SKIP_BUTTON,
+    START_KEYBOARD, BACK_KEYBOARD, HOME_KEYBOARD,
+)
+from reminders import ReminderScheduler
+from outbound import OutboundScheduler, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from telegram_api import TelegramAPI
+from update_engine import UpdateEngine, update_chat_id, update_type
+from webhook import WebhookReceiver, MAX_BODY_SIZE
 
 # Загружаем переменные окружения
 from dotenv import load_dotenv
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
 # Supabase configuration
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
 
+# Клиент базы: supabase (библиотека supabase-py) или async (REST через пул httpx, см. db_async.py)
+DB_CLIENT = os.getenv('DB_CLIENT', 'supabase')
+
+# Чаты, которым доступна команда /report
+ADMIN_CHAT_IDS = {int(x) for x in os.getenv('ADMIN_CHAT_IDS', '').split(',') if x.strip()}
+
+# Максимальная длина сообщения Telegram
+MAX_MESSAGE_LENGTH = 4096
+
+# Long polling
+POLL_TIMEOUT = int(os.getenv('POLL_TIMEOUT', 30))
+
+# Webhook: если задан публичный адрес, обновления принимаются через health check сервер
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+
+# reply — варианты на обычной клавиатуре, inline — кнопки под сообщением с правкой на месте
+KEYBOARD_MODE = os.getenv('KEYBOARD_MODE', 'reply')
+
+# Число процессов-обработчиков (больше 1 — многопроцессный режим, см. shard.py)
+SHARD_WORKERS = int(os.getenv('SHARD_WORKERS', 1))
+
+# Пороги /readyz: возраст последнего getUpdates (секунды), очередь исходящих, ответы для базы
+READY_MAX_POLL_AGE = float(os.getenv('READY_MAX_POLL_AGE', POLL_TIMEOUT + 30))
+READY_MAX_OUTBOUND = int(os.getenv('READY_MAX_OUTBOUND', 1000))
+READY_MAX_BACKLOG = int(os.getenv('READY_MAX_BACKLOG', 500))
+
+# Профилирование через health check сервер (/debug/timings, /debug/profile): без токена выключено
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', 60))
+PROFILE_LOCK = threading.Lock()
+
+# Cache-Control для /api: сколько секунд дашборд может не перепроверять ответ
+API_CACHE_MAX_AGE = int(os.getenv('API_CACHE_MAX_AGE', 5))
+
 # Конфигурация вопросов
 QUESTIONS = [
     {
@@ -167,64 +230,158 @@ ADDITIONAL_QUESTIONS = [
     }
 ]
 
+# Опрос компилируется один раз при старте: ошибки в описании видны сразу
+SURVEY = Survey(QUESTIONS, ADDITIONAL_QUESTIONS)
+
 class DatabaseManager:
+    """
+    Клиент Supabase создается лениво: импорт библиотеки supabase занимает
+    большую часть холодного старта, поэтому бот начинает принимать
+    обновления сразу, а клиент прогревается в фоне (warm) или создается при
+    первом обращении.
+    """
+    
     def __init__(self):
-        if SUPABASE_URL and SUPABASE_KEY:
-            try:
-                self.supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-                print("✅ Подключение к Supabase установлено")
-            except Exception as e:
-                print(f"❌ Ошибка подключения к Supabase: {e}")
-                self.supabase = None
-        else:
-            print("⚠️ SUPABASE_URL или SUPABASE_KEY не установлены")
-            self.supabase = None
+        self.configured = bool(SUPABASE_URL and SUPABASE_KEY)
+        self._client = None
+        self._failed = False
+        self._lock = threading.Lock()
+        if not self.configured:
+            log.warning("⚠️ SUPABASE_URL или SUPABASE_KEY не установлены")
+    
+    @property
+    def supabase(self):
+        """Клиент Supabase (None, если база не настроена или подключиться не удалось)"""
+        if self._client is None and self.configured and not self._failed:
+            with self._lock:
+                if self._client is None and not self._failed:
+                    self._client = self._connect()
+        return self._client
+    
+    def _connect(self):
+        started = time.perf_counter()
+        try:
+            from supabase import create_client
+            client = create_client(SUPABASE_URL, SUPABASE_KEY)
+        except Exception as e:
+            log.error("❌ Ошибка подключения к Supabase: %s", e)
+            self._failed = True
+            return None
+        log.info("✅ Подключение к Supabase установлено (%.2f с)", time.perf_counter() - started)
+        return client
+    
+    def warm(self):
+        """Создает клиент в фоновом потоке, пока бот уже обрабатывает обновления"""
+        if self.configured:
+            threading.Thread(target=lambda: self.supabase, name="supabase-warm", daemon=True).start()
+    
+    def is_available(self):
+        # До первого подключения база считается доступной: ошибку покажет _connect
+        return self.configured and not self._failed
     
-    def save_survey_response(self, user_id: int, username: str, answers: dict):
+    @staticmethod
+    def build_survey_row(user_id: int, username: str, answers: dict, submission_id: str):
+        """
+        Готовит строку таблицы survey_responses
+        """
+        return {
+            "user_id": user_id,
+            "username": username,
+            "submission_id": submission_id,
+            "created_at": datetime.now().isoformat(),
+            "answers": json.dumps(answers, ensure_ascii=False)
+        }
+    
+    def save_survey_response(self, user_id: int, username: str, answers: dict, submission_id: str = None):
         """
         Сохраняет ответы пользователя в базу данных
         """
+        row = self.build_survey_row(user_id, username, answers, submission_id or uuid.uuid4().hex)
+        return self.save_survey_responses([row])
+    
+    def save_survey_responses(self, rows: list):
+        """
+        Сохраняет пачку ответов одним запросом.
+        Строки с уже существующей парой (user_id, submission_id) пропускаются.
+        """
         if not self.supabase:
-            print("❌ База данных недоступна")
+            log.error("❌ База данных недоступна")
             return False, "База данных недоступна"
         
+        from postgrest.types import ReturnMethod
         try:
-            # Подготавливаем данные для сохранения
-            survey_data = {
-                "user_id": user_id,
-                "username": username,
-                "created_at": datetime.now().isoformat(),
-                "answers": json.dumps(answers, ensure_ascii=False)
-            }
-            
-            # Сохраняем в таблицу survey_responses
-            result = self.supabase.table("survey_responses").insert(survey_data).execute()
+            self.supabase.table("survey_responses").upsert(
+                rows,
+                on_conflict="user_id,submission_id",
+                ignore_duplicates=True,
+                returning=ReturnMethod.minimal
+            ).execute()
             
-            print(f"✅ Ответы пользователя {user_id} сохранены в базу данных")
+            log.info("✅ Сохранено ответов в базу данных: %s", len(rows))
             return True, "Ответы успешно сохранены"
         except Exception as e:
-            print(f"❌ Ошибка при сохранении: {str(e)}")
+            log.error("❌ Ошибка при сохранении: %s", str(e))
             return False, f"Ошибка при сохранении: {str(e)}"
     
+    def iter_responses(self, **kwargs):
+        """Постранично читает ответы (см. analytics.iter_responses)"""
+        return iter_responses(self.supabase, **kwargs)
+    
     def get_all_responses_count(self):
         """
-        Получает количество всех ответов
+        Получает количество всех ответов (None, если запрос не удался)
         """
         if not self.supabase:
             return 0
         
         try:
-            result = self.supabase.table("survey_responses").select("id", count="exact").execute()
+            result = self.supabase.table("survey_responses").select("id", count="exact").limit(1).execute()
             return result.count if hasattr(result, 'count') else 0
         except Exception as e:
-            print(f"❌ Ошибка при получении количества ответов: {str(e)}")
-            return 0
+            log.error("❌ Ошибка при получении количества ответов: %s", str(e))
+            return None
+
+def create_database_manager(warm=True):
+    """Менеджер базы по DB_CLIENT; клиент прогревается в фоне (warm=False — при первом запросе)"""
+    if DB_CLIENT == 'async':
+        db = AsyncDatabaseManager(SUPABASE_URL, SUPABASE_KEY)
+        breaker = db.breaker
+        metrics.REGISTRY.gauge("bot_db_circuit_open", "Автомат Supabase разомкнут (1) или нет (0)",
+                               lambda: 0 if breaker.state == "closed" else 1)
+        metrics.REGISTRY.gauge("bot_db_rejected", "Запросы к базе, отклоненные разомкнутым автоматом",
+                               lambda: breaker.rejected)
+    else:
+        db = DatabaseManager()
+    if warm:
+        db.warm()
+    return db
 
 class HealthCheckHandler(BaseHTTPRequestHandler):
+    webhook = None  # WebhookReceiver в режиме webhook
+    health = None  # HealthState для /healthz и /readyz
+    results = None  # AnswerTally для /api/summary и /api/question/<id>
+    
     def do_GET(self):
-        print(f"🏥 GET запрос: {self.path}")
-        print(f"🏥 От: {self.client_address[0]}")
-        print(f"🏥 User-Agent: {self.headers.get('User-Agent', 'Unknown')}")
+        log.debug("🏥 GET запрос: %s от %s (%s)", self.path, self.client_address[0],
+                  self.headers.get('User-Agent', 'Unknown'))
+        
+        # Маршрут сравнивается без строки запроса: /readyz?x=1 — это тоже проверка готовности
+        path, _, query = self.path.partition('?')
+        if path == '/metrics':
+            self.send_text(200, metrics.REGISTRY.render(), metrics.CONTENT_TYPE)
+            return
+        
+        if path in ('/healthz', '/readyz'):
+            self.send_health(path == '/readyz')
+            return
+        
+        if path in ('/debug/timings', '/debug/profile'):
+            self.send_debug(path, parse_qs(query))
+            return
+        
+        if path == '/api/summary' or path.startswith('/api/question/'):
+            self.send_results(path)
+            return
         
         self.send_response(200)
         self.send_header('Content-type', 'text/plain')
@@ -233,124 +390,354 @@ class HealthCheckHandler(BaseHTTPRequestHandler):
         response = "Telegram Bot is running! 🤖"
         self.wfile.write(response.encode())
     
+    def do_POST(self):
+        if self.webhook is None:
+            self.send_text(404, "Not found")
+            return
+        
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_SIZE:
+            self.send_text(413, "Payload too large")
+            return
+        
+        body = self.rfile.read(length)
+        status, text = self.webhook.handle_post(self.path, self.headers, body)
+        self.send_text(status, text)
+    
+    def send_health(self, readiness):
+        """200 или 503 с результатами проверок в JSON"""
+        if self.health is None:
+            ok, checks = True, {}
+        else:
+            ok, checks = self.health.ready() if readiness else self.health.live()
+        body = json.dumps({"status": "ok" if ok else "fail", "checks": checks}, ensure_ascii=False)
+        self.send_text(200 if ok else 503, body, 'application/json')
+    
+    def send_debug(self, path, params):
+        """
+        Профилирование по токену PROFILE_TOKEN (заголовок Authorization: Bearer
+        или параметр token). Без токена эндпоинтов как будто нет.
+        """
+        if not PROFILE_TOKEN:
+            self.send_text(404, "Not found")
+            return
+        auth = self.headers.get('Authorization', '')
+        token = auth[7:] if auth.startswith('Bearer ') else params.get('token', [''])[0]
+        if not hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode()):
+            self.send_text(403, "Forbidden")
+            return
+        
+        if path == '/debug/timings':
+            self.send_text(200, json.dumps(PROFILER.report(), ensure_ascii=False), 'application/json')
+            return
+        
+        try:
+            seconds = min(float(params.get('seconds', ['10'])[0]), PROFILE_MAX_SECONDS)
+            interval = float(params.get('interval', ['0.01'])[0])
+        except ValueError:
+            self.send_text(400, "seconds and interval must be numbers")
+            return
+        # Один профиль за раз: два сэмплера мешали бы друг другу
+        if not PROFILE_LOCK.acquire(blocking=False):
+            self.send_text(409, "Profiler is already running")
+            return
+        try:
+            log.info("🔬 Профилирование на %.0f с", seconds)
+            self.send_text(200, sample_stacks(seconds, max(interval, 0.001)))
+        finally:
+            PROFILE_LOCK.release()
+    
+    def send_results(self, path):
+        """
+        Распределение ответов из памяти. Повторный запрос с тем же
+        If-None-Match получает 304 без тела.
+        """
+        if self.results is None:
+            self.send_text(503, "Starting")
+            return
+        if path == '/api/summary':
+            result = self.results.summary()
+        else:
+            result = self.results.question(path[len('/api/question/'):])
+        if result is None:
+            self.send_text(404, "Not found")
+            return
+        
+        etag, body = result
+        not_modified = etag in (tag.strip() for tag in self.headers.get('If-None-Match', '').split(','))
+        self.send_response(304 if not_modified else 200)
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', f'public, max-age={API_CACHE_MAX_AGE}')
+        if not not_modified:
+            self.send_header('Content-type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not not_modified:
+            self.wfile.write(body)
+    
+    def send_text(self, status, text, content_type='text/plain'):
+        data = text.encode()
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
     def log_message(self, format, *args):
-        print(f"📝 {format % args}")
+        log.debug("📝 %s", format % args)
+
+def bind_health_server():
+    """Занимает порт health check; вызывается до создания бота, чтобы порт слушался сразу"""
+    port = int(os.getenv('PORT', 8080))
+    log.info("🔧 Запуск health check сервера на порту %s", port)
+    log.debug("🔧 Переменные окружения:")
+    for key, value in os.environ.items():
+        if key in ['PORT', 'RAILWAY_ENVIRONMENT', 'RAILWAY_PROJECT_ID', 'TELEGRAM_TOKEN', 'SUPABASE_URL']:
+            log.debug("   %s=%s", key, value[:10] + '...' if len(value) > 10 else value)
+    
+    # Потоковый сервер: медленный клиент не блокирует webhook и проверки
+    server = ThreadingHTTPServer(('0.0.0.0', port), HealthCheckHandler)
+    log.info("🚀 Health check сервер запущен на порту %s", port)
+    return server
 
-def run_health_server():
+def run_health_server(server=None):
     """Запускает простой HTTP сервер для health check"""
     try:
-        port = int(os.getenv('PORT', 8080))
-        print(f"🔧 Запуск health check сервера на порту {port}")
-        print(f"🔧 Переменные окружения:")
-        for key, value in os.environ.items():
-            if key in ['PORT', 'RAILWAY_ENVIRONMENT', 'RAILWAY_PROJECT_ID', 'TELEGRAM_TOKEN', 'SUPABASE_URL']:
-                print(f"   {key}={value[:10] + '...' if len(value) > 10 else value}")
-        
-        server = HTTPServer(('0.0.0.0', port), HealthCheckHandler)
-        print(f"🚀 Health check сервер запущен на порту {port}")
-        print("📡 Ожидание запросов...")
-        
+        if server is None:
+            server = bind_health_server()
+        log.info("📡 Ожидание запросов...")
         server.serve_forever()
         
     except Exception as e:
-        print(f"❌ Ошибка health check сервера: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ Ошибка health check сервера: %s", e)
+
+def register_delivery_metrics(outbound, writer, journal):
+    """Гейджи /metrics для очереди исходящих и записи ответов в базу"""
+    registry = metrics.REGISTRY
+    registry.gauge(
+        "bot_outbound_queue_depth", "Исходящие сообщения в очереди по приоритетам",
+        lambda: {(name,): depth for name, depth
+                 in outbound.get_metrics()["queue_depth_by_priority"].items()},
+        ("priority",),
+    )
+    registry.gauge("bot_writer_backlog", "Ответы, ожидающие записи в базу", writer.backlog)
+    registry.gauge("bot_journal_pending", "Ответы в журнале без подтверждения базы",
+                   lambda: len(journal.pending))
+
+def register_readiness(health, engine, outbound, writer, get_last_poll_at=None):
+    """Проверки /readyz; get_last_poll_at не передается в режиме webhook"""
+    health.add_readiness("engine", flag_check(engine.is_running))
+    if get_last_poll_at is not None:
+        health.add_readiness("poll_age_seconds", max_age_check(get_last_poll_at, READY_MAX_POLL_AGE))
+    health.add_readiness(
+        "outbound_queue_depth",
+        max_value_check(lambda: outbound.get_metrics()["queue_depth"], READY_MAX_OUTBOUND),
+    )
+    health.add_readiness("writer_backlog", max_value_check(writer.backlog, READY_MAX_BACKLOG))
 
 class FullTelegramBot:
-    def __init__(self, token):
+    def __init__(self, token, outbound=None, writer=None, sessions=None, response_counter=None):
+        """
+        outbound, writer, sessions и response_counter передаются в многопроцессном
+        режиме (shard.py), иначе бот создает их сам.
+        """
         self.token = token
-        self.base_url = f"https://api.telegram.org/bot{token}"
+        self.api = TelegramAPI(token)  # Общий пул соединений к Bot API
         self.offset = 0
-        self.user_states = {}  # Состояния пользователей
-        self.user_answers = {}  # Ответы пользователей
-        self.user_info = {}  # Информация о пользователях
-        self.db = DatabaseManager()  # Менеджер базы данных
+        if writer is None:
+            self.db = create_database_manager()  # Менеджер базы данных
+            # Счетчик ответов для /stats: растет после каждой записи, периодически сверяется с базой
+            response_counter = ResponseCounter(self.db)
+            response_counter.start()
+        else:
+            # В процессе-обработчике запись, счетчик и распределение ответов — у супервизора,
+            # клиент базы создается только для /report
+            self.db = None
+        self.response_counter = response_counter
+        self.funnel = SurveyFunnel([q.key for q in SURVEY.questions + SURVEY.additional])
+        # Незавершенные опросы (переживают перезапуск)
+        self.sessions = sessions if sessions is not None else create_session_store()
+        self.sessions.start_eviction()
+        
+        self.journal = None
+        self.tally = None  # Распределение ответов для /api (в многопроцессном режиме — у супервизора)
+        if outbound is None:
+            outbound = OutboundScheduler(self.api)  # Очередь исходящих с учетом лимитов
+            outbound.start()
+        if writer is None:
+            self.journal = ResponseJournal()  # Локальный журнал ответов на случай сбоя базы
+            self.tally = AnswerTally(QUESTIONS)
+            writer = SurveyWriter(  # Фоновая запись ответов пачками
+                self.db, self.journal, on_saved=self.response_counter.on_saved,
+                on_submit=self.tally.record,
+            )
+            writer.start()
+            # Загрузка из базы — после повтора журнала, иначе строка из него учлась бы дважды или ни разу
+            self.tally.start(self.db)
+            register_delivery_metrics(outbound, writer, self.journal)
+        self.outbound = outbound
+        self.writer = writer
+        self.log_sampler = Sampler()  # Выборочное логирование входящих сообщений
+        self.last_poll_at = None  # Время последнего успешного getUpdates
+        self.inline_markups = {}  # chat_id -> (message_id, клавиатура) последней правки
+        self.reminders = None  # ReminderScheduler, подключается вместе с движком
+        self.register_metrics()
     
-    def send_message(self, chat_id, text, reply_markup=None):
-        """Отправляет сообщение в Telegram"""
-        try:
-            url = f"{self.base_url}/sendMessage"
-            data = {
-                "chat_id": chat_id,
-                "text": text,
-                "parse_mode": "HTML"
-            }
-            if reply_markup:
-                data["reply_markup"] = reply_markup
-            
-            response = requests.post(url, json=data)
-            if response.status_code == 200:
-                print(f"✅ Сообщение отправлено в {chat_id}")
-            else:
-                print(f"❌ Ошибка отправки: {response.text}")
-        except Exception as e:
-            print(f"❌ Ошибка отправки сообщения: {e}")
+    def register_metrics(self):
+        """Гейджи /metrics, которые считаются в момент запроса"""
+        registry = metrics.REGISTRY
+        registry.gauge("bot_active_sessions", "Незавершенные опросы", lambda: len(self.sessions))
+        registry.gauge(
+            "bot_poll_age_seconds", "Время с последнего успешного getUpdates",
+            lambda: None if self.last_poll_at is None else round(time.time() - self.last_poll_at, 3),
+        )
     
-    def create_keyboard(self, options, question_type="single_choice"):
-        """Создает клавиатуру для ответов"""
-        keyboard = []
-        
-        if question_type == "single_choice":
-            for i, option in enumerate(options, 1):
-                keyboard.append([{"text": f"{i}. {option}"}])
-        elif question_type == "multiple_choice":
-            for i, option in enumerate(options, 1):
-                keyboard.append([{"text": f"{i}. {option}"}])
-            keyboard.append([{"text": "✅ Завершити вибір"}])
-        
-        return {
-            "keyboard": keyboard,
-            "resize_keyboard": True,
-            "one_time_keyboard": True
+    @timed("send_message")
+    def send_message(self, chat_id, text, reply_markup=None, priority=PRIORITY_NORMAL, coalesce_key=None):
+        """
+        Ставит сообщение в очередь отправки в Telegram. Еще не отправленное
+        сообщение с тем же coalesce_key заменяется новым (серии одинаковых ответов).
+        """
+        data = {
+            "chat_id": chat_id,
+            "text": text,
+            "parse_mode": "HTML"
         }
+        if reply_markup:
+            data["reply_markup"] = reply_markup
+        
+        self.outbound.submit(chat_id, "sendMessage", data, priority, coalesce_key=coalesce_key)
     
     def get_updates(self):
-        """Получает обновления от Telegram"""
-        try:
-            url = f"{self.base_url}/getUpdates"
-            params = {
-                "offset": self.offset,
-                "timeout": 30
-            }
-            response = requests.get(url, params=params)
-            if response.status_code == 200:
-                data = response.json()
-                if data.get("ok") and data.get("result"):
-                    for update in data["result"]:
-                        self.handle_update(update)
-                        self.offset = update["update_id"] + 1
-        except Exception as e:
-            print(f"❌ Ошибка получения обновлений: {e}")
+        """Получает обновления от Telegram (long polling) и сдвигает offset"""
+        params = {
+            "offset": self.offset,
+            "timeout": POLL_TIMEOUT
+        }
+        # Таймаут чтения должен быть больше времени long polling
+        updates = self.api.call("getUpdates", params, timeout=POLL_TIMEOUT + self.api.read_timeout)
+        self.last_poll_at = time.time()
+        if updates:
+            self.offset = updates[-1]["update_id"] + 1
+        return updates
     
     def handle_update(self, update):
-        """Обрабатывает обновление от Telegram"""
-        if "message" in update:
+        """Обрабатывает обновление от Telegram (с разбором времени для профилировщика)"""
+        chat_id = update_chat_id(update)
+        session = self.sessions.get(chat_id) if chat_id is not None else None
+        if session is None:
+            phase = "none"
+        else:
+            phase = f"{session.phase}:{session.current_question}" + (":other" if session.waiting_for_other else "")
+        PROFILER.begin(update_type(update), phase)
+        try:
+            self._handle_update(update)
+        finally:
+            PROFILER.end()
+    
+    def _handle_update(self, update):
+        if "callback_query" in update:
+            callback = update["callback_query"]
+            chat_id = update_chat_id(update)
+            username = callback.get("from", {}).get("username", "")
+            self.handle_callback(chat_id, callback)
+        elif "message" in update:
             message = update["message"]
             chat_id = message["chat"]["id"]
             text = message.get("text", "")
             
-            # Сохраняем информацию о пользователе
-            if chat_id not in self.user_info:
-                self.user_info[chat_id] = {
-                    "username": message.get("from", {}).get("username", ""),
-                    "first_name": message.get("from", {}).get("first_name", ""),
-                    "last_name": message.get("from", {}).get("last_name", "")
-                }
+            username = message.get("from", {}).get("username", "")
             
-            print(f"📨 Получено сообщение от {chat_id}: {text}")
+            # Текст ответа пишется только на DEBUG, на INFO — каждое N-е сообщение
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("📨 Получено сообщение от %s: %s", chat_id, text)
+            elif self.log_sampler():
+                log.info("📨 Получено сообщение от %s (каждое %s-е)", chat_id, self.log_sampler.every)
             
             if text == "/start":
-                self.start_survey(chat_id)
+                self.start_survey(chat_id, username)
             elif text == "/stats":
                 self.show_stats(chat_id)
+            elif text.startswith("/report") and chat_id in ADMIN_CHAT_IDS:
+                self.show_report(chat_id, text.split()[1:])
             else:
                 self.handle_answer(chat_id, text)
+        elif "reminder" in update:
+            self.send_reminder(update["reminder"])
+            return
+        else:
+            return
+        
+        # Сохраняем изменения сессии один раз на обновление
+        session = self.sessions.get(chat_id)
+        if session is not None:
+            if username and not session.username:
+                session.username = username
+            self.save_session(session)
+    
+    @timed("save_session")
+    def save_session(self, session):
+        self.sessions.save(session)
+        if self.reminders is not None:
+            self.reminders.touch(session)
+    
+    @timed("handle_callback")
+    def handle_callback(self, chat_id, callback):
+        """Обрабатывает нажатие inline кнопки варианта"""
+        message = callback.get("message")
+        parsed = SURVEY.parse_callback(callback.get("data"))
+        session = self.sessions.get(chat_id)
+        
+        # Кнопка с уже пройденного вопроса или из завершенного опроса
+        if (message is None or parsed is None or session is None or session.phase != PHASE_MAIN
+                or session.waiting_for_other
+                or SURVEY.questions[session.current_question] is not parsed[0]):
+            self.answer_callback(callback["id"], "Це питання вже закрите")
+            return
+        
+        # Telegram показывает часы на кнопке, пока не получит ответ
+        self.answer_callback(callback["id"])
+        question, option_index = parsed
+        message_id = message["message_id"]
+        
+        if option_index is None:
+            self.edit_reply_markup(chat_id, message_id, question.inline_keyboard(
+                session.choices.get(question.index, 0), question.index in session.others, final=True
+            ))
+            self.finish_multiple_choice(chat_id)
+            return
+        if question.type == 'single_choice' and option_index != question.other_index:
+            self.edit_reply_markup(chat_id, message_id, question.inline_keyboard(1 << option_index, final=True))
+        self.process_answer(chat_id, question.options[option_index], option_index, message_id)
+    
+    @timed("answer_callback")
+    def answer_callback(self, callback_id, text=None):
+        params = {"callback_query_id": callback_id}
+        if text:
+            params["text"] = text
+        # Отдельная очередь: ответ на нажатие не ждет сообщений чата
+        self.outbound.submit(callback_id, "answerCallbackQuery", params, PRIORITY_HIGH)
+    
+    @timed("edit_reply_markup")
+    def edit_reply_markup(self, chat_id, message_id, reply_markup):
+        """
+        Меняет inline клавиатуру отправленного сообщения.
+        Правка к уже запрошенному виду пропускается, а еще не отправленная
+        правка того же сообщения заменяется новой (двойные нажатия).
+        """
+        if self.inline_markups.get(chat_id) == (message_id, reply_markup):
+            return
+        self.inline_markups[chat_id] = (message_id, reply_markup)
+        data = {"chat_id": chat_id, "message_id": message_id, "reply_markup": reply_markup}
+        self.outbound.submit(chat_id, "editMessageReplyMarkup", data, PRIORITY_HIGH,
+                             coalesce_key=("edit", message_id))
     
-    def start_survey(self, chat_id):
+    @timed("start_survey")
+    def start_survey(self, chat_id, username=""):
         """Начинает опрос"""
-        self.user_states[chat_id] = {"current_question": 0, "phase": "main"}
-        self.user_answers[chat_id] = {}
+        # submission_id отличает повторные прохождения и делает запись идемпотентной
+        self.sessions.save(Session(chat_id, uuid.uuid4().hex, username))
+        self.funnel.record_start()
         
         welcome_text = """
 🤖 Привіт! Я бот для збору відповідей на питання про пошук розваг та активностей.
@@ -364,351 +751,483 @@ class FullTelegramBot:
 Готові почати опитування? Натисніть кнопку нижче!
         """
         
-        keyboard = {
-            "keyboard": [[{"text": "🚀 Почати опитування"}]],
-            "resize_keyboard": True
-        }
-        
-        self.send_message(chat_id, welcome_text, keyboard)
+        self.send_message(chat_id, welcome_text, START_KEYBOARD)
     
+    @timed("handle_answer")
     def handle_answer(self, chat_id, text):
         """Обрабатывает ответ пользователя"""
-        if chat_id not in self.user_states:
-            self.send_message(chat_id, "Використайте /start для початку опитування.")
+        session = self.sessions.get(chat_id)
+        if session is None:
+            self.send_message(chat_id, "Використайте /start для початку опитування.", coalesce_key="hint")
             return
         
-        state = self.user_states[chat_id]
+        # Кнопка варианта текущего вопроса находится одним поиском в словаре
+        option_index = None
+        if session.phase == PHASE_MAIN:
+            option_index = SURVEY.lookup(session.current_question, text)
         
-        if text == "🚀 Почати опитування":
+        if text == START_BUTTON:
             self.send_question(chat_id)
-        elif text == "✅ Завершити вибір":
+        elif text == FINISH_CHOICE_BUTTON:
             self.finish_multiple_choice(chat_id)
-        elif text == "↩ Назад до варіантів":
+        elif text == BACK_BUTTON:
             # Возвращаемся к вариантам ответов
-            if "waiting_for_other" in state and state["waiting_for_other"]:
-                state["waiting_for_other"] = False
+            if session.waiting_for_other:
+                session.waiting_for_other = False
+                session.other_question = None
                 self.send_question(chat_id)
-        elif (text.startswith("1.") or text.startswith("2.") or text.startswith("3.") or text.startswith("4.") or text.startswith("5.") or text.startswith("6.") or 
-              text.startswith("☑ 1.") or text.startswith("☑ 2.") or text.startswith("☑ 3.") or text.startswith("☑ 4.") or text.startswith("☑ 5.") or text.startswith("☑ 6.") or
-              text.startswith("☐ 1.") or text.startswith("☐ 2.") or text.startswith("☐ 3.") or text.startswith("☐ 4.") or text.startswith("☐ 5.") or text.startswith("☐ 6.")):
-            self.process_answer(chat_id, text)
-        elif state.get("waiting_for_other", False):
+        elif option_index is not None:
+            self.process_answer(chat_id, text, option_index)
+        elif session.waiting_for_other:
             # Обрабатываем ввод текста для "Інше"
             self.process_other_answer(chat_id, text)
-        elif state["phase"] == "main" and QUESTIONS[state["current_question"]]["type"] == "text":
+        elif SURVEY.is_option_button(text):
+            # Кнопка со старой клавиатуры другого вопроса: показываем текущий вопрос заново
+            self.send_question(chat_id)
+        elif session.phase == PHASE_MAIN and SURVEY.questions[session.current_question].type == "text":
             # Обрабатываем текстовый ответ в основной части
             self.process_answer(chat_id, text)
-        elif state["phase"] == "additional":
+        elif session.phase == PHASE_ADDITIONAL:
             self.process_text_answer(chat_id, text)
         else:
-            self.send_message(chat_id, "Будь ласка, використайте кнопки для відповіді.")
+            self.send_message(chat_id, "Будь ласка, використайте кнопки для відповіді.", coalesce_key="hint")
     
-    def send_question(self, chat_id):
+    @timed("send_reminder")
+    def send_reminder(self, reminder):
+        """Напоминает о брошенном опросе и повторяет текущий вопрос (см. reminders.py)"""
+        chat_id = reminder["chat_id"]
+        session = self.sessions.get(chat_id)
+        # Пользователь мог ответить, пока напоминание ждало в очереди чата
+        if session is None or session.updated_at != reminder["updated_at"]:
+            return
+        session.reminders += 1
+        # Как кнопка "Назад": вместо ввода своего варианта снова показываем варианты
+        session.waiting_for_other = False
+        session.other_question = None
+        
+        self.send_message(chat_id, "👋 Ви не завершили опитування. Продовжимо з того ж питання?",
+                          priority=PRIORITY_LOW)
+        question = None
+        if session.phase == PHASE_MAIN and session.current_question < len(SURVEY.questions):
+            question = SURVEY.questions[session.current_question]
+        if question is not None and question.type == 'multiple_choice' and session.choices.get(question.index):
+            # Уже отмеченные варианты показываем с галочками
+            mask = session.choices[question.index]
+            if KEYBOARD_MODE == 'inline':
+                keyboard = question.inline_keyboard(mask, question.index in session.others)
+            else:
+                keyboard = question.toggle_keyboard(mask, question.index in session.others)
+            self.send_message(chat_id, question.text, keyboard, PRIORITY_LOW)
+        else:
+            self.send_question(chat_id, PRIORITY_LOW)
+        # Напоминание — не активность пользователя: время бездействия не сбрасывается
+        self.sessions.save(session, touch=False)
+        self.reminders.touch(session)
+    
+    @timed("send_question")
+    def send_question(self, chat_id, priority=PRIORITY_HIGH):
         """Отправляет текущий вопрос"""
-        state = self.user_states[chat_id]
-        current_question = state["current_question"]
-        
-        if state["phase"] == "main":
-            if current_question < len(QUESTIONS):
-                question_data = QUESTIONS[current_question]
-                question_text = f"❓ {question_data['question']}"
-                
-                if question_data['type'] == 'text':
-                    # Для текстовых вопросов показываем кнопку "Пропустить"
-                    keyboard = {
-                        "keyboard": [[{"text": "⏭ Пропустити"}]],
-                        "resize_keyboard": True
-                    }
+        session = self.sessions.get(chat_id)
+        current_question = session.current_question
+        
+        if session.phase == PHASE_MAIN:
+            if current_question < len(SURVEY.questions):
+                # Текст и клавиатура вопроса подготовлены заранее
+                question = SURVEY.questions[current_question]
+                if KEYBOARD_MODE == 'inline' and question.type != 'text':
+                    keyboard = question.inline_keyboard()
                 else:
-                    keyboard = self.create_keyboard(question_data['options'], question_data['type'])
-                
-                self.send_message(chat_id, question_text, keyboard)
+                    keyboard = question.keyboard
+                self.send_message(chat_id, question.text, keyboard, priority)
             else:
                 # Переходим к дополнительным вопросам
-                state["phase"] = "additional"
-                state["current_question"] = 0
-                self.send_additional_question(chat_id)
-        elif state["phase"] == "additional":
-            if current_question < len(ADDITIONAL_QUESTIONS):
-                self.send_additional_question(chat_id)
+                session.phase = PHASE_ADDITIONAL
+                session.current_question = 0
+                self.send_additional_question(chat_id, priority)
+        elif session.phase == PHASE_ADDITIONAL:
+            if current_question < len(SURVEY.additional):
+                self.send_additional_question(chat_id, priority)
             else:
                 self.finish_survey(chat_id)
     
-    def send_additional_question(self, chat_id):
+    @timed("send_additional_question")
+    def send_additional_question(self, chat_id, priority=PRIORITY_HIGH):
         """Отправляет дополнительный вопрос"""
-        state = self.user_states[chat_id]
-        current_question = state["current_question"]
-        question_data = ADDITIONAL_QUESTIONS[current_question]
-        
-        question_text = f"📝 {question_data['question']}"
-        keyboard = {
-            "keyboard": [[{"text": "⏭ Пропустити"}]],
-            "resize_keyboard": True
-        }
-        
-        self.send_message(chat_id, question_text, keyboard)
+        session = self.sessions.get(chat_id)
+        question = SURVEY.additional[session.current_question]
+        self.send_message(chat_id, question.text, question.keyboard, priority)
     
-    def process_answer(self, chat_id, text):
-        """Обрабатывает ответ на вопрос"""
-        state = self.user_states[chat_id]
-        current_question = state["current_question"]
+    @timed("process_answer")
+    def process_answer(self, chat_id, text, option_index=None, message_id=None):
+        """
+        Обрабатывает ответ на вопрос основной части (текст или индекс варианта).
+        message_id — сообщение с inline клавиатурой, если ответ пришел нажатием кнопки.
+        """
+        session = self.sessions.get(chat_id)
+        current_question = session.current_question
+        question = SURVEY.questions[current_question]
         
-        if state["phase"] == "main":
-            question_data = QUESTIONS[current_question]
-            
-            if question_data['type'] == 'text':
-                # Обрабатываем текстовый вопрос
-                if text == "⏭ Пропустити":
-                    pass  # Пропускаем вопрос
-                else:
-                    self.user_answers[chat_id][f"q{question_data['id']}"] = text
-                
-                state["current_question"] += 1
-                self.send_question(chat_id)
-                return
-            
-            # Извлекаем номер опции, убирая возможные символы галочек
-            clean_text = text.replace("☑ ", "").replace("☐ ", "")
-            answer_index = int(clean_text.split(".")[0]) - 1
-            
-            if answer_index < len(question_data['options']):
-                selected_answer = question_data['options'][answer_index]
-                
-                print(f"🔍 Обработка ответа: {text} -> {selected_answer}")
-                
-                # Проверяем, выбрал ли пользователь "Інше"
-                if selected_answer == "Інше":
-                    # Переводим в режим ввода текста для "Інше"
-                    state["waiting_for_other"] = True
-                    state["current_question_id"] = question_data['id']
-                    state["question_type"] = question_data['type']
-                    
-                    keyboard = {
-                        "keyboard": [[{"text": "↩ Назад до варіантів"}]],
-                        "resize_keyboard": True
-                    }
-                    
-                    self.send_message(chat_id, "📝 Будь ласка, введіть ваш варіант відповіді:", keyboard)
-                    return
-                
-                if question_data['type'] == 'single_choice':
-                    self.user_answers[chat_id][f"q{question_data['id']}"] = selected_answer
-                    state["current_question"] += 1
-                    self.send_question(chat_id)
-                elif question_data['type'] == 'multiple_choice':
-                    question_key = f"q{question_data['id']}"
-                    if question_key not in self.user_answers[chat_id]:
-                        self.user_answers[chat_id][question_key] = []
-                    
-                    current_answers = self.user_answers[chat_id][question_key]
-                    print(f"📊 Текущие ответы для вопроса {question_data['id']}: {current_answers}")
-                    print(f"🎯 Выбранный ответ: {selected_answer}")
-                    print(f"🔍 Тип current_answers: {type(current_answers)}")
-                    
-                    if selected_answer in current_answers:
-                        current_answers.remove(selected_answer)
-                        print(f"❌ Удален ответ: {selected_answer}")
-                    else:
-                        current_answers.append(selected_answer)
-                        print(f"✅ Добавлен ответ: {selected_answer}")
-                    
-                    print(f"📊 Обновленные ответы: {self.user_answers[chat_id][question_key]}")
-                    
-                    # Обновляем клавиатуру
-                    self.update_multiple_choice_keyboard(chat_id, question_data)
-    
-    def update_multiple_choice_keyboard(self, chat_id, question_data):
-        """Обновляет клавиатуру для множественного выбора"""
-        question_key = f"q{question_data['id']}"
-        current_answers = self.user_answers[chat_id].get(question_key, [])
-        
-        print(f"🔄 Обновление клавиатуры для вопроса {question_data['id']}")
-        print(f"📊 Ключ вопроса: {question_key}")
-        print(f"📊 Текущие ответы: {current_answers}")
-        print(f"🔍 Тип current_answers: {type(current_answers)}")
-        print(f"🔍 Все ответы пользователя: {self.user_answers[chat_id]}")
-        
-        keyboard = []
-        for i, option in enumerate(question_data['options'], 1):
-            # Проверяем, выбрана ли опция
-            is_selected = option in current_answers
-            
-            # Если это опция "Інше", проверяем также наличие ответов "Інше:"
-            if option == "Інше":
-                has_other_answer = any(answer.startswith("Інше:") for answer in current_answers if isinstance(answer, str))
-                is_selected = is_selected or has_other_answer
-            
-            button_text = f"☑ {i}. {option}" if is_selected else f"☐ {i}. {option}"
-            keyboard.append([{"text": button_text}])
+        if question.type == 'text':
+            # Обрабатываем текстовый вопрос
+            if text == SKIP_BUTTON:
+                pass  # Пропускаем вопрос
+            else:
+                session.texts[question.key] = text
             
-            print(f"   {i}. {option}: {'☑' if is_selected else '☐'} (в списке: {option in current_answers})")
+            self.advance(session)
+            self.send_question(chat_id)
+            return
         
-        keyboard.append([{"text": "✅ Завершити вибір"}])
+        log.debug("🔍 Обработка ответа: %s -> %s", text, question.options[option_index])
         
-        reply_markup = {
-            "keyboard": keyboard,
-            "resize_keyboard": True
-        }
+        # Проверяем, выбрал ли пользователь "Інше"
+        if option_index == question.other_index:
+            # Переводим в режим ввода текста для "Інше"
+            session.waiting_for_other = True
+            session.other_question = current_question
+            self.send_message(chat_id, "📝 Будь ласка, введіть ваш варіант відповіді:", BACK_KEYBOARD, PRIORITY_HIGH)
+            return
         
-        question_text = f"❓ {question_data['question']}"
-        self.send_message(chat_id, question_text, reply_markup)
+        if question.type == 'single_choice':
+            session.choices[current_question] = option_index
+            self.advance(session)
+            self.send_question(chat_id)
+        elif question.type == 'multiple_choice':
+            # Выбранные варианты хранятся битовой маской
+            session.toggle_choice(current_question, option_index)
+            
+            # Обновляем клавиатуру
+            self.update_multiple_choice_keyboard(chat_id, question, message_id)
+    
+    @timed("update_multiple_choice_keyboard")
+    def update_multiple_choice_keyboard(self, chat_id, question, message_id=None):
+        """Обновляет клавиатуру для множественного выбора"""
+        session = self.sessions.get(chat_id)
+        mask = session.choices.get(question.index, 0)
+        if message_id is not None:
+            # Inline клавиатура правится на месте, без нового сообщения
+            keyboard = question.inline_keyboard(mask, question.index in session.others)
+            self.edit_reply_markup(chat_id, message_id, keyboard)
+            return
+        keyboard = question.toggle_keyboard(mask, question.index in session.others)
+        # Пока прошлая клавиатура не ушла, серия нажатий заменяет ее последней
+        self.send_message(chat_id, question.text, keyboard, PRIORITY_HIGH,
+                          coalesce_key=("keyboard", question.index))
+    
+    def advance(self, session):
+        """Засчитывает ответ на текущий вопрос и переходит к следующему"""
+        step = session.current_question
+        if session.phase == PHASE_ADDITIONAL:
+            step += len(SURVEY.questions)
+        self.funnel.record_answer(step)
+        session.current_question += 1
+        self.inline_markups.pop(session.chat_id, None)
     
+    @timed("finish_multiple_choice")
     def finish_multiple_choice(self, chat_id):
         """Завершает множественный выбор"""
-        state = self.user_states[chat_id]
-        state["current_question"] += 1
+        session = self.sessions.get(chat_id)
+        self.advance(session)
         self.send_question(chat_id)
     
+    @timed("process_other_answer")
     def process_other_answer(self, chat_id, text):
         """Обрабатывает ввод текста для опции 'Інше'"""
-        state = self.user_states[chat_id]
-        question_id = state["current_question_id"]
-        question_type = state["question_type"]
+        session = self.sessions.get(chat_id)
         
         # Сохраняем введенный текст
-        if question_type == 'single_choice':
-            self.user_answers[chat_id][f"q{question_id}"] = f"Інше: {text}"
-        elif question_type == 'multiple_choice':
-            if f"q{question_id}" not in self.user_answers[chat_id]:
-                self.user_answers[chat_id][f"q{question_id}"] = []
-            self.user_answers[chat_id][f"q{question_id}"].append(f"Інше: {text}")
+        session.others[session.other_question] = text
         
         # Очищаем состояние ожидания
-        state["waiting_for_other"] = False
-        if "current_question_id" in state:
-            del state["current_question_id"]
-        if "question_type" in state:
-            del state["question_type"]
+        session.waiting_for_other = False
+        session.other_question = None
         
         # Переходим к следующему вопросу
-        state["current_question"] += 1
+        self.advance(session)
         self.send_question(chat_id)
     
+    @timed("process_text_answer")
     def process_text_answer(self, chat_id, text):
         """Обрабатывает текстовый ответ"""
-        state = self.user_states[chat_id]
-        current_question = state["current_question"]
-        question_data = ADDITIONAL_QUESTIONS[current_question]
+        session = self.sessions.get(chat_id)
+        question = SURVEY.additional[session.current_question]
         
-        if text == "⏭ Пропустити":
+        if text == SKIP_BUTTON:
             pass
         else:
-            self.user_answers[chat_id][question_data['id']] = text
+            session.texts[question.key] = text
         
-        state["current_question"] += 1
+        self.advance(session)
         self.send_question(chat_id)
     
+    @timed("finish_survey")
     def finish_survey(self, chat_id):
         """Завершает опрос и сохраняет в базу данных"""
         # Сохраняем ответы в базу данных
-        username = self.user_info.get(chat_id, {}).get("username", "")
-        if not username:
-            username = f"user_{chat_id}"
+        session = self.sessions.get(chat_id)
+        username = session.username or f"user_{chat_id}"
+        answers = session.build_answers(QUESTIONS, ADDITIONAL_QUESTIONS)
         
-        success, message = self.db.save_survey_response(chat_id, username, self.user_answers[chat_id])
+        row = DatabaseManager.build_survey_row(chat_id, username, answers, session.submission_id)
+        # Ответ сначала попадает в локальный журнал, запись в базу идет в фоне,
+        # поэтому пользователю сообщаем, что ответы приняты, а не сохранены
+        status = self.writer.submit(row)
         
-        if success:
+        if status == SUBMIT_QUEUED:
             finish_text = """
 🎉 Дякуємо за участь в опитуванні!
 
-✅ Ваші відповіді успішно збережені в базу даних.
+✅ Ваші відповіді прийнято.
 📊 Це допоможе нам створити кращий сервіс для пошуку розваг та активностей.
 
 Бот працює на Railway! 🚂
             """
-        else:
+        elif status == SUBMIT_LOCAL:
             finish_text = """
 🎉 Дякуємо за участь в опитуванні!
 
 ⚠️ Ваші відповіді збережені локально, але виникла проблема з базою даних.
 📊 Ми все одно використаємо ваші відповіді для аналізу.
 
+Бот працює на Railway! 🚂
+            """
+        else:
+            log.error("❌ Ответы пользователя %s не удалось надежно сохранить (submission %s)",
+                      chat_id, session.submission_id)
+            finish_text = """
+🎉 Дякуємо за участь в опитуванні!
+
+⚠️ Під час збереження ваших відповідей виникла помилка, вони можуть не потрапити до результатів.
+Вибачте за незручності.
+
 Бот працює на Railway! 🚂
             """
         
         # Очищаем состояние пользователя
-        if chat_id in self.user_states:
-            del self.user_states[chat_id]
-        if chat_id in self.user_answers:
-            del self.user_answers[chat_id]
-        
-        keyboard = {
-            "keyboard": [[{"text": "🏠 Головна"}]],
-            "resize_keyboard": True
-        }
+        self.sessions.delete(chat_id)
+        self.funnel.record_complete()
         
-        self.send_message(chat_id, finish_text, keyboard)
-        print(f"📊 Опрос завершен для пользователя {chat_id}")
+        self.send_message(chat_id, finish_text, HOME_KEYBOARD)
+        log.info("📊 Опрос завершен для пользователя %s", chat_id)
     
+    @timed("show_stats")
     def show_stats(self, chat_id):
         """Показывает статистику"""
-        db_count = self.db.get_all_responses_count()
-        active_surveys = len(self.user_states)
+        db_count = self.response_counter.value
+        active_surveys = len(self.sessions)
+        funnel = self.funnel.snapshot()
         
+        funnel_lines = "\n".join(
+            f"   {step['question']}: {step['answered']} ✅ / {step['dropped']} ↘️"
+            for step in funnel["steps"]
+        )
         stats_text = f"""
 📊 Статистика опитування:
 
 🗄️ Всього відповідей в базі даних: {db_count}
 🔄 Активних опросів: {active_surveys}
 
+📈 З моменту запуску: почали {funnel['started']}, завершили {funnel['completed']}
+Відповіли на питання / вибули або ще відповідають:
+{funnel_lines}
+
 Бот працює на Railway! 🚂
         """
-        self.send_message(chat_id, stats_text)
+        self.send_message(chat_id, stats_text, priority=PRIORITY_LOW)
+    
+    def report_db(self):
+        """Менеджер базы для /report (в процессе-обработчике создается при первом отчете)"""
+        if self.db is None:
+            self.db = create_database_manager(warm=False)
+        return self.db
+    
+    @timed("show_report")
+    def show_report(self, chat_id, args):
+        """Строит аналитический отчет по базе в фоне: /report [q2] [city|age]"""
+        db = self.report_db()
+        if not db.is_available():
+            self.send_message(chat_id, "⚠️ База даних недоступна.", priority=PRIORITY_LOW)
+            return
+        
+        # Отчет строится только по вопросам с вариантами, которые считает SurveyColumns
+        choices = list(SurveyColumns(QUESTIONS).questions)
+        unknown = [arg for arg in args if arg not in choices and arg not in ("city", "age")]
+        if unknown:
+            self.send_message(
+                chat_id,
+                f"⚠️ Невідомий параметр: {unknown[0]}\n"
+                f"Питання: {', '.join(choices)}\nРозріз: city, age",
+                priority=PRIORITY_LOW,
+            )
+            return
+        question = next((arg for arg in args if arg in choices), None)
+        crosstab = next((arg for arg in args if arg in ("city", "age")), None)
+        
+        def build():
+            try:
+                columns = SurveyColumns(QUESTIONS).load(db.iter_responses())
+                report = format_report(columns, crosstab, question)
+            except Exception as e:
+                log.exception("❌ Ошибка построения отчета: %s", e)
+                report = "❌ Не вдалося побудувати звіт."
+            # Длинный отчет разбиваем на несколько сообщений по строкам
+            chunk = ""
+            for line in report.split("\n"):
+                if len(chunk) + len(line) + 1 > MAX_MESSAGE_LENGTH:
+                    self.send_message(chat_id, chunk, priority=PRIORITY_LOW)
+                    chunk = ""
+                chunk += line + "\n"
+            if chunk.strip():
+                self.send_message(chat_id, chunk, priority=PRIORITY_LOW)
+        
+        # Чтение всей таблицы не должно занимать обработчик обновлений
+        threading.Thread(target=build, name="report", daemon=True).start()
 
-def run_telegram_bot():
-    """Запускает Telegram бота"""
+def run_telegram_bot(webhook=None, health=None):
+    """Запускает Telegram бота (long polling или webhook)"""
     token = os.getenv('TELEGRAM_TOKEN')
     if not token:
-        print("❌ TELEGRAM_TOKEN не найден")
+        log.error("❌ TELEGRAM_TOKEN не найден")
         return
     
+    if SHARD_WORKERS > 1:
+        run_sharded_bot(token, webhook, health)
+        return
+    
+    collect_sessions(1)
     bot = FullTelegramBot(token)
-    print("🤖 Полнофункциональный Telegram бот запущен")
+    # Позиция getUpdates и недавно обработанные обновления переживают перезапуск
+    checkpoint = UpdateCheckpoint()
+    bot.offset = checkpoint.offset
+    guard = FloodGuard(bot.outbound.queue_depth)
+    engine = UpdateEngine(bot, checkpoint=checkpoint, guard=guard)
+    metrics.REGISTRY.gauge("bot_overload_mode", "1, пока команды вне опроса отбрасываются",
+                           lambda: int(guard.overloaded))
+    bot.reminders = ReminderScheduler(
+        bot.sessions, engine.submit, lambda: not engine.is_running() or engine.is_overloaded()
+    ).start()
+    HealthCheckHandler.results = bot.tally
+    if health is not None:
+        register_readiness(health, engine, bot.outbound, bot.writer,
+                           None if webhook else lambda: bot.last_poll_at)
+    log.info("🤖 Полнофункциональный Telegram бот запущен")
     
     try:
-        while True:
-            bot.get_updates()
-            time.sleep(1)
+        if webhook:
+            webhook.attach(engine)
+            webhook.register(bot.api)
+            asyncio.run(engine.run(poll=False))
+        else:
+            # getUpdates не работает, пока у бота зарегистрирован webhook
+            bot.api.call("deleteWebhook")
+            asyncio.run(engine.run())
     except KeyboardInterrupt:
-        print("🛑 Telegram бот остановлен")
+        engine.stop()
+        log.info("🛑 Telegram бот остановлен")
+
+def collect_sessions(workers):
+    """Раскладывает сохраненные сессии по файлам процессов (число процессов могло измениться)"""
+    if os.getenv('SESSION_STORE', 'sqlite') == 'sqlite':
+        reshard_sqlite_sessions(os.getenv('SESSION_DB_PATH', 'spool/sessions.db'), workers, shard_for)
+
+def run_sharded_bot(token, webhook=None, health=None):
+    """
+    Многопроцессный режим: обновления принимаются здесь и раскладываются по
+    SHARD_WORKERS процессам, а отправка и запись в базу остаются общими.
+    """
+    api = TelegramAPI(token)
+    outbound = OutboundScheduler(api)
+    outbound.start()
+    db = create_database_manager()
+    journal = ResponseJournal()
+    # Счетчик для /stats ведет супервизор, обработчики читают его из общей памяти
+    response_count = multiprocessing.get_context('spawn').Value('q', 0, lock=False)
+    response_counter = ResponseCounter(db, shared=response_count)
+    response_counter.start()
+    # Завершенные опросы всех процессов проходят через writer супервизора
+    HealthCheckHandler.results = AnswerTally(QUESTIONS)
+    writer = SurveyWriter(db, journal, on_saved=response_counter.on_saved,
+                          on_submit=HealthCheckHandler.results.record)
+    writer.start()
+    HealthCheckHandler.results.start(db)  # После повтора журнала (см. FullTelegramBot)
+    register_delivery_metrics(outbound, writer, journal)
+    
+    collect_sessions(SHARD_WORKERS)
+    checkpoint = UpdateCheckpoint()
+    supervisor = ShardSupervisor(
+        token, FullTelegramBot, outbound, writer, SHARD_WORKERS, db_available=db.is_available(),
+        checkpoint=checkpoint, response_count=response_count,
+    ).start()
+    if health is not None:
+        health.add_liveness("shard_workers", flag_check(supervisor.all_alive))
+        register_readiness(health, supervisor.router, outbound, writer,
+                           None if webhook else lambda: supervisor.last_poll_at)
+    log.info("🤖 Telegram бот запущен в %s процессах", SHARD_WORKERS)
+    
+    try:
+        if webhook:
+            webhook.attach(supervisor.router)
+            webhook.register(api)
+            while True:
+                time.sleep(float(os.getenv('CHECKPOINT_INTERVAL', 1)))
+                checkpoint.save()
+        else:
+            api.call("deleteWebhook")
+            supervisor.poll(api, POLL_TIMEOUT)
+    except KeyboardInterrupt:
+        supervisor.stop()
+        log.info("🛑 Telegram бот остановлен")
 
 def main():
     """Основная функция"""
-    print("🤖 Запуск полнофункционального Telegram бота...")
+    setup_logging()
+    log.info("🤖 Запуск полнофункционального Telegram бота...")
     
     # Проверяем переменные окружения
     telegram_token = os.getenv('TELEGRAM_TOKEN')
     if not telegram_token:
-        print("⚠️ TELEGRAM_TOKEN не установлен, запускаем только health check сервер")
+        log.warning("⚠️ TELEGRAM_TOKEN не установлен, запускаем только health check сервер")
         run_health_server()
         return
     
-    print("✅ TELEGRAM_TOKEN найден")
+    log.info("✅ TELEGRAM_TOKEN найден")
     
     # Проверяем настройки базы данных
     if SUPABASE_URL and SUPABASE_KEY:
-        print("✅ Настройки Supabase найдены")
+        log.info("✅ Настройки Supabase найдены")
     else:
-        print("⚠️ Настройки Supabase не найдены - ответы будут сохраняться только локально")
+        log.warning("⚠️ Настройки Supabase не найдены - ответы будут сохраняться только локально")
+    
+    health = HealthState()
+    HealthCheckHandler.health = health
+    
+    webhook = None
+    if WEBHOOK_URL:
+        webhook = WebhookReceiver(WEBHOOK_URL)
+        HealthCheckHandler.webhook = webhook
+        log.info("✅ Режим webhook")
     
-    # Запускаем health check сервер в отдельном потоке
-    health_thread = threading.Thread(target=run_health_server, daemon=True)
+    # Порт занимается синхронно: он слушает еще до создания бота,
+    # а /readyz отвечает 503, пока бот не зарегистрирует свои проверки
+    health_thread = threading.Thread(target=run_health_server, args=(bind_health_server(),), daemon=True)
     health_thread.start()
     
-    print("🔄 Запуск основного бота...")
+    log.info("🔄 Запуск основного бота...")
     
     # Запускаем Telegram бота в отдельном потоке
-    bot_thread = threading.Thread(target=run_telegram_bot, daemon=True)
+    bot_thread = threading.Thread(target=run_telegram_bot, args=(webhook, health), daemon=True)
     bot_thread.start()
+    # Поток бота завершается только при фатальной ошибке — тогда процесс пора перезапустить
+    health.add_liveness("bot_thread", flag_check(bot_thread.is_alive))
     
-    print("✅ Все компоненты запущены")
+    log.info("✅ Все компоненты запущены")
     
     # Ждем завершения
     try:
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
-        print("🛑 Получен сигнал остановки")
+        log.info("🛑 Получен сигнал остановки")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,91 @@
+"""
+Логирование бота.
+
+Все модули пишут через logging.getLogger(__name__), а setup_logging
+подключает к корневому логгеру QueueHandler: поток обработки только кладет
+запись в очередь, а вывод в stdout делает фоновый QueueListener.
+
+Переменные окружения:
+- LOG_LEVEL — уровень (по умолчанию INFO; отладочные дампы включаются DEBUG);
+- LOG_FORMAT — text или json (одна JSON запись на строку для сборщика логов);
+- LOG_SAMPLE_EVERY — для частых событий пишется каждое N-е.
+"""
+
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+
+# Атрибуты LogRecord, которые не считаются дополнительными полями
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        # Поля, переданные через extra={...}
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class Sampler:
+    """Пропускает каждое every-е событие: if sampler(): log.info(...)"""
+
+    def __init__(self, every=None):
+        self.every = max(1, every or int(os.getenv('LOG_SAMPLE_EVERY', 100)))
+        self._counter = itertools.count()
+
+    def __call__(self):
+        return next(self._counter) % self.every == 0
+
+
+def setup_logging(level=None, fmt=None, stream=None):
+    """Настраивает неблокирующий вывод логов (повторный вызов ничего не меняет)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    level = level or os.getenv('LOG_LEVEL', 'INFO').upper()
+    fmt = fmt or os.getenv('LOG_FORMAT', 'text')
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    if fmt == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(level)
+    # Сторонние библиотеки пишут каждый HTTP запрос на INFO
+    for noisy in ("httpx", "httpcore", "hpack"):
+        logging.getLogger(noisy).setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Дописывает очередь логов (вызывается при выходе)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,104 @@
+"""
+Сохраняемая позиция getUpdates и защита от повторной обработки обновлений.
+
+UpdateCheckpoint помнит update_id последних DEDUP_WINDOW обработанных
+обновлений (кольцевой буфер и множество) и обновления, которые сейчас в
+работе. Повторно доставленное обновление — после перезапуска, повтора
+webhook или падения посреди пачки — отбрасывается.
+
+После каждой пачки в CHECKPOINT_PATH атомарно записываются безопасный
+offset (первое еще не обработанное обновление) и список обработанных
+update_id. После перезапуска long polling продолжает с этого offset, а
+обновления, обработанные до падения, становятся no-op.
+"""
+
+import json
+import logging
+import os
+import threading
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+
+class UpdateCheckpoint:
+    def __init__(self, path=None, window=None):
+        self.path = path or os.getenv('CHECKPOINT_PATH', 'spool/offset.json')
+        self.window = window or int(os.getenv('DEDUP_WINDOW', 1000))
+        self.offset = 0  # Первый update_id, который еще нужно получить
+        self.recent = deque()  # Обработанные update_id в порядке обработки
+        self.recent_set = set()
+        self.in_flight = set()  # Принятые, но еще не обработанные
+        self.duplicates = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            log.warning("⚠️ Не удалось прочитать %s, начинаем с нуля: %s", self.path, e)
+            return
+        self.offset = int(data.get("offset", 0))
+        for update_id in data.get("processed", [])[-self.window:]:
+            self.recent.append(update_id)
+            self.recent_set.add(update_id)
+        log.info("📍 Продолжаем с update_id %s (обработано недавно: %s)", self.offset, len(self.recent))
+
+    def accept(self, update_id):
+        """True, если обновление новое и его нужно обработать"""
+        with self._lock:
+            if update_id in self.recent_set or update_id in self.in_flight:
+                self.duplicates += 1
+                return False
+            self.in_flight.add(update_id)
+            return True
+
+    def done(self, update_id):
+        """Обновление обработано (успешно или с ошибкой — повтор не поможет)"""
+        with self._lock:
+            self.in_flight.discard(update_id)
+            self.recent.append(update_id)
+            self.recent_set.add(update_id)
+            if len(self.recent) > self.window:
+                self.recent_set.discard(self.recent.popleft())
+            self._dirty = True
+
+    def safe_offset(self):
+        """Offset, до которого все обновления точно обработаны"""
+        with self._lock:
+            return self._safe_offset()
+
+    def _safe_offset(self):
+        if self.in_flight:
+            return min(self.in_flight)
+        if self.recent:
+            return max(self.offset, max(self.recent) + 1)
+        return self.offset
+
+    def save(self):
+        """Атомарно записывает offset и обработанные update_id (если что-то изменилось)"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self.offset = self._safe_offset()
+            data = {"offset": self.offset, "processed": list(self.recent)}
+            self._dirty = False
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.error("❌ Не удалось сохранить позицию обновлений: %s", e)
+            with self._lock:
+                self._dirty = True
@@ -0,0 +1,243 @@
+"""
+Асинхронный доступ к Supabase через REST (PostgREST), DB_CLIENT=async.
+
+Все запросы идут через один httpx.AsyncClient с пулом соединений в
+собственном цикле событий. У каждого вызова есть таймаут (включая ожидание
+свободного слота), одновременно выполняется не больше DB_MAX_CONCURRENCY
+запросов, а после DB_BREAKER_FAILURES сбоев подряд автомат размыкается и
+DB_BREAKER_RESET секунд запросы сразу завершаются ошибкой, не дожидаясь
+таймаутов. Затем один пробный запрос решает, замыкать ли его обратно.
+
+Синхронные методы с теми же именами, что у DatabaseManager, позволяют
+использовать менеджер из потоков SurveyWriter, ResponseCounter и /report.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import httpx
+
+from analytics import PAGE_SIZE
+from metrics import DB_CALL_SECONDS
+
+log = logging.getLogger(__name__)
+
+TABLE = "survey_responses"
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class DatabaseError(Exception):
+    """Ошибка запроса к Supabase (сетевая, таймаут или ответ с ошибкой)"""
+
+    def __init__(self, operation, status, message):
+        super().__init__(f"{operation}: {status} {message}" if status else f"{operation}: {message}")
+        self.operation = operation
+        self.status = status  # None для сетевых ошибок и таймаутов
+        self.message = message
+
+
+class CircuitOpenError(DatabaseError):
+    def __init__(self, operation):
+        super().__init__(operation, None, "circuit breaker is open")
+
+
+class CircuitBreaker:
+    """Размыкается после failures сбоев подряд, через reset_timeout пропускает пробный запрос"""
+
+    def __init__(self, failures=None, reset_timeout=None):
+        self.failures = failures or int(os.getenv('DB_BREAKER_FAILURES', 5))
+        self.reset_timeout = reset_timeout or float(os.getenv('DB_BREAKER_RESET', 30))
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.opened = 0  # Сколько раз размыкался
+        self.rejected = 0  # Запросы, отклоненные без обращения к базе
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == STATE_CLOSED:
+                return True
+            if self.state == STATE_OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = STATE_HALF_OPEN  # Пробный запрос
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != STATE_CLOSED:
+                log.info("✅ Supabase снова отвечает, запросы возобновлены")
+            self.state = STATE_CLOSED
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == STATE_HALF_OPEN or (
+                self.state == STATE_CLOSED and self.consecutive_failures >= self.failures
+            ):
+                self.state = STATE_OPEN
+                self.opened_at = time.monotonic()
+                self.opened += 1
+                log.warning("⚡ Supabase недоступна, запросы приостановлены на %g с", self.reset_timeout)
+
+
+class AsyncDatabaseManager:
+    def __init__(self, url, key, timeout=None, max_concurrency=None, breaker=None):
+        self.url = url.rstrip("/") if url else None
+        self.key = key
+        self.timeout = timeout or float(os.getenv('DB_TIMEOUT', 5))
+        self.max_concurrency = max_concurrency or int(os.getenv('DB_MAX_CONCURRENCY', 8))
+        self.breaker = breaker or CircuitBreaker()
+        self.loop = None
+        self.client = None
+        self._semaphore = None
+        self._start_lock = threading.Lock()
+        if not self.is_available():
+            log.warning("⚠️ SUPABASE_URL или SUPABASE_KEY не установлены")
+
+    def is_available(self):
+        return bool(self.url and self.key)
+
+    def warm(self):
+        """Запускает цикл событий и пул соединений заранее"""
+        if self.is_available():
+            self._ensure_loop()
+
+    def _ensure_loop(self):
+        with self._start_lock:
+            if self.loop is not None:
+                return self.loop
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="db-async", daemon=True).start()
+
+            async def setup():
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                self.client = httpx.AsyncClient(
+                    base_url=f"{self.url}/rest/v1",
+                    headers={"apikey": self.key, "Authorization": f"Bearer {self.key}"},
+                    limits=httpx.Limits(
+                        max_connections=self.max_concurrency,
+                        max_keepalive_connections=self.max_concurrency,
+                        keepalive_expiry=60,
+                    ),
+                    timeout=self.timeout,
+                )
+
+            asyncio.run_coroutine_threadsafe(setup(), loop).result()
+            self.loop = loop
+            return loop
+
+    async def request(self, operation, method, params=None, json=None, headers=None):
+        """
+        Один запрос к PostgREST с таймаутом на ожидание слота и сам вызов.
+        Возвращает httpx.Response, при ошибке бросает DatabaseError.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(operation)
+
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                self._send(method, params, json, headers), self.timeout
+            )
+        except (httpx.HTTPError, asyncio.TimeoutError) as e:
+            DB_CALL_SECONDS.observe(time.perf_counter() - started, operation, "error")
+            self.breaker.record_failure()
+            raise DatabaseError(operation, None, type(e).__name__) from e
+
+        DB_CALL_SECONDS.observe(
+            time.perf_counter() - started, operation, "ok" if response.status_code < 400 else "error"
+        )
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            # 4xx — ошибка запроса, а не признак недоступности базы
+            self.breaker.record_success()
+        if response.status_code >= 400:
+            raise DatabaseError(operation, response.status_code, response.text[:200])
+        return response
+
+    async def _send(self, method, params, json, headers):
+        async with self._semaphore:
+            return await self.client.request(method, f"/{TABLE}", params=params, json=json, headers=headers)
+
+    async def asave_survey_responses(self, rows):
+        """Пачка ответов одним upsert; пары (user_id, submission_id), которые уже есть, пропускаются"""
+        try:
+            await self.request(
+                "insert", "POST",
+                params={"on_conflict": "user_id,submission_id"},
+                json=rows,
+                headers={"Prefer": "resolution=ignore-duplicates,return=minimal"},
+            )
+        except DatabaseError as e:
+            log.error("❌ Ошибка при сохранении: %s", e)
+            return False, f"Ошибка при сохранении: {e}"
+        log.info("✅ Сохранено ответов в базу данных: %s", len(rows))
+        return True, "Ответы успешно сохранены"
+
+    async def aget_all_responses_count(self):
+        """Количество ответов (None, если запрос не удался)"""
+        try:
+            response = await self.request(
+                "count", "GET",
+                params={"select": "id", "limit": "1"},
+                headers={"Prefer": "count=exact"},
+            )
+        except DatabaseError as e:
+            log.error("❌ Ошибка при получении количества ответов: %s", e)
+            return None
+        total = response.headers.get("Content-Range", "*/0").rsplit("/", 1)[-1]
+        return int(total) if total.isdigit() else None
+
+    async def aselect_page(self, after_id, page_size, columns):
+        response = await self.request(
+            "select", "GET",
+            params={"select": columns, "id": f"gt.{after_id}", "order": "id", "limit": str(page_size)},
+        )
+        return response.json()
+
+    def _run(self, coroutine):
+        """Выполняет корутину в цикле менеджера из обычного потока"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._ensure_loop()).result()
+
+    def save_survey_responses(self, rows):
+        if not self.is_available():
+            log.error("❌ База данных недоступна")
+            return False, "База данных недоступна"
+        return self._run(self.asave_survey_responses(rows))
+
+    def get_all_responses_count(self):
+        if not self.is_available():
+            return 0
+        return self._run(self.aget_all_responses_count())
+
+    def iter_responses(self, page_size=PAGE_SIZE, after_id=0, columns="id,user_id,created_at,answers"):
+        """Постранично читает ответы по возрастанию id (как analytics.iter_responses)"""
+        last_id = after_id
+        while True:
+            rows = self._run(self.aselect_page(last_id, page_size, columns))
+            yield from rows
+            if len(rows) < page_size:
+                return
+            last_id = rows[-1]["id"]
+
+    def get_metrics(self):
+        return {
+            "circuit": self.breaker.state,
+            "circuit_opened": self.breaker.opened,
+            "rejected": self.breaker.rejected,
+        }
+
+    def close(self):
+        if self.loop is not None:
+            self._run(self.client.aclose())
+            self.loop.call_soon_threadsafe(self.loop.stop)
@@ -0,0 +1,202 @@
+"""
+Фоновая запись завершенных опросов в Supabase.
+
+finish_survey только ставит строку в очередь и сразу благодарит пользователя.
+Отдельный поток собирает строки в пачки и сохраняет их одним multi-row
+upsert'ом, когда набирается FLUSH_BATCH_SIZE строк или проходит
+FLUSH_INTERVAL секунд. Повторная запись той же пары
+(user_id, submission_id) игнорируется базой, поэтому повторы безопасны.
+
+Если подключен журнал (spool.ResponseJournal), ответ сначала попадает в него,
+а ответы, которые не удалось записать, периодически отправляются повторно.
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+
+from metrics import DB_INSERT_SECONDS, DB_ROWS_SAVED
+from profiling import PROFILER
+
+log = logging.getLogger(__name__)
+
+# Результат SurveyWriter.submit
+SUBMIT_QUEUED = "queued"  # В очереди записи в базу (и в журнале, если он есть)
+SUBMIT_LOCAL = "local"  # База не настроена: ответ сохранен только в журнале
+SUBMIT_FAILED = "failed"  # Не удалось записать в журнал, ответ может потеряться
+
+
+def row_key(row):
+    """Ключ идемпотентности строки ответа"""
+    return row["user_id"], row["submission_id"]
+
+
+class SurveyWriter:
+    def __init__(self, db, journal=None, batch_size=None, flush_interval=None, max_retries=None,
+                 replay_interval=None, on_saved=None, on_submit=None):
+        self.db = db
+        self.journal = journal
+        # Вызывается после успешной записи со списком строк и числом строк из журнала среди них:
+        # такие могли уже быть в базе, и upsert их пропустил
+        self.on_saved = on_saved
+        self.on_submit = on_submit  # Вызывается с каждой новой строкой до записи в базу и с журналом в start
+        self.batch_size = batch_size or int(os.getenv('FLUSH_BATCH_SIZE', 50))
+        self.flush_interval = flush_interval or float(os.getenv('FLUSH_INTERVAL', 2))
+        self.max_retries = max_retries or int(os.getenv('FLUSH_MAX_RETRIES', 5))
+        self.max_backoff = 30.0
+        self.replay_interval = replay_interval or float(os.getenv('SPOOL_REPLAY_INTERVAL', 60))
+        self._last_replay = time.monotonic()
+
+        self.queue = queue.Queue()
+        self.in_progress = 0  # Строки в пачке, которая сейчас пишется
+        self.thread = None
+        self._stopping = threading.Event()
+
+        # Метрики
+        self.saved = 0
+        self.batches = 0
+        self.failed = 0
+        self.replayed = 0
+        self._replayed_keys = set()  # Строки из журнала, которые еще не записаны
+        self.last_flush_time = 0.0
+
+    def start(self):
+        if self.journal and self.journal.pending and self.db.is_available():
+            # Восстановление после перезапуска: дописываем то, что не дошло до базы
+            rows = [row for row, _ in self.journal.pending.values()]
+            for row in rows:
+                # Для этого процесса строка новая: учитывается так же, как из submit
+                if self.on_submit:
+                    self.on_submit(row)
+                self.queue.put(row)
+            self.replayed += len(rows)
+            self._replayed_keys.update(row_key(row) for row in rows)
+            log.info("💾 Повторная отправка ответов из журнала: %s", len(rows))
+        self.thread = threading.Thread(target=self._run, name="survey-writer", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=10):
+        """Дописывает очередь и останавливает поток"""
+        self._stopping.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def submit(self, row):
+        """
+        Ставит строку в очередь записи, не дожидаясь базы.
+        Возвращает SUBMIT_QUEUED, SUBMIT_LOCAL или SUBMIT_FAILED.
+        """
+        if self.on_submit:
+            self.on_submit(row)
+        journaled = False
+        if self.journal:
+            try:
+                self.journal.append(row)
+                journaled = True
+            except OSError as e:
+                log.error("❌ Ошибка записи в журнал: %s", e)
+        if not self.db.is_available():
+            return SUBMIT_LOCAL if journaled else SUBMIT_FAILED
+        self.queue.put(row)
+        # Без журнала строка, которую не удастся записать, потеряется при перезапуске
+        return SUBMIT_QUEUED if journaled or not self.journal else SUBMIT_FAILED
+
+    def backlog(self):
+        """Сколько ответов еще не записано в базу"""
+        return self.queue.qsize() + self.in_progress
+
+    def get_metrics(self):
+        return {
+            "backlog": self.backlog(),
+            "saved": self.saved,
+            "batches": self.batches,
+            "failed": self.failed,
+            "replayed": self.replayed,
+            "journal_pending": len(self.journal.pending) if self.journal else 0,
+            "last_flush_ms": round(self.last_flush_time * 1000, 2),
+        }
+
+    def _run(self):
+        while not (self._stopping.is_set() and self.queue.empty()):
+            batch = self._collect_batch()
+            if batch:
+                self._flush(batch)
+            elif self.journal:
+                self._replay_stale()
+
+    def _replay_stale(self):
+        """Повторно отправляет ответы из журнала, которые так и не дошли до базы"""
+        now = time.monotonic()
+        if now - self._last_replay < self.replay_interval or not self.db.is_available():
+            return
+        self._last_replay = now
+        if self.backlog():
+            return
+        rows = self.journal.stale_rows(self.replay_interval)
+        for row in rows:
+            self.queue.put(row)
+        if rows:
+            self.replayed += len(rows)
+            self._replayed_keys.update(row_key(row) for row in rows)
+            log.info("💾 Повторная отправка ответов из журнала: %s", len(rows))
+
+    def _collect_batch(self):
+        """Собирает пачку по размеру или по таймеру от первой строки"""
+        try:
+            first = self.queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+
+        # Дубликаты внутри пачки схлопываются по ключу идемпотентности
+        batch = {row_key(first): first}
+        self.in_progress = 1
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (self._stopping.is_set() and self.queue.empty()):
+                break
+            try:
+                row = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch[row_key(row)] = row
+            self.in_progress = len(batch)
+        return list(batch.values())
+
+    def _flush(self, batch):
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            success, message = self.db.save_survey_responses(batch)
+            self.last_flush_time = time.perf_counter() - started
+            DB_INSERT_SECONDS.observe(self.last_flush_time, "ok" if success else "error")
+            PROFILER.record("db.save_survey_responses", self.last_flush_time)
+            if success:
+                DB_ROWS_SAVED.inc(amount=len(batch))
+                self.saved += len(batch)
+                self.batches += 1
+                if self.journal:
+                    self.journal.ack(batch)
+                replayed = 0
+                if self._replayed_keys:
+                    for row in batch:
+                        if row_key(row) in self._replayed_keys:
+                            self._replayed_keys.discard(row_key(row))
+                            replayed += 1
+                if self.on_saved:
+                    self.on_saved(batch, replayed)
+                break
+
+            attempt += 1
+            if attempt > self.max_retries:
+                self.failed += len(batch)
+                log.error("❌ Не удалось сохранить %s ответов после %s попыток: %s", len(batch), attempt, message)
+                if self.journal:
+                    log.info("💾 Ответы остаются в журнале и будут отправлены повторно")
+                break
+            backoff = min(self.max_backoff, 0.5 * 2 ** (attempt - 1))
+            log.warning("⏳ Повтор записи %s ответов через %.1f с", len(batch), backoff)
+            time.sleep(backoff)
+        self.in_progress = 0
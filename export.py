@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Выгрузка ответов survey_responses в CSV, JSONL или Parquet.
+
+Строки читаются из Supabase страницами с keyset-пагинацией по id и
+сразу пишутся в файл, поэтому память не зависит от
+размера таблицы. JSON из колонки answers раскладывается по колонкам: одна
+на вопрос, а множественный выбор — по колонке 0/1 на каждый вариант
+(q2_1, q2_2, ...). Свой вариант "Інше" попадает в колонку q2_other.
+
+Инкрементальная выгрузка берет только строки с id больше водяного знака.
+Знак ставится по id, а не по created_at: created_at бот записывает в
+момент завершения опроса, и ответ, дописанный позже из журнала, мог бы
+оказаться ниже уже сохраненного знака и не попасть ни в одну выгрузку.
+С --state знак читается из файла и сохраняется в него после успешной
+записи, поэтому ночная задача забирает только новые ответы:
+
+    python export.py --format csv --output responses.csv
+    python export.py --format parquet --output new.parquet --state spool/export.state
+    python export.py --format jsonl --since 2024-05-01T00:00:00+00:00
+    python export.py --fixture fixtures/survey_responses.jsonl --format csv
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+from analytics import PAGE_SIZE, connect, decode_answers, iter_fixture, iter_responses
+
+BASE_COLUMNS = ("id", "user_id", "username", "submission_id", "created_at")
+SELECT_COLUMNS = ",".join(BASE_COLUMNS + ("answers",))
+OTHER_PREFIX = "Інше"
+PARQUET_BATCH = int(os.getenv('EXPORT_PARQUET_BATCH', 5000))
+
+
+class ExportColumns:
+    """Плоская схема выгрузки, построенная по QUESTIONS и ADDITIONAL_QUESTIONS"""
+
+    def __init__(self, questions, additional_questions=()):
+        self.names = list(BASE_COLUMNS)
+        self.flags = set()  # Колонки 0/1 множественного выбора
+        self._plan = []  # (ключ ответа, тип, варианты -> номер, колонки вариантов, колонка "Інше")
+
+        for question in questions:
+            self._add(f"q{question['id']}", question['type'], question.get('options', ()))
+        for question in additional_questions:
+            self._add(question['id'], question['type'], question.get('options', ()))
+
+    def _add(self, key, question_type, options):
+        other = f"{key}_other" if OTHER_PREFIX in options else None
+        if question_type == 'multiple_choice':
+            option_columns = [f"{key}_{i}" for i in range(1, len(options) + 1)]
+            self.names.extend(option_columns)
+            self.flags.update(option_columns)
+        else:
+            option_columns = None
+            self.names.append(key)
+        if other:
+            self.names.append(other)
+        lookup = {option: i for i, option in enumerate(options)}
+        self._plan.append((key, question_type, lookup, option_columns, other))
+
+    def flatten(self, row):
+        """Строка таблицы -> словарь колонка -> значение (None, если ответа нет)"""
+        answers = decode_answers(row)
+        record = {name: row.get(name) for name in BASE_COLUMNS}
+        for key, question_type, lookup, option_columns, other in self._plan:
+            value = answers.get(key)
+            if option_columns is not None:
+                selected = value if isinstance(value, list) else ([] if value is None else [value])
+                flags = [0] * len(option_columns) if value is not None else [None] * len(option_columns)
+                other_text = None
+                for item in selected:
+                    if item in lookup:
+                        flags[lookup[item]] = 1
+                    elif isinstance(item, str) and item.startswith(OTHER_PREFIX):
+                        other_text = _other_text(item)
+                        if OTHER_PREFIX in lookup:
+                            flags[lookup[OTHER_PREFIX]] = 1
+                record.update(zip(option_columns, flags))
+            elif other and isinstance(value, str) and value.startswith(OTHER_PREFIX):
+                record[key] = OTHER_PREFIX
+                other_text = _other_text(value)
+            else:
+                record[key] = value
+                other_text = None
+            if other:
+                record[other] = other_text
+        return record
+
+
+def _other_text(value):
+    """'Інше: свой текст' -> 'свой текст'"""
+    return value[len(OTHER_PREFIX):].lstrip(":").strip() or None
+
+
+class Watermark:
+    """Запоминает id последней выгруженной строки"""
+
+    def __init__(self, row_id=0):
+        self.id = row_id
+        self.rows = 0
+
+    def track(self, rows):
+        for row in rows:
+            self.id = max(self.id, row["id"])
+            self.rows += 1
+            yield row
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls()
+        return cls(data.get("id") or 0)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding='utf-8') as f:
+            json.dump({"id": self.id}, f)
+        os.replace(tmp_path, path)
+
+
+def write_csv(records, columns, stream):
+    writer = csv.DictWriter(stream, fieldnames=columns.names)
+    writer.writeheader()
+    for record in records:
+        writer.writerow(record)
+
+
+def write_jsonl(records, columns, stream):
+    for record in records:
+        stream.write(json.dumps(record, ensure_ascii=False))
+        stream.write("\n")
+
+
+def write_parquet(records, columns, path, batch_size=PARQUET_BATCH):
+    """Пишет Parquet группами строк по batch_size (нужен pyarrow)"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    def column_type(name):
+        if name in ("id", "user_id"):
+            return pa.int64()
+        if name in columns.flags:
+            return pa.int8()
+        return pa.string()
+
+    schema = pa.schema([(name, column_type(name)) for name in columns.names])
+    with pq.ParquetWriter(path, schema) as writer:
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                batch.clear()
+        if batch:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+
+
+def export(rows, columns, fmt, output):
+    """
+    Пишет строки в output ("-" — stdout, кроме Parquet). Файл сначала
+    пишется во временный рядом и заменяет итоговый только после успеха.
+    """
+    records = (columns.flatten(row) for row in rows)
+    if output == "-":
+        (write_csv if fmt == "csv" else write_jsonl)(records, columns, sys.stdout)
+        return
+
+    directory = os.path.dirname(os.path.abspath(output))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".export-")
+    try:
+        if fmt == "parquet":
+            os.close(fd)
+            write_parquet(records, columns, tmp_path)
+        else:
+            with os.fdopen(fd, "w", encoding='utf-8', newline="") as f:
+                (write_csv if fmt == "csv" else write_jsonl)(records, columns, f)
+        os.replace(tmp_path, output)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def parse_time(value):
+    """ISO время -> datetime с часовым поясом; время без пояса считается локальным"""
+    moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return moment if moment.tzinfo else moment.astimezone()
+
+
+def fixture_rows(path, after_id=0, since=None):
+    """Строки фикстуры в том же порядке и с тем же отбором, что и из Supabase"""
+    since = parse_time(since) if since else None
+    for row in sorted(iter_fixture(path), key=lambda row: row["id"]):
+        if row["id"] <= after_id:
+            continue
+        if since is not None and (not row.get("created_at") or parse_time(row["created_at"]) <= since):
+            continue
+        yield row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Выгрузка ответов опроса")
+    parser.add_argument("--format", choices=["csv", "jsonl", "parquet"], default="csv")
+    parser.add_argument("--output", default="-", help="Файл (по умолчанию stdout)")
+    parser.add_argument("--since", help="Только ответы с created_at позже этого значения")
+    parser.add_argument("--state", help="Файл водяного знака для инкрементальной выгрузки")
+    parser.add_argument("--fixture", help="JSONL файл вместо Supabase")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    args = parser.parse_args()
+
+    if args.format == "parquet":
+        if args.output == "-":
+            parser.error("Для Parquet нужен --output")
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error("Для Parquet нужен pyarrow: pip install pyarrow")
+
+    if args.since:
+        try:
+            parse_time(args.since)
+        except ValueError:
+            parser.error(f"--since: ожидается время в формате ISO 8601, получено {args.since!r}")
+
+    watermark = Watermark.load(args.state) if args.state else Watermark()
+
+    if args.fixture:
+        rows = fixture_rows(args.fixture, watermark.id, args.since)
+    else:
+        # Водяной знак — id, а не created_at: created_at ставит бот при завершении опроса,
+        # и строка, записанная позже из журнала, может оказаться "в прошлом"
+        rows = iter_responses(connect(), args.page_size, watermark.id, SELECT_COLUMNS, since=args.since)
+
+    from bot_simple import QUESTIONS, ADDITIONAL_QUESTIONS
+    export(watermark.track(rows), ExportColumns(QUESTIONS, ADDITIONAL_QUESTIONS), args.format, args.output)
+
+    if args.state:
+        watermark.save(args.state)
+    print(f"✅ Выгружено строк: {watermark.rows}, водяной знак: id {watermark.id}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Локальная замена Supabase REST (PostgREST) для офлайн-проверок.
+
+Поддерживается то, чем пользуется бот: вставка с on_conflict и
+resolution=ignore-duplicates/merge-duplicates, выборка с select, фильтрами
+(eq, neq, gt, gte, lt, lte, а также or=(...) и and(...) из них), order,
+limit, offset и Prefer: count=exact.
+Таблицы хранятся в памяти.
+
+Запуск без аргументов проверяет DatabaseManager и чтение для аналитики:
+    python fake_supabase.py
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qsl, urlparse
+
+from fake_telegram import QuietHTTPServer
+
+FILTER_OPS = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "gt": lambda a, b: a is not None and a > b,
+    "gte": lambda a, b: a is not None and a >= b,
+    "lt": lambda a, b: a is not None and a < b,
+    "lte": lambda a, b: a is not None and a <= b,
+}
+RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+
+def _split_conditions(text):
+    """Делит список условий по запятым верхнего уровня (без учета скобок и кавычек)"""
+    parts, current, depth, quoted = [], "", 0, False
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and char == ",":
+            parts.append(current)
+            current = ""
+            continue
+        current += char
+    parts.append(current)
+    return parts
+
+
+def _parse_condition(text):
+    """Условие PostgREST (column.op.value, and(...), or(...)) -> предикат строки"""
+    for name, combine in (("and", all), ("or", any)):
+        if text.startswith(name + "(") and text.endswith(")"):
+            checks = [_parse_condition(part) for part in _split_conditions(text[len(name) + 1:-1])]
+            return lambda row: combine(check(row) for check in checks)
+    column, op, operand = text.split(".", 2)
+    check = FILTER_OPS.get(op)
+    if check is None:
+        raise ValueError(f"Unsupported operator {op}")
+    if len(operand) >= 2 and operand[0] == operand[-1] == '"':
+        operand = operand[1:-1]
+    return lambda row: check(row.get(column), _coerce(operand, row.get(column)))
+
+
+def _coerce(value, sample):
+    """Приводит значение из строки запроса к типу значения в таблице"""
+    if isinstance(sample, bool):
+        return value == "true"
+    if isinstance(sample, int):
+        return int(value)
+    if isinstance(sample, float):
+        return float(value)
+    return value
+
+
+class FakeSupabase:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency  # Искусственная задержка каждого запроса, секунды
+        self.server = None
+        self._lock = threading.Lock()
+        self.tables = {}  # имя -> список строк
+        self.next_ids = {}
+        self.requests = []  # (method, path)
+        self.errors = []  # Ответы с ошибкой для следующих запросов
+
+    @property
+    def url(self):
+        """Базовый адрес для SUPABASE_URL"""
+        return f"http://{self.host}:{self.server.server_port}"
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, как у настоящего API
+            disable_nagle_algorithm = True  # Заголовки и тело пишутся отдельно
+
+            def do_GET(self):
+                self._respond(fake.handle("GET", self.path, self.headers, b""))
+
+            def do_HEAD(self):
+                status, headers, _ = fake.handle("GET", self.path, self.headers, b"")
+                self._respond((status, headers, b""))
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                self._respond(fake.handle("POST", self.path, self.headers, self.rfile.read(length)))
+
+            def _respond(self, response):
+                status, headers, body = response
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = QuietHTTPServer((self.host, self.port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def fail_next(self, status=503, message="Injected error"):
+        """Следующий запрос вернет ошибку"""
+        with self._lock:
+            self.errors.append((status, message))
+
+    def rows(self, table="survey_responses"):
+        with self._lock:
+            return [dict(row) for row in self.tables.get(table, [])]
+
+    def load_rows(self, rows, table="survey_responses"):
+        """Заполняет таблицу готовыми строками (например, из fixtures)"""
+        with self._lock:
+            self._insert(table, list(rows), None, "ignore-duplicates")
+
+    def handle(self, method, path, headers, body):
+        if self.latency:
+            time.sleep(self.latency)
+        url = urlparse(path)
+        with self._lock:
+            self.requests.append((method, url.path))
+            if self.errors:
+                status, message = self.errors.pop(0)
+                return self._json(status, {"message": message, "code": str(status)})
+
+        prefix = "/rest/v1/"
+        if not url.path.startswith(prefix):
+            return self._json(404, {"message": "Not found"})
+        table = url.path[len(prefix):]
+        params = parse_qsl(url.query, keep_blank_values=True)
+        prefer = {
+            item.split("=", 1)[0].strip(): item.split("=", 1)[-1].strip()
+            for item in headers.get("Prefer", "").split(",") if item.strip()
+        }
+
+        if method == "POST":
+            try:
+                payload = json.loads(body or b"[]")
+            except ValueError:
+                return self._json(400, {"message": "Invalid JSON"})
+            rows = payload if isinstance(payload, list) else [payload]
+            on_conflict = dict(params).get("on_conflict")
+            with self._lock:
+                inserted = self._insert(table, rows, on_conflict, prefer.get("resolution"))
+            if prefer.get("return") == "representation":
+                return self._json(201, inserted)
+            return 201, {}, b""
+
+        with self._lock:
+            rows = [dict(row) for row in self.tables.get(table, [])]
+        return self._select(rows, params, prefer)
+
+    def _insert(self, table, rows, on_conflict, resolution):
+        """Вставляет строки под блокировкой, возвращает вставленные"""
+        existing = self.tables.setdefault(table, [])
+        keys = on_conflict.split(",") if on_conflict else []
+        index = {tuple(row.get(k) for k in keys): row for row in existing} if keys else {}
+        inserted = []
+        for row in rows:
+            row = dict(row)
+            key = tuple(row.get(k) for k in keys)
+            if keys and key in index:
+                if resolution == "merge-duplicates":
+                    index[key].update(row)
+                    inserted.append(index[key])
+                continue
+            if "id" not in row:
+                self.next_ids[table] = self.next_ids.get(table, 0) + 1
+                row["id"] = self.next_ids[table]
+            else:
+                self.next_ids[table] = max(self.next_ids.get(table, 0), row["id"])
+            row.setdefault("created_at", datetime.now(timezone.utc).isoformat())
+            existing.append(row)
+            if keys:
+                index[key] = row
+            inserted.append(row)
+        return inserted
+
+    def _select(self, rows, params, prefer):
+        limit = offset = None
+        order = []
+        columns = "*"
+        for name, value in params:
+            if name == "select":
+                columns = value
+            elif name == "limit":
+                limit = int(value)
+            elif name == "offset":
+                offset = int(value)
+            elif name == "order":
+                for item in value.split(","):
+                    column, _, direction = item.partition(".")
+                    order.append((column, direction.startswith("desc")))
+            elif name not in RESERVED_PARAMS:
+                # or=(a,b) и and=(a,b) — логические группы, иначе column=op.value
+                condition = f"{name}{value}" if name in ("or", "and") else f"{name}.{value}"
+                try:
+                    check = _parse_condition(condition)
+                except ValueError as e:
+                    return self._json(400, {"message": str(e)})
+                rows = [row for row in rows if check(row)]
+
+        total = len(rows)
+        for column, descending in reversed(order):
+            rows.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse=descending)
+        start = offset or 0
+        rows = rows[start:start + limit if limit is not None else None]
+        if columns != "*":
+            names = [name.strip() for name in columns.split(",")]
+            rows = [{name: row.get(name) for name in names} for row in rows]
+
+        headers = {"Content-Type": "application/json"}
+        if prefer.get("count") == "exact":
+            span = f"{start}-{start + len(rows) - 1}" if rows else "*"
+            headers["Content-Range"] = f"{span}/{total}"
+        return 200, headers, json.dumps(rows, ensure_ascii=False).encode()
+
+    @staticmethod
+    def _json(status, data):
+        return status, {"Content-Type": "application/json"}, json.dumps(data, ensure_ascii=False).encode()
+
+
+def run_selfcheck():
+    """Сохраняет ответы через DatabaseManager и читает их как аналитика"""
+    fake = FakeSupabase().start()
+    os.environ.update(SUPABASE_URL=fake.url, SUPABASE_KEY="fake-key")
+    try:
+        import bot_simple
+        from analytics import iter_responses
+
+        bot_simple.SUPABASE_URL, bot_simple.SUPABASE_KEY = fake.url, "fake-key"
+        db = bot_simple.DatabaseManager()
+        rows = [
+            db.build_survey_row(100 + i, f"user{i}", {"q1": "У своєму місті"}, f"s{i}")
+            for i in range(5)
+        ]
+        assert db.save_survey_responses(rows)[0]
+        # Повторная отправка той же пачки не создает дубликатов
+        assert db.save_survey_responses(rows[:2])[0]
+        assert db.get_all_responses_count() == 5, db.get_all_responses_count()
+        assert [row["user_id"] for row in iter_responses(db.supabase, page_size=2)] == [100, 101, 102, 103, 104]
+        print("✅ FakeSupabase работает с DatabaseManager и аналитикой")
+        return 0
+    finally:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(run_selfcheck())
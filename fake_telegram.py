@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Локальная замена api.telegram.org для офлайн-проверок.
+
+FakeTelegram реализует нужные боту методы Bot API (getUpdates, sendMessage,
+editMessageReplyMarkup, answerCallbackQuery, setWebhook, deleteWebhook) и
+умеет доставлять обновления как через long polling, так и POST-запросом на
+зарегистрированный webhook.
+
+Запуск без аргументов проверяет режим webhook целиком:
+    python fake_telegram.py
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qsl, urlparse
+
+import httpx
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    """Не печатает трейсбеки, когда бот обрывает соединение (например, при остановке)"""
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeAPIError(Exception):
+    """Ответ метода с ok=false"""
+
+    def __init__(self, error_code, description):
+        super().__init__(description)
+        self.error_code = error_code
+        self.description = description
+
+
+class FakeTelegram:
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.server = None
+        self._cond = threading.Condition()
+        self.updates = []  # Очередь для getUpdates
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.calls = []  # Все вызовы (method, params)
+        self.messages = defaultdict(list)  # Отправленные ботом сообщения по chat_id
+        self.edits = defaultdict(list)  # Примененные правки клавиатур по chat_id
+        self.callback_answers = {}  # callback_query_id -> параметры answerCallbackQuery
+        self.listeners = []  # callback(chat_id, message, edited) на каждое сообщение бота
+        self.errors = {}  # method -> список ответов с ошибкой для следующих вызовов
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.webhook_client = httpx.Client(timeout=10)
+
+    @property
+    def url(self):
+        """Базовый адрес для TELEGRAM_API_URL"""
+        return f"http://{self.host}:{self.server.server_port}"
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, как у настоящего API
+            disable_nagle_algorithm = True  # Заголовки и тело пишутся отдельно
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length)
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    params = json.loads(body or b"{}")
+                else:
+                    params = dict(parse_qsl(body.decode()))
+                self._respond(params)
+
+            def do_GET(self):
+                self._respond(dict(parse_qsl(urlparse(self.path).query)))
+
+            def _respond(self, params):
+                method = urlparse(self.path).path.rsplit('/', 1)[-1]
+                result = fake.handle_method(method, params)
+                data = json.dumps(result, ensure_ascii=False).encode()
+                self.send_response(200 if result.get("ok") else result.get("error_code", 400))
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = QuietHTTPServer((self.host, self.port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        with self._cond:
+            self._cond.notify_all()
+        self.webhook_client.close()
+
+    def fail_next(self, method, error_code, description="Injected error", retry_after=None):
+        """Следующий вызов method вернет ошибку (например, 429 с retry_after)"""
+        response = {"ok": False, "error_code": error_code, "description": description}
+        if retry_after is not None:
+            response["parameters"] = {"retry_after": retry_after}
+        with self._cond:
+            self.errors.setdefault(method, []).append(response)
+
+    def handle_method(self, method, params):
+        with self._cond:
+            self.calls.append((method, params))
+            pending_errors = self.errors.get(method)
+            if pending_errors:
+                return pending_errors.pop(0)
+
+        handler = getattr(self, f"_api_{method}", None)
+        if handler is None:
+            return {"ok": False, "error_code": 404, "description": "Not Found: method not found"}
+        try:
+            return {"ok": True, "result": handler(params)}
+        except FakeAPIError as e:
+            return {"ok": False, "error_code": e.error_code, "description": e.description}
+
+    def _api_getMe(self, params):
+        return {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+
+    def _api_setWebhook(self, params):
+        with self._cond:
+            self.webhook_url = params.get("url") or None
+            self.webhook_secret = params.get("secret_token")
+        return True
+
+    def _api_deleteWebhook(self, params):
+        with self._cond:
+            self.webhook_url = None
+            self.webhook_secret = None
+        return True
+
+    def _api_getUpdates(self, params):
+        offset = int(params.get("offset", 0))
+        timeout = float(params.get("timeout", 0))
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                # Как и Telegram, подтверждаем все обновления до offset
+                self.updates = [u for u in self.updates if u["update_id"] >= offset]
+                if self.updates:
+                    return list(self.updates[:int(params.get("limit", 100))])
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self.server is None:
+                    return []
+                self._cond.wait(remaining)
+
+    def _api_sendMessage(self, params):
+        chat_id = int(params["chat_id"])
+        reply_markup = params.get("reply_markup")
+        if isinstance(reply_markup, str):
+            reply_markup = json.loads(reply_markup)
+        with self._cond:
+            message = {
+                "message_id": self.next_message_id,
+                "chat": {"id": chat_id, "type": "private"},
+                "date": int(time.time()),
+                "text": params.get("text", ""),
+                "reply_markup": reply_markup,
+            }
+            self.next_message_id += 1
+            self.messages[chat_id].append(message)
+            self._cond.notify_all()
+        self._notify(chat_id, message, False)
+        return message
+
+    def _api_editMessageReplyMarkup(self, params):
+        chat_id = int(params["chat_id"])
+        message_id = int(params["message_id"])
+        reply_markup = params.get("reply_markup")
+        if isinstance(reply_markup, str):
+            reply_markup = json.loads(reply_markup)
+        with self._cond:
+            for message in self.messages[chat_id]:
+                if message["message_id"] == message_id:
+                    break
+            else:
+                raise FakeAPIError(400, "Bad Request: message to edit not found")
+            if message["reply_markup"] == reply_markup:
+                # Как и Telegram, отвергаем правку без изменений
+                raise FakeAPIError(400, "Bad Request: message is not modified")
+            message["reply_markup"] = reply_markup
+            self.edits[chat_id].append((message_id, reply_markup))
+            self._cond.notify_all()
+        self._notify(chat_id, message, True)
+        return message
+
+    def _api_answerCallbackQuery(self, params):
+        with self._cond:
+            self.callback_answers[params["callback_query_id"]] = params
+            self._cond.notify_all()
+        return True
+
+    def subscribe(self, callback):
+        """Подписывает callback(chat_id, message, edited) на сообщения и правки бота"""
+        self.listeners.append(callback)
+
+    def _notify(self, chat_id, message, edited):
+        for callback in self.listeners:
+            callback(chat_id, message, edited)
+
+    def push_update(self, update):
+        """
+        Доставляет обновление боту: на webhook, если он зарегистрирован,
+        иначе в очередь getUpdates. Возвращает HTTP статус webhook (или None).
+        """
+        with self._cond:
+            update["update_id"] = self.next_update_id
+            self.next_update_id += 1
+            webhook_url, secret = self.webhook_url, self.webhook_secret
+            if not webhook_url:
+                self.updates.append(update)
+                self._cond.notify_all()
+                return None
+
+        headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+        response = self.webhook_client.post(webhook_url, json=update, headers=headers)
+        return response.status_code
+
+    def send_text(self, chat_id, text, username=None):
+        """Имитирует текстовое сообщение пользователя"""
+        user = {"id": chat_id, "is_bot": False, "first_name": f"User{chat_id}",
+                "username": username or f"user{chat_id}"}
+        return self.push_update({
+            "message": {
+                "message_id": int(time.time() * 1000) % 2**31,
+                "from": user,
+                "chat": {"id": chat_id, "type": "private"},
+                "date": int(time.time()),
+                "text": text,
+            }
+        })
+
+    def press_button(self, chat_id, message_id, data, username=None):
+        """Имитирует нажатие inline кнопки под сообщением бота"""
+        user = {"id": chat_id, "is_bot": False, "first_name": f"User{chat_id}",
+                "username": username or f"user{chat_id}"}
+        with self._cond:
+            message = next(m for m in self.messages[chat_id] if m["message_id"] == message_id)
+            callback_id = f"{chat_id}-{self.next_update_id}"
+        self.push_update({
+            "callback_query": {
+                "id": callback_id,
+                "from": user,
+                "message": dict(message),
+                "chat_instance": str(chat_id),
+                "data": data,
+            }
+        })
+        return callback_id
+
+    def wait_for_edits(self, chat_id, count, timeout=5.0):
+        """Ждет, пока бот применит не менее count правок клавиатур в чате"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while len(self.edits[chat_id]) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Бот применил {len(self.edits[chat_id])} из {count} правок в {chat_id}")
+                self._cond.wait(remaining)
+            return list(self.edits[chat_id])
+
+    def wait_for_messages(self, chat_id, count, timeout=5.0):
+        """Ждет, пока бот отправит в чат не менее count сообщений"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while len(self.messages[chat_id]) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Бот отправил {len(self.messages[chat_id])} из {count} сообщений в {chat_id}")
+                self._cond.wait(remaining)
+            return list(self.messages[chat_id])
+
+
+def run_webhook_selfcheck():
+    """Прогоняет начало опроса через webhook на локальном FakeTelegram"""
+    import asyncio
+
+    fake = FakeTelegram().start()
+    # Настраиваем окружение до импорта бота: адрес API и отключенная база
+    os.environ['TELEGRAM_API_URL'] = fake.url
+    os.environ['SUPABASE_URL'] = ''
+    os.environ['SUPABASE_KEY'] = ''
+
+    from bot_simple import FullTelegramBot, HealthCheckHandler
+    from update_engine import UpdateEngine
+    from webhook import WebhookReceiver
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), HealthCheckHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    bot = FullTelegramBot("123:FAKE")
+    engine = UpdateEngine(bot)
+    webhook = WebhookReceiver(f"http://127.0.0.1:{server.server_port}", secret="selfcheck-secret")
+    webhook.attach(engine)
+    HealthCheckHandler.webhook = webhook
+    webhook.register(bot.api)
+    threading.Thread(target=asyncio.run, args=(engine.run(poll=False),), daemon=True).start()
+    while engine.loop is None:
+        time.sleep(0.01)
+
+    chat_id = 1001
+    assert fake.send_text(chat_id, "/start") == 200
+    messages = fake.wait_for_messages(chat_id, 1)
+    assert "Привіт" in messages[0]["text"], messages[0]["text"]
+
+    assert fake.send_text(chat_id, "🚀 Почати опитування") == 200
+    messages = fake.wait_for_messages(chat_id, 2)
+    assert messages[1]["text"].startswith("❓"), messages[1]["text"]
+
+    # Запрос без правильного секрета отклоняется
+    fake.webhook_secret = "wrong"
+    assert fake.send_text(chat_id, "/start") == 403
+
+    engine.stop()
+    server.shutdown()
+    fake.stop()
+    print("✅ Webhook режим работает с FakeTelegram")
+
+
+if __name__ == "__main__":
+    sys.exit(run_webhook_selfcheck())
@@ -0,0 +1,113 @@
+"""
+Защита от флуда и сброс нагрузки до обработки обновления.
+
+Каждый чат может прислать не больше FLOOD_LIMIT сообщений и нажатий за
+скользящее окно FLOOD_WINDOW секунд; лишние отбрасываются еще в
+UpdateEngine.dispatch, не доходя до handle_answer и не порождая ответов.
+Окно считается приближенно по двум соседним интервалам: число событий в
+текущем интервале плюс доля прошлого, пропорциональная тому, какая его
+часть еще попадает в окно. На чат хранятся три числа, проверка — O(1).
+
+Когда бот перегружен (в очереди обработки не меньше SHED_PENDING
+обновлений или в очереди исходящих не меньше SHED_OUTBOUND сообщений),
+первыми отбрасываются команды вне опроса (SHED_COMMANDS, по умолчанию
+/stats и /report), а ответы на вопросы продолжают обрабатываться. Режим
+выключается, когда обе очереди уменьшаются вдвое.
+"""
+
+import logging
+import os
+import time
+
+from metrics import UPDATES_SHED
+
+log = logging.getLogger(__name__)
+
+SHED_FLOOD = "flood"
+SHED_OVERLOAD = "overload"
+
+
+class FloodGuard:
+    def __init__(self, get_outbound_depth=None, limit=None, window=None, shed_pending=None,
+                 shed_outbound=None, shed_commands=None):
+        self.get_outbound_depth = get_outbound_depth or (lambda: 0)
+        self.limit = limit or int(os.getenv('FLOOD_LIMIT', 20))
+        self.window = window or float(os.getenv('FLOOD_WINDOW', 10))
+        self.shed_pending = shed_pending or int(os.getenv('SHED_PENDING', 500))
+        self.shed_outbound = shed_outbound or int(os.getenv('SHED_OUTBOUND', 500))
+        self.shed_commands = shed_commands or {
+            command.strip() for command in os.getenv('SHED_COMMANDS', '/stats,/report').split(',')
+            if command.strip()
+        }
+        self.chats = {}  # chat_id -> [номер интервала, событий в нем, событий в прошлом]
+        self._swept = 0  # Номер интервала последней очистки
+        self.overloaded = False
+
+        # Метрики
+        self.shed = {SHED_FLOOD: 0, SHED_OVERLOAD: 0}
+
+    def admit(self, update, chat_id, pending, now=None):
+        """
+        True, если обновление нужно обработать. Вызывается из потока event loop
+        движка, поэтому блокировки не нужны.
+        """
+        if "message" not in update and "callback_query" not in update:
+            return True  # Служебные и синтетические обновления не ограничиваются
+
+        self._update_overload(pending)
+        if self.overloaded:
+            text = update.get("message", {}).get("text", "")
+            if text.split("@", 1)[0].split(" ", 1)[0] in self.shed_commands:
+                return self._drop(SHED_OVERLOAD)
+
+        if chat_id is not None and not self._hit(chat_id, time.monotonic() if now is None else now):
+            return self._drop(SHED_FLOOD)
+        return True
+
+    def _hit(self, chat_id, now):
+        position = now / self.window
+        index = int(position)
+        if index != self._swept:
+            self._sweep(index)
+
+        state = self.chats.get(chat_id)
+        if state is None or state[0] < index - 1:
+            state = self.chats[chat_id] = [index, 0, 0]
+        elif state[0] == index - 1:
+            state[0], state[1], state[2] = index, 0, state[1]
+
+        # Прошлый интервал входит в окно на оставшуюся долю
+        estimate = state[2] * (1 - (position - index)) + state[1]
+        if estimate >= self.limit:
+            return False  # Отброшенные не считаются: поток сверх лимита режется до лимита
+        state[1] += 1
+        return True
+
+    def _sweep(self, index):
+        """Раз в интервал забывает чаты, молчавшие дольше окна"""
+        self._swept = index
+        for chat_id in [chat_id for chat_id, state in self.chats.items() if state[0] < index - 1]:
+            del self.chats[chat_id]
+
+    def _update_overload(self, pending):
+        depth = self.get_outbound_depth()
+        if self.overloaded:
+            # Выход из перегрузки — только когда очереди опустели наполовину, чтобы режим не мигал
+            overloaded = pending >= self.shed_pending // 2 or depth >= self.shed_outbound // 2
+        else:
+            overloaded = pending >= self.shed_pending or depth >= self.shed_outbound
+        if overloaded != self.overloaded:
+            self.overloaded = overloaded
+            if overloaded:
+                log.warning("🚧 Перегрузка: команды %s временно не обрабатываются",
+                            ", ".join(sorted(self.shed_commands)))
+            else:
+                log.info("✅ Нагрузка снизилась, все команды обрабатываются")
+
+    def _drop(self, reason):
+        self.shed[reason] += 1
+        UPDATES_SHED.inc(reason)
+        return False
+
+    def get_metrics(self):
+        return {"tracked_chats": len(self.chats), "overloaded": self.overloaded, "shed": dict(self.shed)}
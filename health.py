@@ -0,0 +1,95 @@
+"""
+Проверки для /healthz (liveness) и /readyz (readiness).
+
+Liveness отвечает на вопрос "жив ли процесс бота" (например, не умер ли
+поток обработки), readiness — "справляется ли он сейчас": давно ли был
+успешный getUpdates, не переполнена ли очередь исходящих и не копятся ли
+ответы для базы. Проверки читают только состояние в памяти, а результат
+кэшируется на HEALTH_CACHE_TTL секунд, так что частые запросы Railway
+ничего не стоят.
+"""
+
+import os
+import threading
+import time
+
+
+class HealthState:
+    def __init__(self, cache_ttl=None):
+        self.cache_ttl = cache_ttl if cache_ttl is not None else float(os.getenv('HEALTH_CACHE_TTL', 2))
+        self.liveness_checks = {}  # имя -> функция () -> (ok, значение)
+        self.readiness_checks = {}
+        self._cache = {}  # вид проверки -> (время, результат)
+        self._lock = threading.Lock()
+
+    def add_liveness(self, name, check):
+        with self._lock:
+            self.liveness_checks[name] = check
+            self._cache.clear()
+
+    def add_readiness(self, name, check):
+        with self._lock:
+            self.readiness_checks[name] = check
+            self._cache.clear()
+
+    def live(self):
+        """(ok, {имя: {"ok": ..., "value": ...}}) для /healthz"""
+        return self._evaluate("live", lambda: self.liveness_checks)
+
+    def ready(self):
+        """
+        То же для /readyz: неживой процесс не может быть готов, а пока бот
+        не зарегистрировал свои проверки, он еще запускается.
+        """
+        return self._evaluate("ready", lambda: {
+            **self.liveness_checks,
+            **(self.readiness_checks or {"startup": lambda: (False, "starting")}),
+        })
+
+    def _evaluate(self, kind, get_checks):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(kind)
+            if cached is not None and now - cached[0] < self.cache_ttl:
+                return cached[1]
+            checks = dict(get_checks())
+
+        details = {}
+        for name, check in checks.items():
+            try:
+                ok, value = check()
+            except Exception as e:
+                ok, value = False, f"{type(e).__name__}: {e}"
+            details[name] = {"ok": bool(ok), "value": value}
+        result = (all(item["ok"] for item in details.values()), details)
+
+        with self._lock:
+            self._cache[kind] = (now, result)
+        return result
+
+
+def max_age_check(get_timestamp, max_age):
+    """Проверка: событие (time.time() или None) было не раньше max_age секунд назад"""
+    def check():
+        timestamp = get_timestamp()
+        if timestamp is None:
+            return False, None
+        age = round(time.time() - timestamp, 1)
+        return age <= max_age, age
+    return check
+
+
+def max_value_check(get_value, limit):
+    """Проверка: значение не больше limit"""
+    def check():
+        value = get_value()
+        return value <= limit, value
+    return check
+
+
+def flag_check(get_flag):
+    """Проверка логического условия"""
+    def check():
+        flag = bool(get_flag())
+        return flag, flag
+    return check
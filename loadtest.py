@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест бота на виртуальных респондентах.
+
+Бот запускается целиком (UpdateEngine, очередь исходящих, журнал, запись в
+базу), но вместо api.telegram.org и Supabase работают FakeTelegram и
+FakeSupabase. Каждый респондент проходит QUESTIONS и ADDITIONAL_QUESTIONS:
+думает перед ответом (логнормальное время), иногда выбирает "Інше" и вводит
+свой вариант, пропускает текстовые вопросы или бросает опрос.
+
+    python loadtest.py --respondents 2000 --speed 20
+    python loadtest.py --respondents 500 --speed 0      # без пауз: предельная пропускная способность
+
+Отчет: обновления/с, p50/p99 времени от ответа пользователя до следующего
+сообщения бота, память на незавершенную сессию. При одинаковом --seed
+респонденты принимают одинаковые решения.
+"""
+
+import argparse
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from fake_supabase import FakeSupabase
+from fake_telegram import FakeTelegram
+from survey import (
+    START_BUTTON, FINISH_CHOICE_BUTTON, BACK_BUTTON, SKIP_BUTTON, OTHER_OPTION,
+)
+
+# Медианное время на размышление перед действием, секунды
+THINK_TIMES = {
+    "start": 3.0,
+    "choice": 4.0,
+    "toggle": 2.0,
+    "finish": 1.5,
+    "other": 12.0,
+    "text": 20.0,
+    "skip": 2.0,
+}
+THINK_SIGMA = 0.6
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+
+class Respondent:
+    __slots__ = ("chat_id", "rng", "question", "picks", "sent_at", "sent_kind", "finished", "abandoned")
+
+    def __init__(self, chat_id, seed):
+        self.chat_id = chat_id
+        self.rng = random.Random(seed * 1000003 + chat_id)
+        self.question = None  # Текст вопроса, на который сейчас отвечает
+        self.picks = None  # Оставшиеся варианты множественного выбора
+        self.sent_at = None  # Когда отправлено последнее действие
+        self.sent_kind = None
+        self.finished = False
+        self.abandoned = False
+
+    def react(self, message, edited, other_rate, skip_rate):
+        """
+        Решает, что ответить на сообщение бота.
+        Возвращает (вид действия, текст или callback_data) или None.
+        """
+        text = message.get("text", "")
+        markup = message.get("reply_markup") or {}
+        if "Дякуємо" in text:
+            self.finished = True
+            return None
+
+        if "inline_keyboard" in markup:
+            buttons = [(row[0]["text"], row[0]["callback_data"]) for row in markup["inline_keyboard"]]
+        else:
+            buttons = [(row[0]["text"], None) for row in markup.get("keyboard", [])]
+        labels = [label for label, _ in buttons]
+        if edited and FINISH_CHOICE_BUTTON not in labels:
+            # Итоговая правка inline клавиатуры, следующий вопрос придет отдельным сообщением
+            return None
+
+        if START_BUTTON in labels:
+            return "start", START_BUTTON
+        if BACK_BUTTON in labels:
+            return "other", f"Свій варіант {self.rng.randint(1, 1000)}"
+        if labels == [SKIP_BUTTON]:
+            if self.rng.random() < skip_rate:
+                return "skip", SKIP_BUTTON
+            return "text", f"Відповідь респондента {self.chat_id}"
+
+        options = [button for button in buttons if button[0] != FINISH_CHOICE_BUTTON]
+        if not options:
+            return None
+        other = next((i for i, (label, _) in enumerate(options) if label.endswith(OTHER_OPTION)), None)
+        if FINISH_CHOICE_BUTTON in labels:
+            if text != self.question or self.picks is None:
+                # Новый вопрос множественного выбора: заранее выбираем 1-3 варианта
+                self.question = text
+                regular = [i for i in range(len(options)) if i != other]
+                self.picks = self.rng.sample(regular, min(len(regular), self.rng.randint(1, 3)))
+                if other is not None and self.rng.random() < other_rate:
+                    self.picks.append(other)  # После "Інше" бот сразу ждет текст
+            if self.picks:
+                return "toggle", options[self.picks.pop(0)]
+            self.picks = None
+            return "finish", buttons[labels.index(FINISH_CHOICE_BUTTON)]
+
+        self.question = text
+        if other is not None and self.rng.random() < other_rate:
+            return "choice", options[other]
+        return "choice", self.rng.choice(options)
+
+
+class LoadTest:
+    def __init__(self, fake, respondents, speed, ramp, other_rate, skip_rate, abandon_rate, seed):
+        self.fake = fake
+        self.speed = speed
+        self.ramp = ramp
+        self.other_rate = other_rate
+        self.skip_rate = skip_rate
+        self.abandon_rate = abandon_rate
+        self.respondents = {chat_id: Respondent(chat_id, seed) for chat_id in range(10000, 10000 + respondents)}
+        self.turnarounds = []
+        self.turnarounds_by_kind = {}
+        self.updates = 0
+        self.unexpected = 0
+        self._heap = []  # (время, seq, chat_id, (вид, данные), message_id)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._active = len(self.respondents)
+        self.first_send = None
+        self.last_reply = None
+        fake.subscribe(self.on_bot_message)
+
+    def think(self, respondent, kind):
+        if not self.speed:
+            return 0.0
+        median = THINK_TIMES[kind]
+        return respondent.rng.lognormvariate(math.log(median), THINK_SIGMA) / self.speed
+
+    def on_bot_message(self, chat_id, message, edited):
+        respondent = self.respondents.get(chat_id)
+        if respondent is None or respondent.finished or respondent.abandoned:
+            return
+        now = time.perf_counter()
+        with self._cond:
+            if respondent.sent_at is not None:
+                self.turnarounds.append(now - respondent.sent_at)
+                self.turnarounds_by_kind.setdefault(respondent.sent_kind, []).append(now - respondent.sent_at)
+                respondent.sent_at = None
+                self.last_reply = now
+
+        action = respondent.react(message, edited, self.other_rate, self.skip_rate)
+        if action is None:
+            if respondent.finished:
+                self._retire()
+            elif not edited:
+                # Бот ответил чем-то, чего респондент не ожидал
+                with self._cond:
+                    self.unexpected += 1
+            return
+        # abandon_rate — доля респондентов, бросающих опрос где-то по пути (~30 шагов)
+        if respondent.rng.random() < self.abandon_rate / 30:
+            respondent.abandoned = True
+            self._retire()
+            return
+        self._schedule(now + self.think(respondent, action[0]), chat_id, action, message["message_id"])
+
+    def _schedule(self, due, chat_id, action, message_id=None):
+        with self._cond:
+            heapq.heappush(self._heap, (due, next(self._seq), chat_id, action, message_id))
+            self._cond.notify()
+
+    def _retire(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def run(self, timeout):
+        """Запускает респондентов и ждет, пока все закончат (или выйдет timeout)"""
+        started = time.perf_counter()
+        for chat_id in self.respondents:
+            self._schedule(started + random.Random(chat_id).uniform(0, self.ramp), chat_id, ("start", "/start"))
+
+        deadline = started + timeout
+        while True:
+            with self._cond:
+                while True:
+                    now = time.perf_counter()
+                    if self._active <= 0 or now >= deadline:
+                        return
+                    if self._heap and self._heap[0][0] <= now:
+                        _, _, chat_id, (kind, payload), message_id = heapq.heappop(self._heap)
+                        break
+                    wait = self._heap[0][0] - now if self._heap else deadline - now
+                    self._cond.wait(min(wait, deadline - now))
+                respondent = self.respondents[chat_id]
+                respondent.sent_at = time.perf_counter()
+                respondent.sent_kind = "/start" if payload == "/start" else kind
+                if self.first_send is None:
+                    self.first_send = respondent.sent_at
+                self.updates += 1
+
+            if isinstance(payload, tuple):
+                label, data = payload
+                if data is not None:
+                    self.fake.press_button(chat_id, message_id, data)
+                    continue
+                payload = label
+            self.fake.send_text(chat_id, payload)
+
+
+def measure_session_memory(count=10000):
+    """Память на одну незавершенную сессию в MemorySessionStore (середина опроса)"""
+    from sessions import MemorySessionStore, Session
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    store = MemorySessionStore()
+    for chat_id in range(count):
+        session = Session(chat_id, f"{chat_id:032x}", f"user{chat_id}")
+        session.current_question = 7
+        session.choices = {0: 1, 1: 0b1011, 2: 2, 3: 0b110, 5: 1, 6: 0}
+        session.texts = {"q5": "Відповідь на текстове питання"}
+        session.others = {4: "Свій варіант"}
+        store.save(session)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return size / count
+
+
+def run_loadtest(respondents=1000, speed=20.0, ramp=None, other_rate=0.15, skip_rate=0.3,
+                 abandon_rate=0.05, seed=1, inline=False, telegram_limits=False, db_latency=0.02,
+                 timeout=600):
+    """Прогоняет нагрузочный тест и печатает отчет; возвращает словарь результатов"""
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    fake_telegram = FakeTelegram().start()
+    fake_supabase = FakeSupabase(latency=db_latency).start()
+    os.environ.update(
+        TELEGRAM_API_URL=fake_telegram.url,
+        SUPABASE_URL=fake_supabase.url,
+        SUPABASE_KEY="loadtest-key",
+        POLL_TIMEOUT="1",
+        SPOOL_PATH=os.path.join(workdir, "responses.jsonl"),
+        SESSION_DB_PATH=os.path.join(workdir, "sessions.db"),
+        CHECKPOINT_PATH=os.path.join(workdir, "offset.json"),
+        KEYBOARD_MODE="inline" if inline else "reply",
+        LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"),
+    )
+    if not telegram_limits:
+        # Меряем бота, а не лимиты Telegram
+        os.environ.update(OUTBOUND_GLOBAL_RATE="1000000", OUTBOUND_CHAT_RATE="1000000",
+                          OUTBOUND_CHAT_BURST="1000")
+
+    # Конфигурация бота читается при импорте, поэтому импорт после настройки окружения
+    from botlog import setup_logging
+    setup_logging()
+    from bot_simple import FullTelegramBot
+    from checkpoint import UpdateCheckpoint
+    from update_engine import UpdateEngine
+
+    bot = FullTelegramBot("0:loadtest")
+    engine = UpdateEngine(bot, checkpoint=UpdateCheckpoint())
+    threading.Thread(target=asyncio.run, args=(engine.run(),), name="engine", daemon=True).start()
+
+    ramp = respondents / 100 if ramp is None else ramp
+    test = LoadTest(fake_telegram, respondents, speed, ramp, other_rate, skip_rate, abandon_rate, seed)
+    print(f"🧪 Нагрузочный тест: {respondents} респондентов, ускорение x{speed or '∞'}, "
+          f"разгон {ramp:.0f} с, {'inline' if inline else 'reply'} клавиатуры")
+    peak_sessions = 0
+
+    runner = threading.Thread(target=test.run, args=(timeout,), daemon=True)
+    runner.start()
+    while runner.is_alive():
+        peak_sessions = max(peak_sessions, len(bot.sessions))
+        runner.join(0.2)
+
+    # Дожидаемся записи завершенных опросов в базу
+    deadline = time.monotonic() + 30
+    while (bot.writer.backlog() or bot.journal.pending) and time.monotonic() < deadline:
+        time.sleep(0.1)
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    finished = sum(r.finished for r in test.respondents.values())
+    abandoned = sum(r.abandoned for r in test.respondents.values())
+    elapsed = (test.last_reply or time.perf_counter()) - (test.first_send or time.perf_counter())
+    result = {
+        "respondents": respondents,
+        "finished": finished,
+        "abandoned": abandoned,
+        "stuck": respondents - finished - abandoned,
+        "unexpected_replies": test.unexpected,
+        "updates": test.updates,
+        "elapsed_s": round(elapsed, 2),
+        "updates_per_s": round(test.updates / elapsed, 1) if elapsed > 0 else 0.0,
+        "turnaround_p50_ms": round(percentile(test.turnarounds, 50) * 1000, 2),
+        "turnaround_p99_ms": round(percentile(test.turnarounds, 99) * 1000, 2),
+        "rows_in_db": len(fake_supabase.rows()),
+        "peak_sessions": peak_sessions,
+        "session_bytes": round(measure_session_memory()),
+        # ru_maxrss в Linux — килобайты; включает FakeTelegram и FakeSupabase
+        "peak_rss_mb": round(rss_after / 1024, 1),
+    }
+
+    print(f"   завершили: {finished}, бросили: {abandoned}, зависли: {result['stuck']}, "
+          f"неожиданных ответов: {test.unexpected}")
+    print(f"   обновлений: {test.updates} за {result['elapsed_s']} с — {result['updates_per_s']} обновлений/с")
+    print(f"   ответ бота: p50 {result['turnaround_p50_ms']} мс, p99 {result['turnaround_p99_ms']} мс")
+    for kind, values in sorted(test.turnarounds_by_kind.items()):
+        print(f"      {kind:<8} p50 {percentile(values, 50) * 1000:8.2f} мс   p99 {percentile(values, 99) * 1000:8.2f} мс")
+    print(f"   строк в базе: {result['rows_in_db']}")
+    print(f"   память: {result['session_bytes']} байт на сессию (tracemalloc), "
+          f"пик сессий {peak_sessions}, пик RSS процесса {result['peak_rss_mb']} МБ")
+
+    engine.stop()
+    fake_telegram.stop()
+    fake_supabase.stop()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест на виртуальных респондентах")
+    parser.add_argument("--respondents", type=int, default=1000)
+    parser.add_argument("--speed", type=float, default=20.0, help="Ускорение времени на размышление (0 — без пауз)")
+    parser.add_argument("--ramp", type=float, help="За сколько секунд приходят все респонденты")
+    parser.add_argument("--other-rate", type=float, default=0.15, help="Доля ответов 'Інше'")
+    parser.add_argument("--skip-rate", type=float, default=0.3, help="Доля пропущенных текстовых вопросов")
+    parser.add_argument("--abandon-rate", type=float, default=0.05, help="Доля брошенных опросов")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--inline", action="store_true", help="Режим KEYBOARD_MODE=inline")
+    parser.add_argument("--telegram-limits", action="store_true", help="Не снимать лимиты отправки")
+    parser.add_argument("--db-latency", type=float, default=0.02, help="Задержка FakeSupabase, секунды")
+    parser.add_argument("--timeout", type=float, default=600)
+    args = parser.parse_args()
+
+    result = run_loadtest(
+        args.respondents, args.speed, args.ramp, args.other_rate, args.skip_rate, args.abandon_rate,
+        args.seed, args.inline, args.telegram_limits, args.db_latency, args.timeout,
+    )
+    return 0 if result["stuck"] == 0 and result["unexpected_replies"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
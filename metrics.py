@@ -0,0 +1,308 @@
+"""
+Метрики в формате Prometheus для эндпоинта /metrics.
+
+Счетчики и гистограммы не берут блокировку на каждое событие: каждый поток
+пишет в свой шард (словарь в threading.local), а при запросе /metrics шарды
+всех потоков суммируются. Блокировка нужна только при первом обращении
+потока к метрике. Когда поток завершается, его шард прибавляется к общему
+остатку метрики и удаляется, поэтому короткоживущие потоки не копят
+словари. Гейджи вычисляются в момент запроса через функцию.
+
+    UPDATES = REGISTRY.counter("bot_updates_total", "Обновления", ("type",))
+    UPDATES.inc("message")
+    LATENCY = REGISTRY.histogram("bot_handler_seconds", "Обработчики", ("handler",))
+    LATENCY.observe(0.012, "process_answer")
+"""
+
+import bisect
+import functools
+import math
+import threading
+import time
+import weakref
+
+from profiling import PROFILER
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _ThreadOwner:
+    """Живет в threading.local рядом с шардом и удаляется вместе с потоком"""
+
+    __slots__ = ("__weakref__",)
+
+
+class _ShardedMetric:
+    """Общая часть счетчика и гистограммы: шард значений на каждый поток"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}  # Сумма шардов завершившихся потоков
+        # RLock: финализатор может сработать при сборке мусора внутри уже взятой блокировки
+        self._lock = threading.RLock()
+
+    def _shard(self):
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            owner = self._local.owner = _ThreadOwner()
+            with self._lock:
+                self._shards.append(values)
+            finalizer = weakref.finalize(owner, self._retire, values)
+            finalizer.atexit = False
+            return values
+
+    def _retire(self, values):
+        """Переносит шард завершившегося потока в общий остаток"""
+        with self._lock:
+            self._shards = [shard for shard in self._shards if shard is not values]
+            for labels, value in list(values.items()):
+                self._fold(self._retired, labels, value)
+
+    def _fold(self, total, labels, value):
+        raise NotImplementedError
+
+    def _snapshots(self):
+        # Копии под блокировкой: шард не попадет в снимок дважды, пока переносится в остаток.
+        # Копия словаря атомарна под GIL, поток-владелец может продолжать запись
+        with self._lock:
+            return [dict(self._retired)] + [dict(shard) for shard in self._shards]
+
+
+class Counter(_ShardedMetric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        values = self._shard()
+        values[labels] = values.get(labels, 0) + amount
+
+    def _fold(self, total, labels, value):
+        total[labels] = total.get(labels, 0) + value
+
+    def collect(self):
+        """Сумма по всем потокам: labels -> значение"""
+        total = {}
+        for shard in self._snapshots():
+            for labels, value in shard.items():
+                self._fold(total, labels, value)
+        return total
+
+    def render(self):
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in sorted(self.collect().items())
+        ]
+
+
+class Histogram(_ShardedMetric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        values = self._shard()
+        state = values.get(labels)
+        if state is None:
+            # Счетчики корзин (последняя — +Inf), затем сумма и количество
+            state = values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def time(self, *labels):
+        """Контекстный менеджер, измеряющий длительность блока"""
+        return _Timer(self, labels)
+
+    def _fold(self, total, labels, state):
+        # Всегда новый список: остаток копируется в снимок без глубокого копирования
+        merged = total.get(labels)
+        total[labels] = list(state) if merged is None else [a + b for a, b in zip(merged, state)]
+
+    def collect(self):
+        total = {}
+        for shard in self._snapshots():
+            for labels, state in shard.items():
+                self._fold(total, labels, state)
+        return total
+
+    def render(self):
+        lines = []
+        for labels, state in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), state):
+                cumulative += count
+                le = ("le", _format_value(float(bound)))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{label_text} {state[-1]}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class Gauge:
+    """Значение, которое вычисляется при запросе /metrics"""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, func, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # func возвращает число или (при labelnames) словарь labels -> число
+        self.func = func
+
+    def render(self):
+        value = self.func()
+        if value is None:
+            return []
+        if not self.labelnames:
+            return [f"{self.name} {_format_value(value)}"]
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(item)}"
+            for labels, item in sorted(value.items())
+        ]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self.metrics.get(metric.name)
+            # Счетчики переживают повторное создание бота, гейджи перепривязываются
+            if existing is not None and existing.kind == metric.kind and metric.kind != "gauge":
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, func, labelnames=()):
+        return self._register(Gauge(name, documentation, func, labelnames))
+
+    def render(self):
+        """Текст для /metrics в формате Prometheus"""
+        with self._lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # Ошибка одного гейджа не должна ломать весь ответ
+                lines.append(f"# ERROR {metric.name}: {_escape(e)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+UPDATES_RECEIVED = REGISTRY.counter(
+    "bot_updates_received_total", "Обновления, принятые от Telegram", ("type",)
+)
+UPDATES_DUPLICATE = REGISTRY.counter(
+    "bot_updates_duplicate_total", "Повторно доставленные обновления, которые были отброшены"
+)
+UPDATES_SHED = REGISTRY.counter(
+    "bot_updates_shed_total", "Обновления, отброшенные защитой от флуда или при перегрузке", ("reason",)
+)
+UPDATES_HANDLED = REGISTRY.counter(
+    "bot_updates_handled_total", "Обработанные обновления", ("result",)
+)
+UPDATE_SECONDS = REGISTRY.histogram(
+    "bot_update_seconds", "Полное время обработки одного обновления"
+)
+UPDATE_LAG_SECONDS = REGISTRY.histogram(
+    "bot_update_lag_seconds", "Задержка от отправки сообщения пользователем до приема ботом",
+    buckets=(0.5, 1, 2, 5, 10, 30, 60, 300, 1800),
+)
+HANDLER_SECONDS = REGISTRY.histogram(
+    "bot_handler_seconds", "Время работы обработчиков бота", ("handler",)
+)
+TELEGRAM_CALL_SECONDS = REGISTRY.histogram(
+    "bot_telegram_call_seconds", "Задержка вызовов Bot API", ("method",),
+    buckets=DEFAULT_BUCKETS + (30.0, 60.0),
+)
+TELEGRAM_ERRORS = REGISTRY.counter(
+    "bot_telegram_errors_total", "Ошибки вызовов Bot API по кодам", ("method", "code")
+)
+DB_INSERT_SECONDS = REGISTRY.histogram(
+    "bot_db_insert_seconds", "Задержка записи пачки ответов в Supabase", ("result",)
+)
+DB_CALL_SECONDS = REGISTRY.histogram(
+    "bot_db_call_seconds", "Задержка запросов к Supabase REST (DB_CLIENT=async)", ("operation", "result")
+)
+DB_ROWS_SAVED = REGISTRY.counter(
+    "bot_db_rows_saved_total", "Ответы, записанные в Supabase"
+)
+
+
+def timed(handler):
+    """
+    Декоратор: время работы метода попадает в HANDLER_SECONDS{handler=...}
+    и в скользящие гистограммы профилировщика (profiling.PROFILER)
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                HANDLER_SECONDS.observe(elapsed, handler)
+                PROFILER.record(handler, elapsed)
+        return wrapper
+    return decorator
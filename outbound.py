@@ -0,0 +1,311 @@
+"""
+Планировщик исходящих сообщений с учетом лимитов Telegram.
+
+Сообщения ставятся в очередь и отправляются пулом потоков с двумя
+token bucket'ами: общий лимит бота (~30 сообщений/с) и лимит на чат.
+Ответы 429 повторяются после retry_after, сетевые ошибки и 5xx — с
+ограниченной экспоненциальной задержкой. Внутри чата порядок сообщений
+сохраняется, а между чатами первыми уходят сообщения с высоким приоритетом
+(следующий вопрос опроса важнее ответа на /stats).
+
+Чтобы поток вопросов под нагрузкой не задерживал остальное бесконечно,
+после OUTBOUND_PRIORITY_BURST отправок подряд из старшего приоритета,
+пока ждут младшие, уходит одно сообщение младшего приоритета — того,
+что ждет дольше. Так младшие получают не меньше 1/(BURST+1) пропускной
+способности.
+"""
+
+import logging
+import os
+import heapq
+import itertools
+import random
+import threading
+import time
+from collections import deque
+
+from telegram_api import TelegramAPIError
+
+log = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 0  # Следующий вопрос опроса
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2  # /stats и другие служебные ответы
+
+PRIORITY_NAMES = {PRIORITY_HIGH: "high", PRIORITY_NORMAL: "normal", PRIORITY_LOW: "low"}
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def wait_time(self, now):
+        """Сколько секунд ждать до появления токена (0 — можно отправлять)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class OutboundMessage:
+    __slots__ = ("chat_id", "method", "params", "priority", "seq", "attempts", "coalesce_key")
+
+    def __init__(self, chat_id, method, params, priority, seq, coalesce_key=None):
+        self.chat_id = chat_id
+        self.method = method
+        self.params = params
+        self.priority = priority
+        self.seq = seq
+        self.attempts = 0
+        self.coalesce_key = coalesce_key
+
+
+class _ChatQueue:
+    __slots__ = ("messages", "bucket", "priority", "gen", "busy", "delayed")
+
+    def __init__(self, bucket):
+        self.messages = deque()
+        self.bucket = bucket
+        self.priority = PRIORITY_LOW
+        self.gen = -1  # Поколение записи в куче: устаревшие записи пропускаются
+        self.busy = False
+        self.delayed = False  # Ждет в отложенной куче (лимит чата или повтор)
+
+
+class OutboundScheduler:
+    def __init__(self, api, global_rate=None, per_chat_rate=None, per_chat_burst=None,
+                 max_retries=None, workers=None, priority_burst=None):
+        self.api = api
+        self.global_rate = global_rate or float(os.getenv('OUTBOUND_GLOBAL_RATE', 30))
+        self.per_chat_rate = per_chat_rate or float(os.getenv('OUTBOUND_CHAT_RATE', 1))
+        self.per_chat_burst = per_chat_burst or int(os.getenv('OUTBOUND_CHAT_BURST', 3))
+        self.max_retries = max_retries or int(os.getenv('OUTBOUND_MAX_RETRIES', 5))
+        self.workers = workers or int(os.getenv('OUTBOUND_WORKERS', 8))
+        self.priority_burst = priority_burst or int(os.getenv('OUTBOUND_PRIORITY_BURST', 4))
+        self.base_backoff = 0.5
+        self.max_backoff = 30.0
+
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._global_bucket = TokenBucket(self.global_rate, self.global_rate, time.monotonic())
+        self._chats = {}  # chat_id -> _ChatQueue
+        # priority -> куча (seq, gen, chat_id): чаты, которые можно отправлять
+        self._ready = {priority: [] for priority in PRIORITY_NAMES}
+        self._streak = 0  # Отправок подряд из старшего приоритета, пока ждали младшие
+        self._delayed = []  # Куча (ready_at, priority, seq, gen, chat_id) — ждут лимита или повтора
+        self._threads = []
+        self._stopping = False
+
+        # Метрики
+        self.depth_by_priority = {priority: 0 for priority in PRIORITY_NAMES}
+        self.max_depth = 0
+        self.in_flight = 0
+        self.sent = 0
+        self.retried = 0
+        self.rate_limited = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.promoted = 0  # Отправок младшего приоритета вне очереди
+
+    def start(self):
+        """Запускает потоки отправки"""
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"outbound-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+
+    def submit(self, chat_id, method, params, priority=PRIORITY_NORMAL, coalesce_key=None):
+        """
+        Ставит вызов Bot API в очередь чата.
+        Если в очереди уже ждет вызов с тем же coalesce_key (например, правка
+        клавиатуры того же сообщения), он заменяется новым вместо второй отправки.
+        """
+        with self._cond:
+            chat = self._chats.get(chat_id)
+            if coalesce_key is not None and chat is not None:
+                # Первое сообщение может уже отправляться — его не трогаем
+                for queued in itertools.islice(chat.messages, 1 if chat.busy else 0, None):
+                    if queued.coalesce_key == coalesce_key:
+                        queued.params = params
+                        self.coalesced += 1
+                        return
+
+            message = OutboundMessage(chat_id, method, params, priority, next(self._seq), coalesce_key)
+            if chat is None:
+                bucket = TokenBucket(self.per_chat_rate, self.per_chat_burst, time.monotonic())
+                chat = self._chats[chat_id] = _ChatQueue(bucket)
+                chat.priority = priority
+                chat.messages.append(message)
+                self._schedule(chat, chat_id)
+            else:
+                chat.messages.append(message)
+                if priority < chat.priority:
+                    # Сообщения чата уходят по порядку, поэтому повышаем приоритет всей очереди
+                    chat.priority = priority
+                    if not chat.busy and not chat.delayed:
+                        self._schedule(chat, chat_id)
+
+            self.depth_by_priority[priority] += 1
+            depth = self.queue_depth()
+            if depth > self.max_depth:
+                self.max_depth = depth
+            self._cond.notify()
+
+    def queue_depth(self):
+        return sum(self.depth_by_priority.values())
+
+    def get_metrics(self):
+        """Снимок метрик очереди"""
+        with self._cond:
+            return {
+                "queue_depth": self.queue_depth(),
+                "queue_depth_by_priority": {
+                    PRIORITY_NAMES[priority]: depth for priority, depth in self.depth_by_priority.items()
+                },
+                "max_queue_depth": self.max_depth,
+                "chats_waiting": len(self._chats),
+                "in_flight": self.in_flight,
+                "sent": self.sent,
+                "retried": self.retried,
+                "rate_limited": self.rate_limited,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+                "promoted": self.promoted,
+            }
+
+    def _schedule(self, chat, chat_id, ready_at=None):
+        # Поколение берется из общего счетчика, чтобы не совпасть с записями удаленной очереди
+        chat.gen = next(self._seq)
+        chat.delayed = ready_at is not None
+        head = chat.messages[0]
+        if ready_at is None:
+            heapq.heappush(self._ready[chat.priority], (head.seq, chat.gen, chat_id))
+        else:
+            heapq.heappush(self._delayed, (ready_at, chat.priority, head.seq, chat.gen, chat_id))
+
+    def _next_message(self):
+        """Ждет, пока можно отправить следующее сообщение (вызывается под блокировкой)"""
+        while not self._stopping:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, _, seq, gen, chat_id = heapq.heappop(self._delayed)
+                chat = self._chats.get(chat_id)
+                if chat is not None and chat.gen == gen:
+                    chat.delayed = False
+                    heapq.heappush(self._ready[chat.priority], (seq, gen, chat_id))
+
+            timeout = self._delayed[0][0] - now if self._delayed else None
+            waiting = [priority for priority, heap in sorted(self._ready.items()) if heap]
+            if waiting:
+                global_wait = self._global_bucket.wait_time(now)
+                if global_wait == 0:
+                    priority = self._pick_priority(waiting)
+                    _, gen, chat_id = heapq.heappop(self._ready[priority])
+                    chat = self._chats.get(chat_id)
+                    if chat is None or chat.gen != gen or chat.busy:
+                        continue
+                    chat_wait = chat.bucket.wait_time(now)
+                    if chat_wait > 0:
+                        self._schedule(chat, chat_id, now + chat_wait)
+                        continue
+                    if len(waiting) == 1:
+                        self._streak = 0
+                    elif priority == waiting[0]:
+                        self._streak += 1
+                    else:
+                        self._streak = 0
+                        self.promoted += 1
+                    self._global_bucket.take()
+                    chat.bucket.take()
+                    chat.busy = True
+                    self.in_flight += 1
+                    return chat_id, chat, chat.messages[0]
+                timeout = global_wait if timeout is None else min(timeout, global_wait)
+
+            self._cond.wait(timeout)
+        return None
+
+    def _pick_priority(self, waiting):
+        """Старший из ждущих приоритетов, а после серии из priority_burst — младший, ждущий дольше"""
+        if len(waiting) == 1 or self._streak < self.priority_burst:
+            return waiting[0]
+        # seq растет со временем постановки: меньший seq у головы кучи — дольше ждет
+        return min(waiting[1:], key=lambda priority: self._ready[priority][0][0])
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                item = self._next_message()
+            if item is None:
+                return
+            chat_id, chat, message = item
+
+            error = None
+            try:
+                self.api.call(message.method, message.params)
+            except TelegramAPIError as e:
+                error = e
+
+            with self._cond:
+                self.in_flight -= 1
+                chat.busy = False
+                if error is None:
+                    self.sent += 1
+                    self._complete(chat, chat_id)
+                else:
+                    self._handle_error(chat, chat_id, message, error)
+                self._cond.notify()
+
+    def _complete(self, chat, chat_id):
+        """Убирает отправленное (или отброшенное) сообщение из очереди чата"""
+        message = chat.messages.popleft()
+        self.depth_by_priority[message.priority] -= 1
+        if chat.messages:
+            chat.priority = min(m.priority for m in chat.messages)
+            self._schedule(chat, chat_id)
+        else:
+            del self._chats[chat_id]
+
+    def _handle_error(self, chat, chat_id, message, error):
+        message.attempts += 1
+        now = time.monotonic()
+
+        if error.error_code == 429:
+            # Telegram сам говорит, сколько ждать
+            self.rate_limited += 1
+            if message.attempts <= self.max_retries:
+                self.retried += 1
+                log.warning("⏳ 429 для %s, повтор через %s с", chat_id, error.retry_after)
+                self._schedule(chat, chat_id, now + (error.retry_after or 1))
+                return
+        elif error.error_code is None or error.error_code >= 500:
+            if message.attempts <= self.max_retries:
+                self.retried += 1
+                backoff = min(self.max_backoff, self.base_backoff * 2 ** (message.attempts - 1))
+                backoff *= random.uniform(0.8, 1.2)
+                self._schedule(chat, chat_id, now + backoff)
+                return
+        elif error.error_code == 400 and "message is not modified" in error.description:
+            # Повторная правка сообщения к тому же виду: результат уже достигнут
+            self.sent += 1
+            self._complete(chat, chat_id)
+            return
+
+        # 4xx (бот заблокирован, неверный запрос) или исчерпаны повторы
+        self.dropped += 1
+        log.error("❌ Сообщение для %s отброшено после %s попыток: %s", chat_id, message.attempts, error)
+        self._complete(chat, chat_id)
@@ -0,0 +1,172 @@
+"""
+Профилирование обработки обновлений без перезапуска.
+
+Каждый обработчик, помеченный metrics.timed, и каждый вызов Bot API
+попадают в скользящие гистограммы за последние PROFILE_WINDOW секунд:
+в отличие от /metrics, где счетчики копятся с запуска, здесь видно, что
+тормозит прямо сейчас. Время вложенных обработчиков включает время
+вызванных ими.
+
+Обновление, которое обрабатывалось дольше PROFILE_SLOW_UPDATE секунд,
+сохраняется в выборку медленных вместе с типом, фазой опроса и временем
+по обработчикам (последние PROFILE_SLOW_KEEP штук).
+
+sample_stacks — статистический профилировщик: на протяжении N секунд
+снимает стеки всех потоков через sys._current_frames и возвращает их в
+свернутом формате (folded stacks), который понимают flamegraph.pl и
+speedscope. Профиль по времени "на часах", ожидание тоже попадает в него.
+"""
+
+import bisect
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+# Границы корзин: от 0.1 мс до ~100 с, каждая в 1.5 раза больше предыдущей
+ROLLING_BUCKETS = tuple(0.0001 * 1.5 ** i for i in range(35))
+
+
+class RollingHistogram:
+    """Гистограмма за последние window секунд: кольцо из slots интервалов"""
+
+    def __init__(self, window, slots=10):
+        self.slot_seconds = window / slots
+        self.slots = [[-1, [0] * (len(ROLLING_BUCKETS) + 1), 0.0] for _ in range(slots)]
+        self._lock = threading.Lock()
+
+    def observe(self, value, now=None):
+        epoch = int((now or time.monotonic()) // self.slot_seconds)
+        slot = self.slots[epoch % len(self.slots)]
+        with self._lock:
+            if slot[0] != epoch:
+                # Интервал устарел — начинаем его заново
+                slot[0] = epoch
+                slot[1] = [0] * (len(ROLLING_BUCKETS) + 1)
+                slot[2] = 0.0
+            slot[1][bisect.bisect_left(ROLLING_BUCKETS, value)] += 1
+            slot[2] = max(slot[2], value)
+
+    def snapshot(self, now=None):
+        """{"count", "p50", "p90", "p99", "max"} за окно (квантили — по верхней границе корзины)"""
+        epoch = int((now or time.monotonic()) // self.slot_seconds)
+        counts = [0] * (len(ROLLING_BUCKETS) + 1)
+        max_value = 0.0
+        with self._lock:
+            for slot_epoch, slot_counts, slot_max in self.slots:
+                if epoch - slot_epoch < len(self.slots):
+                    counts = [a + b for a, b in zip(counts, slot_counts)]
+                    max_value = max(max_value, slot_max)
+        total = sum(counts)
+        result = {"count": total, "max": round(max_value, 6)}
+        for name, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+            result[name] = self._quantile(counts, total, q, max_value)
+        return result
+
+    @staticmethod
+    def _quantile(counts, total, q, max_value):
+        if not total:
+            return None
+        rank = q * total
+        cumulative = 0
+        for bound, count in zip(ROLLING_BUCKETS, counts):
+            cumulative += count
+            if cumulative >= rank:
+                return round(min(bound, max_value), 6)
+        return round(max_value, 6)
+
+
+class _Trace:
+    """Время по обработчикам внутри одного обновления"""
+
+    __slots__ = ("kind", "phase", "started", "spans")
+
+    def __init__(self, kind, phase):
+        self.kind = kind
+        self.phase = phase
+        self.started = time.perf_counter()
+        self.spans = {}  # обработчик -> (вызовы, секунды)
+
+
+class UpdateProfiler:
+    def __init__(self, window=None, slow_threshold=None, slow_keep=None):
+        self.window = window or float(os.getenv('PROFILE_WINDOW', 300))
+        self.slow_threshold = slow_threshold or float(os.getenv('PROFILE_SLOW_UPDATE', 0.5))
+        self.histograms = {}  # имя -> RollingHistogram
+        self.slow = deque(maxlen=slow_keep or int(os.getenv('PROFILE_SLOW_KEEP', 50)))
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def record(self, name, elapsed):
+        """Время одного вызова обработчика (из metrics.timed) или Bot API"""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, RollingHistogram(self.window))
+        histogram.observe(elapsed)
+
+        trace = getattr(self._local, "trace", None)
+        if trace is not None:
+            calls, total = trace.spans.get(name, (0, 0.0))
+            trace.spans[name] = (calls + 1, total + elapsed)
+
+    def begin(self, kind, phase):
+        """Начинает разбор обновления в текущем потоке"""
+        self._local.trace = _Trace(kind, phase)
+
+    def end(self):
+        """Заканчивает разбор обновления; медленное попадает в выборку"""
+        trace = self._local.trace
+        self._local.trace = None
+        elapsed = time.perf_counter() - trace.started
+        self.record(f"update.{trace.kind}", elapsed)
+        if elapsed >= self.slow_threshold:
+            self.slow.append({
+                "at": round(time.time(), 3),
+                "type": trace.kind,
+                "phase": trace.phase,
+                "seconds": round(elapsed, 6),
+                "handlers": {
+                    name: {"calls": calls, "seconds": round(total, 6)}
+                    for name, (calls, total) in trace.spans.items()
+                },
+            })
+
+    def report(self):
+        """Скользящие гистограммы и медленные обновления для /debug/timings"""
+        with self._lock:
+            histograms = dict(self.histograms)
+        return {
+            "window_seconds": self.window,
+            "slow_threshold_seconds": self.slow_threshold,
+            "timings": {name: histograms[name].snapshot() for name in sorted(histograms)},
+            "slow_updates": list(self.slow),
+        }
+
+
+PROFILER = UpdateProfiler()
+
+
+def sample_stacks(seconds, interval=0.01, max_depth=64):
+    """
+    Снимает стеки всех потоков (кроме своего) каждые interval секунд и
+    возвращает строки "поток;функция (файл:строка);... число_снимков".
+    """
+    own = threading.get_ident()
+    counts = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None and len(stack) < max_depth:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            counts[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
@@ -0,0 +1,117 @@
+"""
+Напоминания о брошенных опросах (REMINDER_AFTER > 0).
+
+Сессии индексируются кучей по времени, когда пора напомнить: последняя
+активность плюс REMINDER_AFTER секунд (для следующего напоминания —
+кратно больше). Каждое сохранение сессии добавляет новую запись, а
+устаревшие записи отбрасываются при извлечении (ленивое удаление), так что
+планировщик никогда не перебирает все чаты.
+
+Напоминание не отправляется отсюда напрямую: в движок уходит синтетическое
+обновление {"reminder": ...}, и бот обрабатывает его в очереди чата, как
+обычное сообщение. Поэтому напоминание не пересекается с ответом
+пользователя, а сообщения уходят с низким приоритетом. Отправка ограничена
+REMINDER_RATE в секунду и приостанавливается, пока движок перегружен; на
+один опрос приходится не больше REMINDER_MAX напоминаний.
+"""
+
+import heapq
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class ReminderScheduler:
+    def __init__(self, sessions, submit, is_busy=None, after=None, max_reminders=None, rate=None):
+        self.sessions = sessions
+        self.submit = submit  # engine.submit
+        self.is_busy = is_busy or (lambda: False)
+        self.after = after if after is not None else float(os.getenv('REMINDER_AFTER', 0))
+        self.max_reminders = max_reminders or int(os.getenv('REMINDER_MAX', 1))
+        self.rate = rate or float(os.getenv('REMINDER_RATE', 5))
+        self.heap = []  # (когда напомнить, chat_id, updated_at сессии, уже отправлено)
+        self.latest = {}  # chat_id -> актуальная запись кучи
+        self._cond = threading.Condition()
+        self.thread = None
+
+        # Метрики
+        self.sent = 0
+        self.stale = 0
+
+    @property
+    def enabled(self):
+        return self.after > 0
+
+    def start(self):
+        """Индексирует восстановленные сессии и запускает планировщик"""
+        if not self.enabled:
+            return self
+        for session in self.sessions.values():
+            self.touch(session)
+        self.thread = threading.Thread(target=self._run, name="reminders", daemon=True)
+        self.thread.start()
+        log.info("⏰ Напоминания через %.0f с бездействия (не больше %s на опрос)", self.after, self.max_reminders)
+        return self
+
+    def touch(self, session):
+        """Сессия сохранена: переносит ее напоминание (если лимит не исчерпан)"""
+        if not self.enabled:
+            return
+        with self._cond:
+            if session.reminders >= self.max_reminders:
+                self.latest.pop(session.chat_id, None)
+                return
+            due = session.updated_at + self.after * (session.reminders + 1)
+            entry = (due, session.chat_id, session.updated_at, session.reminders)
+            self.latest[session.chat_id] = entry
+            heapq.heappush(self.heap, entry)
+            if self.heap[0] is entry:
+                self._cond.notify()
+            if len(self.heap) > 4 * len(self.latest) + 1024:
+                # Устаревших записей стало слишком много — перестраиваем кучу
+                self.heap = list(self.latest.values())
+                heapq.heapify(self.heap)
+
+    def pending(self):
+        with self._cond:
+            return len(self.latest)
+
+    def _pop_due(self):
+        """Ждет следующее актуальное напоминание и возвращает его запись"""
+        with self._cond:
+            while True:
+                if not self.heap:
+                    self._cond.wait()
+                    continue
+                entry = self.heap[0]
+                delay = entry[0] - time.time()
+                if delay > 0:
+                    self._cond.wait(min(delay, 60))
+                    continue
+                heapq.heappop(self.heap)
+                chat_id = entry[1]
+                if self.latest.get(chat_id) is not entry:
+                    continue  # Сессия с тех пор обновлялась
+                del self.latest[chat_id]
+                return entry
+
+    def _run(self):
+        interval = 1 / self.rate
+        while True:
+            due, chat_id, updated_at, reminders = self._pop_due()
+            session = self.sessions.get(chat_id)
+            if session is None or session.updated_at != updated_at:
+                self.stale += 1
+                continue
+            while self.is_busy():
+                # Сначала отвечаем активным пользователям
+                time.sleep(0.5)
+            self.submit({"reminder": {"chat_id": chat_id, "updated_at": updated_at}})
+            self.sent += 1
+            time.sleep(interval)
+
+    def get_metrics(self):
+        return {"pending": self.pending(), "sent": self.sent, "stale": self.stale}
@@ -0,0 +1,299 @@
+"""
+Хранилище незавершенных опросов.
+
+Состояние опроса одного чата хранится в компактной записи Session: вместо
+строк вариантов хранятся их индексы (для множественного выбора — битовая
+маска), а полный словарь ответов собирается только при завершении опроса.
+
+Бэкенды:
+- MemorySessionStore — словарь в памяти процесса;
+- SQLiteSessionStore — тот же словарь плюс запись в SQLite на диске, чтобы
+  перезапуск или редеплой не сбрасывал прогресс респондентов.
+
+Сессии, не обновлявшиеся дольше SESSION_TTL секунд, удаляются.
+
+В многопроцессном режиме (shard.py) у каждого процесса свой файл SQLite
+(shard_path), а reshard_sqlite_sessions перекладывает сессии между файлами,
+если изменилось число процессов.
+"""
+
+import glob
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+PHASE_MAIN = "main"
+PHASE_ADDITIONAL = "additional"
+
+
+class Session:
+    __slots__ = (
+        "chat_id",
+        "phase",
+        "current_question",
+        "waiting_for_other",
+        "other_question",  # Индекс вопроса, для которого вводится "Інше"
+        "choices",  # Индекс вопроса -> индекс варианта или битовая маска
+        "texts",  # Ключ ответа -> текст (текстовые вопросы)
+        "others",  # Индекс вопроса -> текст варианта "Інше"
+        "username",
+        "submission_id",
+        "updated_at",
+        "reminders",  # Сколько напоминаний об этом опросе уже отправлено
+    )
+
+    def __init__(self, chat_id, submission_id, username=""):
+        self.chat_id = chat_id
+        self.phase = PHASE_MAIN
+        self.current_question = 0
+        self.waiting_for_other = False
+        self.other_question = None
+        self.choices = {}
+        self.texts = {}
+        self.others = {}
+        self.username = username
+        self.submission_id = submission_id
+        self.updated_at = time.time()
+        self.reminders = 0
+
+    def toggle_choice(self, question_index, option_index):
+        """Переключает вариант множественного выбора"""
+        self.choices[question_index] = self.choices.get(question_index, 0) ^ (1 << option_index)
+
+    def is_selected(self, question_index, option_index):
+        return bool(self.choices.get(question_index, 0) >> option_index & 1)
+
+    def build_answers(self, questions, additional_questions):
+        """Собирает словарь ответов в формате, который сохраняется в базу"""
+        answers = {}
+        for index, question in enumerate(questions):
+            key = f"q{question['id']}"
+            if question['type'] == 'text':
+                if key in self.texts:
+                    answers[key] = self.texts[key]
+            elif question['type'] == 'single_choice':
+                if index in self.others:
+                    answers[key] = f"Інше: {self.others[index]}"
+                elif index in self.choices:
+                    answers[key] = question['options'][self.choices[index]]
+            elif question['type'] == 'multiple_choice':
+                if index in self.choices or index in self.others:
+                    mask = self.choices.get(index, 0)
+                    selected = [option for i, option in enumerate(question['options']) if mask >> i & 1]
+                    if index in self.others:
+                        selected.append(f"Інше: {self.others[index]}")
+                    answers[key] = selected
+        for question in additional_questions:
+            if question['id'] in self.texts:
+                answers[question['id']] = self.texts[question['id']]
+        return answers
+
+    def to_record(self):
+        """Компактное представление для хранения на диске"""
+        return [
+            self.phase,
+            self.current_question,
+            self.waiting_for_other,
+            self.other_question,
+            list(self.choices.items()),
+            self.texts,
+            list(self.others.items()),
+            self.username,
+            self.submission_id,
+            self.reminders,
+        ]
+
+    @classmethod
+    def from_record(cls, chat_id, record, updated_at):
+        (phase, current_question, waiting_for_other, other_question,
+         choices, texts, others, username, submission_id) = record[:9]
+        session = cls(chat_id, submission_id, username)
+        # Записи, сохраненные до появления напоминаний, короче
+        session.reminders = record[9] if len(record) > 9 else 0
+        session.phase = phase
+        session.current_question = current_question
+        session.waiting_for_other = waiting_for_other
+        session.other_question = other_question
+        session.choices = dict(choices)
+        session.texts = texts
+        session.others = dict(others)
+        session.updated_at = updated_at
+        return session
+
+
+class MemorySessionStore:
+    def __init__(self, ttl=None):
+        self.ttl = ttl or float(os.getenv('SESSION_TTL', 3 * 24 * 3600))
+        self.sessions = {}
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, chat_id):
+        return chat_id in self.sessions
+
+    def get(self, chat_id):
+        return self.sessions.get(chat_id)
+
+    def values(self):
+        """Снимок всех сессий"""
+        return list(self.sessions.values())
+
+    def save(self, session, touch=True):
+        """Сохраняет изменения сессии; touch=False не считает это активностью пользователя"""
+        if touch:
+            session.updated_at = time.time()
+        self.sessions[session.chat_id] = session
+
+    def delete(self, chat_id):
+        self.sessions.pop(chat_id, None)
+
+    def evict_expired(self):
+        """Удаляет брошенные сессии, возвращает их количество"""
+        threshold = time.time() - self.ttl
+        expired = [chat_id for chat_id, session in list(self.sessions.items()) if session.updated_at < threshold]
+        for chat_id in expired:
+            self.delete(chat_id)
+        return len(expired)
+
+    def start_eviction(self, interval=None):
+        """Запускает периодическую очистку брошенных сессий"""
+        interval = interval or float(os.getenv('SESSION_EVICT_INTERVAL', 600))
+
+        def run():
+            while True:
+                time.sleep(interval)
+                evicted = self.evict_expired()
+                if evicted:
+                    log.info("🧹 Удалено брошенных сессий: %s", evicted)
+
+        threading.Thread(target=run, name="session-eviction", daemon=True).start()
+
+    def close(self):
+        pass
+
+
+def _open_sessions_db(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS sessions ("
+        "chat_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+    )
+    conn.commit()
+    return conn
+
+
+class SQLiteSessionStore(MemorySessionStore):
+    def __init__(self, path=None, ttl=None):
+        super().__init__(ttl)
+        self.path = path or os.getenv('SESSION_DB_PATH', 'spool/sessions.db')
+        self._lock = threading.Lock()
+        self.conn = _open_sessions_db(self.path)
+        self._restore()
+
+    def _restore(self):
+        """Загружает незавершенные опросы, сохраненные до перезапуска"""
+        threshold = time.time() - self.ttl
+        with self._lock:
+            self.conn.execute("DELETE FROM sessions WHERE updated_at < ?", (threshold,))
+            self.conn.commit()
+            rows = self.conn.execute("SELECT chat_id, data, updated_at FROM sessions").fetchall()
+        for chat_id, data, updated_at in rows:
+            try:
+                self.sessions[chat_id] = Session.from_record(chat_id, json.loads(data), updated_at)
+            except (ValueError, TypeError) as e:
+                log.warning("⚠️ Пропущена поврежденная сессия %s: %s", chat_id, e)
+        if self.sessions:
+            log.info("♻️ Восстановлено незавершенных опросов: %s", len(self.sessions))
+
+    def save(self, session, touch=True):
+        super().save(session, touch)
+        data = json.dumps(session.to_record(), ensure_ascii=False, separators=(',', ':'))
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sessions (chat_id, data, updated_at) VALUES (?, ?, ?)",
+                (session.chat_id, data, session.updated_at),
+            )
+            self.conn.commit()
+
+    def delete(self, chat_id):
+        super().delete(chat_id)
+        with self._lock:
+            self.conn.execute("DELETE FROM sessions WHERE chat_id = ?", (chat_id,))
+            self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+def create_session_store(path=None):
+    """Создает хранилище по переменной SESSION_STORE (sqlite или memory)"""
+    backend = os.getenv('SESSION_STORE', 'sqlite')
+    if backend == 'memory':
+        return MemorySessionStore()
+    if backend == 'sqlite':
+        return SQLiteSessionStore(path)
+    raise ValueError(f"Неизвестное хранилище сессий: {backend}")
+
+
+def shard_path(path, index):
+    """Файл сессий процесса index: spool/sessions.db -> spool/sessions.shard0.db"""
+    base, ext = os.path.splitext(path)
+    return f"{base}.shard{index}{ext}"
+
+
+def reshard_sqlite_sessions(path, workers, shard_for):
+    """
+    Раскладывает сессии из общего файла и файлов шардов по файлам для
+    workers процессов (shard_for(chat_id, workers) -> номер процесса).
+    При workers=1 все сессии собираются обратно в общий файл path.
+    Вызывается до запуска процессов, возвращает число перенесенных сессий.
+    """
+    base, ext = os.path.splitext(path)
+    shards = sorted(glob.glob(f"{glob.escape(base)}.shard*{ext}"))
+    if workers == 1 and not shards:
+        return 0
+    sources = [path] + shards
+    targets = {}
+    moved = 0
+    try:
+        for source in sources:
+            if not os.path.exists(source):
+                continue
+            conn = _open_sessions_db(source)
+            rows = conn.execute("SELECT chat_id, data, updated_at FROM sessions").fetchall()
+            for chat_id, data, updated_at in rows:
+                target_path = path if workers == 1 else shard_path(path, shard_for(chat_id, workers))
+                if target_path == source:
+                    continue
+                target = targets.get(target_path)
+                if target is None:
+                    target = targets[target_path] = _open_sessions_db(target_path)
+                target.execute(
+                    "INSERT OR REPLACE INTO sessions (chat_id, data, updated_at) VALUES (?, ?, ?)",
+                    (chat_id, data, updated_at),
+                )
+                conn.execute("DELETE FROM sessions WHERE chat_id = ?", (chat_id,))
+                moved += 1
+            # Сначала фиксируем копии, затем удаление из источника
+            for target in targets.values():
+                target.commit()
+            conn.commit()
+            conn.close()
+    finally:
+        for target in targets.values():
+            target.close()
+    if moved:
+        log.info("♻️ Сессии перераспределены по %s процессам: %s", workers, moved)
+    return moved
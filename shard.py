@@ -0,0 +1,248 @@
+"""
+Многопроцессный режим бота (SHARD_WORKERS > 1).
+
+Один процесс-супервизор принимает обновления (long polling или webhook) и
+раскладывает их по процессам-обработчикам по chat_id, поэтому сессия чата
+всегда живет в одном процессе. Каждый обработчик запускает свой
+UpdateEngine и FullTelegramBot со своим файлом сессий.
+
+Общими остаются ресурсы, у которых глобальные лимиты: исходящие вызовы
+Bot API идут через очередь в единый OutboundScheduler супервизора, а
+завершенные опросы — в его SurveyWriter с локальным журналом.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from botlog import setup_logging
+from db_writer import SUBMIT_LOCAL, SUBMIT_QUEUED
+from floodguard import FloodGuard
+from metrics import UPDATES_DUPLICATE
+from outbound import PRIORITY_NORMAL
+from reminders import ReminderScheduler
+from sessions import create_session_store, shard_path
+from stats import SharedResponseCounter
+from update_engine import UpdateEngine, update_chat_id
+
+log = logging.getLogger(__name__)
+
+
+def shard_for(chat_id, workers):
+    """Номер процесса, который обслуживает чат (служебные обновления — в первый)"""
+    return 0 if chat_id is None else chat_id % workers
+
+
+class QueueOutbound:
+    """Замена OutboundScheduler в обработчике: вызовы уходят супервизору"""
+
+    def __init__(self, out_queue, depth=None):
+        self.queue = out_queue
+        self.depth = depth  # multiprocessing.Value: длина очереди исходящих супервизора
+
+    def submit(self, chat_id, method, params, priority=PRIORITY_NORMAL, coalesce_key=None):
+        self.queue.put((chat_id, method, params, priority, coalesce_key))
+
+    def queue_depth(self):
+        return self.depth.value if self.depth is not None else 0
+
+
+class QueueWriter:
+    """Замена SurveyWriter в обработчике: строки пишет супервизор"""
+
+    def __init__(self, out_queue, db_available):
+        self.queue = out_queue
+        self.db_available = db_available
+
+    def submit(self, row):
+        # Журнал ведет супервизор, его ошибки сюда не доходят
+        self.queue.put(row)
+        return SUBMIT_QUEUED if self.db_available else SUBMIT_LOCAL
+
+
+class ShardRouter:
+    """Единая точка входа обновлений с интерфейсом UpdateEngine для webhook"""
+
+    def __init__(self, queues, checkpoint=None):
+        self.queues = queues
+        self.checkpoint = checkpoint  # UpdateCheckpoint: повторы отбрасываются до раскладки
+        self.routed = [0] * len(queues)
+
+    def is_running(self):
+        return True
+
+    def is_overloaded(self):
+        return any(update_queue.full() for update_queue in self.queues)
+
+    def submit(self, update):
+        """Передает обновление процессу чата (блокируется, если его очередь полна)"""
+        update_id = update.get("update_id")
+        if self.checkpoint is not None and not self.checkpoint.accept(update_id):
+            UPDATES_DUPLICATE.inc()
+            return
+        index = shard_for(update_chat_id(update), len(self.queues))
+        self.queues[index].put(update)
+        self.routed[index] += 1
+        if self.checkpoint is not None:
+            # Дальше за обновление отвечает процесс-обработчик
+            self.checkpoint.done(update_id)
+
+    dispatch = submit
+
+
+def run_worker(index, workers, factory, token, update_queue, outbound_queue, writer_queue, db_available,
+               guard_factory=None, response_count=None, outbound_depth=None):
+    """Точка входа процесса-обработчика"""
+    setup_logging()
+    sessions = create_session_store(shard_path(os.getenv('SESSION_DB_PATH', 'spool/sessions.db'), index))
+    bot = factory(
+        token,
+        outbound=QueueOutbound(outbound_queue, outbound_depth),
+        writer=QueueWriter(writer_queue, db_available),
+        sessions=sessions,
+        response_counter=SharedResponseCounter(response_count),
+    )
+    # Чаты закреплены за процессом, поэтому окна флуда считаются здесь;
+    # перегрузка — и по своей очереди обработки, и по очереди исходящих супервизора
+    guard = guard_factory(bot.outbound.queue_depth) if guard_factory is not None else None
+    engine = UpdateEngine(bot, guard=guard)
+    bot.reminders = ReminderScheduler(
+        sessions, engine.submit, lambda: not engine.is_running() or engine.is_overloaded()
+    ).start()
+    threading.Thread(target=asyncio.run, args=(engine.run(poll=False),), name="engine", daemon=True).start()
+    while not engine.is_running():
+        time.sleep(0.01)
+    log.info("🧩 Обработчик %s/%s запущен (pid %s)", index + 1, workers, os.getpid())
+
+    while True:
+        update = update_queue.get()
+        if update is None:
+            break
+        # Пока движок перегружен, очередь процесса заполняется и тормозит прием
+        while engine.is_overloaded():
+            time.sleep(0.005)
+        engine.submit(update)
+
+    while engine.pending:
+        time.sleep(0.01)
+    engine.stop()
+    sessions.close()
+
+
+class ShardSupervisor:
+    """
+    Запускает workers процессов-обработчиков.
+    outbound и writer — общие OutboundScheduler и SurveyWriter супервизора
+    (или любые объекты с тем же методом submit).
+    """
+
+    def __init__(self, token, factory, outbound, writer, workers=None, max_pending=None, db_available=True,
+                 checkpoint=None, guard_factory=FloodGuard, response_count=None):
+        self.token = token
+        self.factory = factory  # factory(token, outbound=, writer=, sessions=) -> бот
+        self.outbound = outbound
+        self.writer = writer
+        self.workers = workers or int(os.getenv('SHARD_WORKERS', 2))
+        self.max_pending = max_pending or int(os.getenv('BOT_MAX_PENDING', 1000))
+        self.db_available = db_available
+        self.checkpoint = checkpoint  # UpdateCheckpoint для long polling и webhook
+        # (get_outbound_depth) -> FloodGuard в каждом обработчике, None — без защиты
+        self.guard_factory = guard_factory
+        # spawn: дочерний процесс не наследует потоки и блокировки супервизора
+        self.context = multiprocessing.get_context('spawn')
+        # Число ответов для /stats: пишет ResponseCounter супервизора, читают обработчики
+        self.response_count = (response_count if response_count is not None
+                               else self.context.Value('q', 0, lock=False))
+        # Длина очереди исходящих для FloodGuard обработчиков, обновляется потоком _drain_outbound
+        self.outbound_depth = self.context.Value('q', 0, lock=False)
+        self.depth_interval = 0.2
+        self.processes = []
+        self.router = None
+        self.last_poll_at = None  # Время последнего успешного getUpdates
+        self.outbound_queue = None
+        self.writer_queue = None
+
+    def start(self):
+        update_queues = [self.context.Queue(self.max_pending) for _ in range(self.workers)]
+        self.outbound_queue = self.context.Queue()
+        self.writer_queue = self.context.Queue()
+        for index, update_queue in enumerate(update_queues):
+            process = self.context.Process(
+                target=run_worker,
+                args=(index, self.workers, self.factory, self.token, update_queue,
+                      self.outbound_queue, self.writer_queue, self.db_available, self.guard_factory,
+                      self.response_count, self.outbound_depth),
+                name=f"shard-{index}",
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+        self.router = ShardRouter(update_queues, self.checkpoint)
+
+        threading.Thread(target=self._drain_outbound, name="shard-outbound", daemon=True).start()
+        threading.Thread(target=self._drain_writer, name="shard-writer", daemon=True).start()
+        log.info("🧩 Запущено процессов-обработчиков: %s", self.workers)
+        return self
+
+    def _drain_outbound(self):
+        get_depth = getattr(self.outbound, "queue_depth", None)
+        while True:
+            try:
+                item = self.outbound_queue.get(timeout=self.depth_interval)
+            except queue.Empty:
+                item = ()  # Очередь исходящих уменьшается и без новых вызовов
+            if item is None:
+                return
+            if item:
+                chat_id, method, params, priority, coalesce_key = item
+                self.outbound.submit(chat_id, method, params, priority, coalesce_key=coalesce_key)
+            if get_depth is not None:
+                self.outbound_depth.value = get_depth()
+
+    def _drain_writer(self):
+        while True:
+            row = self.writer_queue.get()
+            if row is None:
+                return
+            self.writer.submit(row)
+
+    def all_alive(self):
+        """Все процессы-обработчики работают"""
+        return all(process.is_alive() for process in self.processes)
+
+    def poll(self, api, poll_timeout):
+        """Long polling в супервизоре: обновления сразу раскладываются по процессам"""
+        offset = self.checkpoint.offset if self.checkpoint is not None else 0
+        while True:
+            try:
+                updates = api.call(
+                    "getUpdates",
+                    {"offset": offset, "timeout": poll_timeout},
+                    timeout=poll_timeout + api.read_timeout,
+                )
+            except Exception as e:
+                log.error("❌ Ошибка получения обновлений: %s", e)
+                time.sleep(1)
+                continue
+            self.last_poll_at = time.time()
+            for update in updates:
+                self.router.submit(update)
+            if updates:
+                offset = updates[-1]["update_id"] + 1
+            if self.checkpoint is not None:
+                self.checkpoint.save()
+
+    def stop(self, timeout=10):
+        """Дорабатывает очереди обработчиков и останавливает процессы"""
+        for update_queue in self.router.queues:
+            update_queue.put(None)
+        for process in self.processes:
+            process.join(timeout)
+        if self.checkpoint is not None:
+            self.checkpoint.save()
+        self.outbound_queue.put(None)
+        self.writer_queue.put(None)
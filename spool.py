@@ -0,0 +1,133 @@
+"""
+Локальный журнал (WAL) завершенных опросов.
+
+Каждый ответ сначала дописывается в append-only JSONL файл и только потом
+отправляется в Supabase. После успешной записи в базу в журнал добавляется
+отметка ack. При старте неподтвержденные ответы читаются из журнала и
+отправляются повторно; дубликаты отсекаются по (user_id, submission_id).
+
+fsync выполняется группами: пока один поток синхронизирует файл, остальные
+дописывают записи, и следующий fsync подтверждает их все сразу.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from db_writer import row_key
+
+log = logging.getLogger(__name__)
+
+
+class ResponseJournal:
+    def __init__(self, path=None, fsync=True, compact_bytes=None):
+        self.path = path or os.getenv('SPOOL_PATH', 'spool/responses.jsonl')
+        self.fsync = fsync
+        self.compact_bytes = compact_bytes or int(os.getenv('SPOOL_COMPACT_BYTES', 1024 * 1024))
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._cond = threading.Condition()
+        self._written = 0  # Номер последней записанной строки
+        self._synced = 0  # Номер последней строки, прошедшей fsync
+        self._syncing = False
+        self.pending = {}  # key -> (row, время записи) — еще не подтверждены базой
+
+        self._recover()
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def _recover(self):
+        """Читает журнал и восстанавливает неподтвержденные ответы"""
+        if not os.path.exists(self.path):
+            return
+        now = time.time()
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Оборванная последняя строка после падения
+                    continue
+                if record.get("op") == "put":
+                    row = record["row"]
+                    self.pending[row_key(row)] = (row, now)
+                elif record.get("op") == "ack":
+                    for key in record["keys"]:
+                        self.pending.pop(tuple(key), None)
+        if self.pending:
+            log.info("💾 В журнале найдено неотправленных ответов: %s", len(self.pending))
+
+    def append(self, row):
+        """Дописывает ответ в журнал и возвращается после fsync"""
+        line = json.dumps({"op": "put", "row": row}, ensure_ascii=False) + "\n"
+        with self._cond:
+            self._file.write(line)
+            self._written += 1
+            seq = self._written
+            self.pending[row_key(row)] = (row, time.time())
+        if self.fsync:
+            self._sync(seq)
+
+    def _sync(self, seq):
+        """Групповой fsync: один поток синхронизирует записи всех ожидающих"""
+        with self._cond:
+            while self._synced < seq:
+                if self._syncing:
+                    self._cond.wait()
+                    continue
+                self._syncing = True
+                target = self._written
+                self._file.flush()
+                fd = self._file.fileno()
+                break
+            else:
+                return
+
+        try:
+            os.fsync(fd)
+        finally:
+            with self._cond:
+                self._synced = max(self._synced, target)
+                self._syncing = False
+                self._cond.notify_all()
+
+    def ack(self, rows):
+        """Отмечает ответы как записанные в базу"""
+        keys = [row_key(row) for row in rows]
+        line = json.dumps({"op": "ack", "keys": keys}, ensure_ascii=False) + "\n"
+        with self._cond:
+            # Потеря ack не страшна: повторная запись в базу будет проигнорирована
+            self._file.write(line)
+            self._file.flush()
+            for key in keys:
+                self.pending.pop(key, None)
+            if self._file.tell() > self.compact_bytes and not self._syncing:
+                self._compact()
+
+    def stale_rows(self, older_than):
+        """Неподтвержденные ответы, записанные в журнал раньше older_than секунд назад"""
+        threshold = time.time() - older_than
+        with self._cond:
+            return [row for row, appended in self.pending.values() if appended <= threshold]
+
+    def _compact(self):
+        """Переписывает журнал, оставляя только неподтвержденные ответы (под блокировкой)"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for row, _ in self.pending.values():
+                f.write(json.dumps({"op": "put", "row": row}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._synced = self._written
+
+    def close(self):
+        with self._cond:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
@@ -0,0 +1,281 @@
+"""
+Статистика опроса без запросов к базе на каждый /stats.
+
+ResponseCounter один раз берет количество ответов из Supabase, затем
+увеличивается после каждой успешной записи и периодически сверяется с
+базой в фоне. В многопроцессном режиме счетчик ведет супервизор, а
+процессы-обработчики читают его значение из общей памяти
+(SharedResponseCounter). SurveyFunnel считает, сколько респондентов ответили на
+каждый вопрос, чтобы показывать воронку и места, где опрос бросают.
+AnswerTally держит распределение ответов по вариантам для JSON API.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from analytics import OTHER_LABEL, decode_answers
+
+log = logging.getLogger(__name__)
+
+
+class ResponseCounter:
+    def __init__(self, db, resync_interval=None, shared=None):
+        self.db = db
+        self.resync_interval = resync_interval or float(os.getenv('STATS_RESYNC_INTERVAL', 300))
+        self.shared = shared  # multiprocessing.Value для процессов-обработчиков или None
+        self.value = 0
+        self.synced_at = None  # Время последней сверки с базой
+        self._lock = threading.Lock()
+        self._wake = threading.Event()  # Внеочередная сверка
+
+    def start(self):
+        """Загружает начальное значение и запускает периодическую сверку в фоне"""
+        threading.Thread(target=self._run, name="response-counter", daemon=True).start()
+
+    def _run(self):
+        while True:
+            self.resync()
+            self._wake.wait(self.resync_interval)
+            self._wake.clear()
+
+    def resync(self):
+        count = self.db.get_all_responses_count()
+        if count is None:
+            return
+        with self._lock:
+            self.value = count
+            self.synced_at = time.time()
+            self._publish()
+
+    def increment(self, n=1):
+        with self._lock:
+            self.value += n
+            self._publish()
+
+    def _publish(self):
+        if self.shared is not None:
+            self.shared.value = self.value
+
+    def on_saved(self, rows, replayed=0):
+        """
+        Колбэк SurveyWriter после успешной записи пачки. Строки из журнала
+        могли уже быть в базе, поэтому вместо увеличения — внеочередная сверка.
+        """
+        if len(rows) > replayed:
+            self.increment(len(rows) - replayed)
+        if replayed:
+            self._wake.set()
+
+
+class SharedResponseCounter:
+    """Счетчик ответов в процессе-обработчике: значение ведет ResponseCounter супервизора"""
+
+    def __init__(self, shared):
+        self.shared = shared
+
+    @property
+    def value(self):
+        return self.shared.value
+
+
+class SurveyFunnel:
+    def __init__(self, steps):
+        self.steps = list(steps)  # Ключи вопросов в порядке прохождения
+        self.started = 0
+        self.answered = [0] * len(self.steps)
+        self.completed = 0
+        self._lock = threading.Lock()
+
+    def record_start(self):
+        with self._lock:
+            self.started += 1
+
+    def record_answer(self, step):
+        with self._lock:
+            self.answered[step] += 1
+
+    def record_complete(self):
+        with self._lock:
+            self.completed += 1
+
+    def snapshot(self):
+        """Воронка: для каждого вопроса — сколько ответили и сколько ушло на нем"""
+        with self._lock:
+            started, answered, completed = self.started, list(self.answered), self.completed
+        rows = []
+        reached = started
+        for key, count in zip(self.steps, answered):
+            rows.append({"question": key, "reached": reached, "answered": count,
+                         "dropped": max(reached - count, 0)})
+            reached = count
+        return {"started": started, "completed": completed, "steps": rows}
+
+
+class AnswerTally:
+    """
+    Распределение ответов по вариантам для /api/summary и /api/question/<id>.
+
+    Начальные значения один раз читаются из базы в фоне, затем каждый
+    завершенный опрос добавляется по одной строке. JSON ответа строится
+    только после изменений и отдается из кэша вместе с ETag. Неудачная
+    загрузка повторяется API_SEED_ATTEMPTS раз, после чего распределение
+    остается неполным ("complete": false) и считает только новые ответы.
+    """
+
+    def __init__(self, questions, seed_attempts=None, seed_retry_delay=None):
+        self.questions = {}  # id вопроса -> (ключ ответа, описание, варианты -> номер)
+        for question in questions:
+            options = question.get('options', ())
+            self.questions[str(question['id'])] = (
+                f"q{question['id']}", question, {option: i for i, option in enumerate(options)}
+            )
+        # Для вопросов с вариантами последний счетчик — свой вариант "Інше: ..."
+        self.counts = {
+            key: [0] * (len(question['options']) + 1) if 'options' in question else []
+            for key, question, _ in self.questions.values()
+        }
+        self.answered = {key: 0 for key, _, _ in self.questions.values()}
+        self.responses = 0
+        self.seeded = False
+        self.seed_attempts = seed_attempts or int(os.getenv('API_SEED_ATTEMPTS', 3))
+        self.seed_retry_delay = seed_retry_delay or float(os.getenv('API_SEED_RETRY_DELAY', 30))
+        self.version = 0
+        self.versions = {key: 0 for key in self.answered}  # Версия каждого вопроса для ETag
+        self.boot = uuid.uuid4().hex[:8]  # ETag не совпадет с выданным до перезапуска
+        self._live_keys = set()  # Строки, учтенные до окончания загрузки из базы
+        self._tracking = True  # Запоминать ли ключи строк: нужно, только пока загрузка впереди
+        self._rendered = {}  # ключ кэша -> (версия, ETag, тело)
+        self._lock = threading.Lock()
+
+    def start(self, db):
+        """
+        Загружает распределение по уже сохраненным ответам в фоне. Вызывается
+        после SurveyWriter.start: строки из журнала к этому моменту прошли
+        через record и при загрузке пропускаются, даже если уже записаны.
+        """
+        if db.is_available():
+            threading.Thread(target=self._seed, args=(db,), name="answer-tally", daemon=True).start()
+        else:
+            # Без базы загружать нечего: все ответы проходят через record
+            with self._lock:
+                self.seeded = True
+                self.version += 1
+                self._tracking = False
+                self._live_keys.clear()
+        return self
+
+    def _seed(self, db):
+        delay = self.seed_retry_delay
+        for attempt in range(1, self.seed_attempts + 1):
+            try:
+                seed = self._load(db)
+                break
+            except Exception as e:
+                log.error("❌ Не удалось загрузить ответы для /api (попытка %s из %s): %s",
+                          attempt, self.seed_attempts, e)
+                if attempt < self.seed_attempts:
+                    time.sleep(delay)
+                    delay *= 2
+        else:
+            # Больше не пробуем: ключи строк не нужны, распределение остается неполным
+            with self._lock:
+                self._tracking = False
+                self._live_keys.clear()
+            return
+        with self._lock:
+            for key, counts in seed.counts.items():
+                self.counts[key] = [a + b for a, b in zip(self.counts[key], counts)]
+                self.answered[key] += seed.answered[key]
+                self.versions[key] += 1
+            self.responses += seed.responses
+            self.seeded = True
+            self.version += 1
+            self._tracking = False
+            self._live_keys.clear()
+        log.info("📊 Загружено ответов для /api: %s", seed.responses)
+
+    def _load(self, db):
+        """Распределение по строкам базы, которых еще нет в record"""
+        seed = AnswerTally(q for _, q, _ in self.questions.values())
+        for row in db.iter_responses(columns="id,user_id,submission_id,answers"):
+            # Строки этого процесса уже учтены в record (он вызывается до записи в базу)
+            if (row.get("user_id"), row.get("submission_id")) not in self._live_keys:
+                seed._add(decode_answers(row))
+        return seed
+
+    def record(self, row):
+        """Колбэк SurveyWriter при постановке строки в очередь записи (и при повторе журнала)"""
+        answers = decode_answers(row)
+        with self._lock:
+            if self._tracking:
+                self._live_keys.add((row.get("user_id"), row.get("submission_id")))
+            for key in self._add(answers):
+                self.versions[key] += 1
+            self.version += 1
+
+    def _add(self, answers):
+        """Добавляет ответы одного опроса; возвращает ключи вопросов, на которые ответили"""
+        self.responses += 1
+        changed = []
+        for key, question, lookup in self.questions.values():
+            value = answers.get(key)
+            if value is None:
+                continue
+            self.answered[key] += 1
+            changed.append(key)
+            counts = self.counts[key]
+            if not counts:
+                continue
+            for item in value if isinstance(value, list) else [value]:
+                if item in lookup:
+                    counts[lookup[item]] += 1
+                elif isinstance(item, str) and item.startswith("Інше"):
+                    counts[-1] += 1
+        return changed
+
+    def _question(self, question_id):
+        key, question, _ = self.questions[question_id]
+        result = {
+            "id": question['id'],
+            "question": question['question'],
+            "type": question['type'],
+            "answered": self.answered[key],
+        }
+        if self.counts[key]:
+            labels = list(question['options']) + [OTHER_LABEL]
+            result["options"] = [
+                {"option": label, "count": count} for label, count in zip(labels, self.counts[key])
+            ]
+        return result
+
+    def summary(self):
+        """(ETag, JSON) по всем вопросам"""
+        return self._render("summary", self.version, lambda: {
+            "responses": self.responses,
+            "complete": self.seeded,
+            "questions": [self._question(question_id) for question_id in self.questions],
+        })
+
+    def question(self, question_id):
+        """(ETag, JSON) по одному вопросу или None, если такого нет"""
+        if question_id not in self.questions:
+            return None
+        key = self.questions[question_id][0]
+        return self._render(key, self.versions[key], lambda: {
+            "complete": self.seeded,
+            **self._question(question_id),
+        })
+
+    def _render(self, cache_key, version, build):
+        with self._lock:
+            cached = self._rendered.get(cache_key)
+            if cached is not None and cached[0] == version:
+                return cached[1], cached[2]
+            body = json.dumps(build(), ensure_ascii=False).encode()
+            etag = f'"{self.boot}-{version}"'
+            self._rendered[cache_key] = (version, etag, body)
+            return etag, body
@@ -0,0 +1,218 @@
+"""
+Скомпилированное описание опроса.
+
+QUESTIONS и ADDITIONAL_QUESTIONS один раз при старте проверяются и
+превращаются в неизменяемые объекты: тексты кнопок заранее сопоставлены
+с (вопрос, вариант), а клавиатуры заранее сериализованы в JSON, так что
+обработка ответа — это поиск в словаре без разбора строки.
+
+Для режима inline клавиатур (KEYBOARD_MODE=inline) варианты кодируются в
+callback_data как "<id вопроса>:<индекс варианта>" или "<id вопроса>:done".
+"""
+
+import json
+
+START_BUTTON = "🚀 Почати опитування"
+FINISH_CHOICE_BUTTON = "✅ Завершити вибір"
+BACK_BUTTON = "↩ Назад до варіантів"
+SKIP_BUTTON = "⏭ Пропустити"
+HOME_BUTTON = "🏠 Головна"
+OTHER_OPTION = "Інше"
+
+SERVICE_BUTTONS = {START_BUTTON, FINISH_CHOICE_BUTTON, BACK_BUTTON, SKIP_BUTTON, HOME_BUTTON}
+QUESTION_TYPES = {"single_choice", "multiple_choice", "text"}
+
+# Telegram ограничивает текст кнопки, а маска выбора хранится в целом числе
+MAX_BUTTON_LENGTH = 200
+MAX_OPTIONS = 63
+# Telegram ограничивает callback_data 64 байтами
+MAX_CALLBACK_DATA = 64
+CALLBACK_FINISH = "done"
+
+
+class SurveyDefinitionError(ValueError):
+    """Ошибка в описании вопросов"""
+
+
+def serialize_markup(markup):
+    return json.dumps(markup, ensure_ascii=False, separators=(',', ':'))
+
+
+def reply_keyboard(buttons, one_time=False):
+    markup = {"keyboard": [[{"text": text}] for text in buttons], "resize_keyboard": True}
+    if one_time:
+        markup["one_time_keyboard"] = True
+    return serialize_markup(markup)
+
+
+def inline_keyboard(buttons):
+    """buttons — список пар (текст, callback_data), по одной кнопке в ряду"""
+    return serialize_markup({"inline_keyboard": [[{"text": text, "callback_data": data}] for text, data in buttons]})
+
+
+START_KEYBOARD = reply_keyboard([START_BUTTON])
+SKIP_KEYBOARD = reply_keyboard([SKIP_BUTTON])
+BACK_KEYBOARD = reply_keyboard([BACK_BUTTON])
+HOME_KEYBOARD = reply_keyboard([HOME_BUTTON])
+
+
+class CompiledQuestion:
+    __slots__ = (
+        "index",
+        "id",
+        "key",  # Ключ в словаре ответов: q1 для основных, id для дополнительных
+        "type",
+        "text",  # Текст сообщения с префиксом
+        "options",
+        "other_index",  # Индекс варианта "Інше" или None
+        "buttons",  # Текст кнопки -> индекс варианта
+        "keyboard",  # Клавиатура первого показа (JSON)
+        "_toggle_keyboards",  # (маска, есть "Інше") -> клавиатура с галочками (JSON)
+        "_inline_keyboards",  # (маска, есть "Інше", итоговая) -> inline клавиатура (JSON)
+    )
+
+    def __init__(self, index, data, prefix, key):
+        self.index = index
+        self.id = data["id"]
+        self.key = key
+        self.type = data["type"]
+        self.text = f"{prefix} {data['question']}"
+        self.options = tuple(data.get("options", ()))
+        self.other_index = self.options.index(OTHER_OPTION) if OTHER_OPTION in self.options else None
+        self.buttons = {}
+        self._toggle_keyboards = {}
+        self._inline_keyboards = {}
+
+        labels = [f"{i}. {option}" for i, option in enumerate(self.options, 1)]
+        for option_index, label in enumerate(labels):
+            self.buttons[label] = option_index
+            self.buttons[f"☑ {label}"] = option_index
+            self.buttons[f"☐ {label}"] = option_index
+
+        if self.type == "single_choice":
+            self.keyboard = reply_keyboard(labels, one_time=True)
+        elif self.type == "multiple_choice":
+            self.keyboard = reply_keyboard(labels + [FINISH_CHOICE_BUTTON], one_time=True)
+        else:
+            self.keyboard = SKIP_KEYBOARD
+
+    def toggle_keyboard(self, mask, other_selected=False):
+        """Клавиатура множественного выбора с отмеченными вариантами (кэшируется по маске)"""
+        cache_key = (mask, other_selected)
+        keyboard = self._toggle_keyboards.get(cache_key)
+        if keyboard is None:
+            buttons = []
+            for i, option in enumerate(self.options):
+                selected = mask >> i & 1 or (other_selected and i == self.other_index)
+                buttons.append(f"{'☑' if selected else '☐'} {i + 1}. {option}")
+            buttons.append(FINISH_CHOICE_BUTTON)
+            keyboard = self._toggle_keyboards[cache_key] = reply_keyboard(buttons)
+        return keyboard
+
+    def inline_keyboard(self, mask=0, other_selected=False, final=False):
+        """
+        Inline клавиатура вопроса с вариантами (кэшируется).
+        final=True — ответ принят: отмечены выбранные варианты, кнопки завершения нет.
+        """
+        cache_key = (mask, other_selected, final)
+        keyboard = self._inline_keyboards.get(cache_key)
+        if keyboard is None:
+            buttons = []
+            for i, option in enumerate(self.options):
+                label = f"{i + 1}. {option}"
+                selected = mask >> i & 1 or (other_selected and i == self.other_index)
+                if self.type == "multiple_choice":
+                    label = f"{'☑' if selected else '☐'} {label}"
+                elif selected:
+                    label = f"☑ {label}"
+                buttons.append((label, f"{self.id}:{i}"))
+            if self.type == "multiple_choice" and not final:
+                buttons.append((FINISH_CHOICE_BUTTON, f"{self.id}:{CALLBACK_FINISH}"))
+            keyboard = self._inline_keyboards[cache_key] = inline_keyboard(buttons)
+        return keyboard
+
+
+class Survey:
+    def __init__(self, questions, additional_questions):
+        validate_survey(questions, additional_questions)
+        self.questions = tuple(
+            CompiledQuestion(i, data, "❓", f"q{data['id']}") for i, data in enumerate(questions)
+        )
+        self.additional = tuple(
+            CompiledQuestion(i, data, "📝", data["id"]) for i, data in enumerate(additional_questions)
+        )
+        # Текст кнопки -> ((индекс вопроса, индекс варианта), ...) по всем вопросам
+        self.buttons = {}
+        for question in self.questions:
+            for text, option_index in question.buttons.items():
+                self.buttons.setdefault(text, ())
+                self.buttons[text] += ((question.index, option_index),)
+        # id вопроса из callback_data -> вопрос
+        self.by_callback_id = {str(question.id): question for question in self.questions}
+
+    def lookup(self, question_index, text):
+        """Индекс варианта, если text — кнопка вопроса question_index, иначе None"""
+        return self.questions[question_index].buttons.get(text)
+
+    def is_option_button(self, text):
+        """Кнопка варианта какого-либо вопроса (например, со старой клавиатуры)"""
+        return text in self.buttons
+
+    def parse_callback(self, data):
+        """
+        Разбирает callback_data inline кнопки.
+        Возвращает (вопрос, индекс варианта или None для завершения выбора) или None.
+        """
+        question_id, _, action = (data or "").partition(":")
+        question = self.by_callback_id.get(question_id)
+        if question is None or question.type == "text":
+            return None
+        if action == CALLBACK_FINISH and question.type == "multiple_choice":
+            return question, None
+        if action.isdigit() and int(action) < len(question.options):
+            return question, int(action)
+        return None
+
+
+def validate_survey(questions, additional_questions):
+    """Проверяет описание опроса и сообщает обо всех найденных ошибках сразу"""
+    errors = []
+    seen_keys = set()
+    for group, items in (("QUESTIONS", questions), ("ADDITIONAL_QUESTIONS", additional_questions)):
+        for position, question in enumerate(items):
+            where = f"{group}[{position}]"
+            if "id" not in question or not question.get("question"):
+                errors.append(f"{where}: нужны поля id и question")
+                continue
+            key = f"q{question['id']}" if group == "QUESTIONS" else question["id"]
+            if key in seen_keys:
+                errors.append(f"{where}: повторяющийся ключ ответа {key}")
+            seen_keys.add(key)
+
+            question_type = question.get("type")
+            if question_type not in QUESTION_TYPES:
+                errors.append(f"{where}: неизвестный тип {question_type!r}")
+                continue
+            if group == "ADDITIONAL_QUESTIONS" and question_type != "text":
+                errors.append(f"{where}: дополнительные вопросы должны быть текстовыми")
+
+            options = question.get("options", [])
+            if question_type == "text":
+                if options:
+                    errors.append(f"{where}: у текстового вопроса не должно быть вариантов")
+                continue
+            if not options:
+                errors.append(f"{where}: нет вариантов ответа")
+            if len(options) > MAX_OPTIONS:
+                errors.append(f"{where}: больше {MAX_OPTIONS} вариантов")
+            if len(set(options)) != len(options):
+                errors.append(f"{where}: повторяющиеся варианты")
+            if len(f"{question['id']}:{CALLBACK_FINISH}".encode()) > MAX_CALLBACK_DATA:
+                errors.append(f"{where}: слишком длинный id для callback_data")
+            for i, option in enumerate(options, 1):
+                if len(f"☐ {i}. {option}") > MAX_BUTTON_LENGTH:
+                    errors.append(f"{where}: слишком длинный вариант {option!r}")
+                if option in SERVICE_BUTTONS:
+                    errors.append(f"{where}: вариант совпадает со служебной кнопкой {option!r}")
+    if errors:
+        raise SurveyDefinitionError("Ошибки в описании опроса:\n" + "\n".join(errors))
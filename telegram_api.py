@@ -0,0 +1,138 @@
+"""
+Общий HTTP-клиент для Telegram Bot API.
+
+Все методы Bot API идут через один пул keep-alive соединений (HTTP/2,
+если установлен пакет h2), с таймаутами и статистикой задержек по методам.
+"""
+
+import os
+import threading
+import time
+
+import httpx
+
+from metrics import TELEGRAM_CALL_SECONDS, TELEGRAM_ERRORS
+from profiling import PROFILER
+
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+
+
+def _http2_available():
+    """Проверяет, можно ли включить HTTP/2 (нужен пакет h2)"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class TelegramAPIError(Exception):
+    """Ошибка вызова Bot API (сетевая или ответ с ok=false)"""
+
+    def __init__(self, method, error_code, description, retry_after=None):
+        super().__init__(f"{method}: {error_code} {description}")
+        self.method = method
+        self.error_code = error_code  # None для сетевых ошибок
+        self.description = description
+        self.retry_after = retry_after
+
+
+class CallStats:
+    """Статистика вызовов одного метода Bot API"""
+
+    __slots__ = ("count", "errors", "total_time", "max_time", "error_codes")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.error_codes = {}
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total_time / self.count * 1000, 2) if self.count else 0.0,
+            "max_ms": round(self.max_time * 1000, 2),
+            "error_codes": dict(self.error_codes),
+        }
+
+
+class TelegramAPI:
+    def __init__(self, token, base_url=None, pool_size=None, connect_timeout=None, read_timeout=None):
+        self.base_url = f"{base_url or TELEGRAM_API_URL}/bot{token}"
+        pool_size = pool_size or int(os.getenv('TELEGRAM_POOL_SIZE', 32))
+        connect_timeout = connect_timeout or float(os.getenv('TELEGRAM_CONNECT_TIMEOUT', 5))
+        self.read_timeout = read_timeout or float(os.getenv('TELEGRAM_READ_TIMEOUT', 10))
+        self.http2 = _http2_available()
+
+        self.client = httpx.Client(
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=60,
+            ),
+            timeout=httpx.Timeout(self.read_timeout, connect=connect_timeout),
+        )
+        self.stats = {}  # Статистика по методам
+        self._stats_lock = threading.Lock()
+
+    def call(self, method, params=None, timeout=None):
+        """
+        Вызывает метод Bot API и возвращает поле result.
+        timeout задает таймаут чтения для конкретного вызова (нужно для long polling).
+        """
+        started = time.perf_counter()
+        try:
+            response = self.client.post(
+                f"{self.base_url}/{method}",
+                json=params or {},
+                timeout=httpx.USE_CLIENT_DEFAULT if timeout is None else httpx.Timeout(
+                    timeout, connect=self.client.timeout.connect
+                ),
+            )
+            data = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            self._record(method, time.perf_counter() - started, type(e).__name__)
+            raise TelegramAPIError(method, None, str(e)) from e
+
+        elapsed = time.perf_counter() - started
+        if not data.get("ok"):
+            error_code = data.get("error_code", response.status_code)
+            self._record(method, elapsed, error_code)
+            raise TelegramAPIError(
+                method,
+                error_code,
+                data.get("description", ""),
+                retry_after=data.get("parameters", {}).get("retry_after"),
+            )
+
+        self._record(method, elapsed)
+        return data["result"]
+
+    def _record(self, method, elapsed, error_code=None):
+        TELEGRAM_CALL_SECONDS.observe(elapsed, method)
+        PROFILER.record(f"api.{method}", elapsed)
+        if error_code is not None:
+            TELEGRAM_ERRORS.inc(method, error_code)
+        with self._stats_lock:
+            stats = self.stats.get(method)
+            if stats is None:
+                stats = self.stats[method] = CallStats()
+            stats.count += 1
+            stats.total_time += elapsed
+            if elapsed > stats.max_time:
+                stats.max_time = elapsed
+            if error_code is not None:
+                stats.errors += 1
+                stats.error_codes[error_code] = stats.error_codes.get(error_code, 0) + 1
+
+    def get_stats(self):
+        """Возвращает снимок статистики задержек по методам"""
+        with self._stats_lock:
+            return {method: stats.as_dict() for method, stats in self.stats.items()}
+
+    def close(self):
+        self.client.close()
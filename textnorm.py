@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Нормализация свободных ответов и поиск по пожеланиям.
+
+Текстовые ответы (q7, свои варианты "Інше: ...", city, age, obstacles,
+suggestions) хранятся как ввел пользователь, поэтому "Київ", "Kyiv" и
+"киев" считаются разными городами, а возраст — строками. Скрипт читает
+ответы потоком и нормализует их пачками в пуле процессов:
+
+- текст — Unicode NFKC, casefold, единые апострофы и пробелы;
+- город — транслитерация в латиницу и словарь вариантов написания
+  (CITY_ALIASES) -> каноническое название;
+- возраст — первое число в ответе -> возрастная группа;
+- одинаковые после нормализации ответы схлопываются со счетчиком.
+
+По словам из suggestions строится инвертированный индекс для --search.
+
+Нормализованные строки дописываются в кэш (TEXTNORM_CACHE, JSONL), и
+повторный запуск читает из базы и обрабатывает только строки с id больше
+последнего обработанного:
+
+    python textnorm.py --fixture fixtures/survey_responses.jsonl
+    python textnorm.py --search "карта фільтри"
+    python textnorm.py --json --top 20 > texts.json
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import unicodedata
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from analytics import PAGE_SIZE, connect, decode_answers, iter_fixture, iter_responses
+
+TEXT_FIELDS = ("q7", "obstacles", "suggestions")
+INDEX_FIELD = "suggestions"
+OTHER_PREFIX = "Інше"
+CACHE_PATH = os.getenv('TEXTNORM_CACHE', 'spool/textnorm.jsonl')
+CHUNK_SIZE = int(os.getenv('TEXTNORM_CHUNK', 500))
+
+# Украинский и русский алфавиты в латиницу (упрощенно, без правил для начала слова)
+TRANSLIT = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "h", "ґ": "g", "д": "d", "е": "e", "є": "ie",
+    "ж": "zh", "з": "z", "и": "y", "і": "i", "ї": "i", "й": "i", "к": "k", "л": "l",
+    "м": "m", "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t", "у": "u",
+    "ф": "f", "х": "kh", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "shch", "ь": "", "ю": "iu",
+    "я": "ia", "ё": "e", "ы": "y", "э": "e", "ъ": "", "'": "",
+})
+
+# Каноническое название -> другие написания (латиница, русский, старые названия)
+CITY_ALIASES = {
+    "Київ": ("Kyiv", "Kiev", "Kiyv", "Киев"),
+    "Львів": ("Lviv", "Lvov", "Львов"),
+    "Харків": ("Kharkiv", "Kharkov", "Харьков"),
+    "Одеса": ("Odesa", "Odessa", "Одесса"),
+    "Дніпро": ("Dnipro", "Dnepr", "Днепр", "Дніпропетровськ", "Днепропетровск"),
+    "Запоріжжя": ("Zaporizhzhia", "Zaporozhye", "Запорожье"),
+    "Вінниця": ("Vinnytsia", "Vinnitsa", "Винница"),
+    "Івано-Франківськ": ("Ivano-Frankivsk", "Ивано-Франковск", "Франик"),
+    "Тернопіль": ("Ternopil", "Тернополь"),
+    "Ужгород": ("Uzhhorod", "Uzhgorod"),
+    "Чернівці": ("Chernivtsi", "Черновцы"),
+    "Полтава": ("Poltava",),
+    "Житомир": ("Zhytomyr", "Zhitomir"),
+    "Черкаси": ("Cherkasy", "Черкассы"),
+    "Миколаїв": ("Mykolaiv", "Nikolaev", "Николаев"),
+    "Херсон": ("Kherson",),
+    "Суми": ("Sumy", "Сумы"),
+    "Рівне": ("Rivne", "Rovno", "Ровно"),
+    "Луцьк": ("Lutsk", "Луцк"),
+    "Чернігів": ("Chernihiv", "Chernigov", "Чернигов"),
+    "Кропивницький": ("Kropyvnytskyi", "Кировоград"),
+    "Хмельницький": ("Khmelnytskyi", "Хмельницкий"),
+}
+
+# Возрастные группы: (от, до включительно, подпись)
+AGE_BUCKETS = (
+    (0, 17, "<18"), (18, 24, "18-24"), (25, 34, "25-34"),
+    (35, 44, "35-44"), (45, 54, "45-54"), (55, 120, "55+"),
+)
+
+_APOSTROPHES = str.maketrans({"’": "'", "ʼ": "'", "`": "'", "‘": "'"})
+_NOT_WORD = re.compile(r"[^\w'-]+")
+_NUMBER = re.compile(r"\d{1,3}")
+_WORD = re.compile(r"\w{3,}")
+
+
+def fold(text):
+    """Текст для сравнения: NFKC, casefold, один вид апострофа, без лишней пунктуации и пробелов"""
+    text = unicodedata.normalize("NFKC", text).translate(_APOSTROPHES).casefold()
+    return " ".join(_NOT_WORD.sub(" ", text).split())
+
+
+def transliterate(text):
+    """Латиница для уже свернутого текста (fold)"""
+    return text.translate(TRANSLIT)
+
+
+def city_key(text):
+    """Ключ города: транслитерация без пробелов и дефисов"""
+    return re.sub(r"[^a-z0-9]", "", transliterate(fold(text)))
+
+
+_CITY_INDEX = {
+    city_key(alias): canonical
+    for canonical, aliases in CITY_ALIASES.items()
+    for alias in (canonical, *aliases)
+}
+
+
+def normalize_city(value):
+    """Каноническое название известного города, иначе свернутый текст"""
+    return _CITY_INDEX.get(city_key(value)) or fold(value) or None
+
+
+def age_bucket(value):
+    """Возрастная группа по первому числу в ответе ("25 років", "40+", "25-30")"""
+    match = _NUMBER.search(str(value))
+    if match is None:
+        return None
+    age = int(match.group())
+    for low, high, label in AGE_BUCKETS:
+        if low <= age <= high:
+            return label
+    return None
+
+
+def tokens(text):
+    """Слова от трех букв для индекса (текст уже свернут)"""
+    return sorted(set(_WORD.findall(text)))
+
+
+def normalize_row(row):
+    """Нормализованные текстовые поля одной строки таблицы"""
+    answers = decode_answers(row)
+    record = {"id": row["id"]}
+    for field in TEXT_FIELDS:
+        value = answers.get(field)
+        if isinstance(value, str) and fold(value):
+            record[field] = fold(value)
+    if record.get(INDEX_FIELD):
+        record["tokens"] = tokens(record[INDEX_FIELD])
+
+    city = answers.get("city")
+    if isinstance(city, str) and city.strip():
+        record["city"] = normalize_city(city)
+    age = answers.get("age")
+    if age is not None:
+        record["age"] = age_bucket(age)
+
+    others = {}
+    for key, value in answers.items():
+        for item in value if isinstance(value, list) else [value]:
+            if isinstance(item, str) and item.startswith(OTHER_PREFIX):
+                text = fold(item[len(OTHER_PREFIX):].lstrip(":"))
+                if text:
+                    others[key] = text
+    if others:
+        record["other"] = others
+    return record
+
+
+def normalize_rows(rows):
+    """Пачка строк для процесса пула"""
+    return [normalize_row(row) for row in rows]
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def normalize_parallel(rows, workers=None, chunk_size=CHUNK_SIZE):
+    """
+    Нормализует строки пачками в пуле процессов, сохраняя порядок. В работе
+    не больше двух пачек на процесс, так что строки читаются по мере обработки.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for chunk in _chunks(rows, chunk_size):
+            yield normalize_rows(chunk)
+        return
+    with ProcessPoolExecutor(workers) as executor:
+        in_flight = deque()
+        limit = 2 * workers
+        for chunk in _chunks(rows, chunk_size):
+            in_flight.append(executor.submit(normalize_rows, chunk))
+            if len(in_flight) >= limit:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+class NormalizedCache:
+    """Нормализованные строки в JSONL: повторный запуск обрабатывает только новые id"""
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self.records = []
+        self.last_id = 0
+
+    def load(self):
+        try:
+            with open(self.path, "r+b") as f:
+                valid_size = 0
+                for line in f:
+                    try:
+                        record = json.loads(line) if line.endswith(b"\n") else None
+                    except ValueError:
+                        record = None
+                    if record is None:
+                        # Недописанная строка после сбоя: отрезаем, строка обработается заново
+                        f.truncate(valid_size)
+                        break
+                    valid_size += len(line)
+                    self.records.append(record)
+                    self.last_id = max(self.last_id, record["id"])
+        except FileNotFoundError:
+            pass
+        return self
+
+    def append(self, records):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False))
+                f.write("\n")
+        self.records.extend(records)
+        for record in records:
+            self.last_id = max(self.last_id, record["id"])
+
+
+class TextIndex:
+    """Сводка по нормализованным строкам и инвертированный индекс слов -> id ответов"""
+
+    def __init__(self, records):
+        self.rows = 0
+        self.cities = Counter()
+        self.ages = Counter()
+        self.values = {field: Counter() for field in TEXT_FIELDS}
+        self.others = Counter()  # (вопрос, текст) -> количество
+        self.postings = {}  # слово -> список id
+        for record in records:
+            self.add(record)
+
+    def add(self, record):
+        self.rows += 1
+        if "city" in record:
+            self.cities[record["city"]] += 1
+        if "age" in record:
+            self.ages[record["age"]] += 1
+        for field in TEXT_FIELDS:
+            if field in record:
+                self.values[field][record[field]] += 1
+        for key, text in record.get("other", {}).items():
+            self.others[key, text] += 1
+        for word in record.get("tokens", ()):
+            self.postings.setdefault(word, []).append(record["id"])
+
+    def search(self, query):
+        """id ответов, в пожеланиях которых есть все слова запроса"""
+        words = tokens(fold(query))
+        if not words:
+            return []
+        # Начинаем с самого редкого слова, чтобы пересечение было коротким
+        lists = sorted((self.postings.get(word, []) for word in words), key=len)
+        result = set(lists[0])
+        for ids in lists[1:]:
+            result.intersection_update(ids)
+        return sorted(result)
+
+    def summary(self, top=10):
+        age_order = [label for _, _, label in AGE_BUCKETS] + [None]
+        return {
+            "rows": self.rows,
+            "cities": dict(self.cities.most_common()),
+            "ages": {label or "unknown": self.ages[label] for label in age_order if self.ages[label]},
+            "texts": {
+                field: {"unique": len(counter), "top": counter.most_common(top)}
+                for field, counter in self.values.items()
+            },
+            "other": [
+                {"question": key, "text": text, "count": count}
+                for (key, text), count in self.others.most_common(top)
+            ],
+            "index_words": len(self.postings),
+        }
+
+
+def format_summary(summary):
+    lines = [f"📝 Ответов: {summary['rows']}", "", "🏙 Города:"]
+    lines += [f"   {city}: {count}" for city, count in summary["cities"].items()]
+    lines += ["", "🎂 Возраст:"]
+    lines += [f"   {label}: {count}" for label, count in summary["ages"].items()]
+    for field, info in summary["texts"].items():
+        lines += ["", f"💬 {field} (уникальных: {info['unique']}):"]
+        lines += [f"   {count} × {value}" for value, count in info["top"]]
+    if summary["other"]:
+        lines += ["", "✏️ Свои варианты:"]
+        lines += [f"   {item['question']}: {item['count']} × {item['text']}" for item in summary["other"]]
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нормализация свободных ответов опроса")
+    parser.add_argument("--fixture", help="JSONL файл вместо Supabase")
+    parser.add_argument("--cache", default=CACHE_PATH, help="Файл кэша нормализованных строк")
+    parser.add_argument("--workers", type=int, help="Процессов в пуле (по умолчанию — по числу ядер)")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--search", help="Найти ответы, в пожеланиях которых есть все слова")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="Вывод в JSON")
+    args = parser.parse_args()
+
+    cache = NormalizedCache(args.cache).load()
+    if args.fixture:
+        rows = sorted((row for row in iter_fixture(args.fixture) if row["id"] > cache.last_id),
+                      key=lambda row: row["id"])
+    else:
+        rows = iter_responses(connect(), args.page_size, cache.last_id, columns="id,answers")
+
+    new_rows = 0
+    for records in normalize_parallel(rows, args.workers):
+        cache.append(records)
+        new_rows += len(records)
+    print(f"✅ Нормализовано новых строк: {new_rows}, всего в кэше: {len(cache.records)}", file=sys.stderr)
+
+    index = TextIndex(cache.records)
+    if args.search:
+        ids = index.search(args.search)
+        by_id = {record["id"]: record for record in cache.records}
+        if args.json:
+            json.dump([by_id[i] for i in ids], sys.stdout, ensure_ascii=False, indent=2)
+            print()
+        else:
+            print(f"🔎 Найдено: {len(ids)}")
+            for i in ids:
+                print(f"   #{i}: {by_id[i][INDEX_FIELD]}")
+    elif args.json:
+        json.dump(index.summary(args.top), sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print(format_summary(index.summary(args.top)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Асинхронный движок обработки обновлений Telegram.
+
+Long polling идет без пауз между запросами, а обновления раздаются
+по очередям чатов: внутри одного чата порядок сохраняется, разные чаты
+обрабатываются параллельно. Сама логика опроса остается в синхронных
+методах FullTelegramBot (handle_update/handle_answer), которые выполняются
+в пуле потоков.
+
+С checkpoint.UpdateCheckpoint повторно доставленные обновления
+отбрасываются, а позиция сохраняется после каждой пачки (в режиме
+webhook — раз в CHECKPOINT_INTERVAL секунд). С floodguard.FloodGuard
+флуд из одного чата и необязательные команды при перегрузке отбрасываются
+до постановки в очередь чата.
+"""
+
+import logging
+import os
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import UPDATES_RECEIVED, UPDATES_DUPLICATE, UPDATES_HANDLED, UPDATE_SECONDS, UPDATE_LAG_SECONDS
+
+log = logging.getLogger(__name__)
+
+
+def update_chat_id(update):
+    """Возвращает chat_id, к которому относится обновление"""
+    for key in ("message", "edited_message"):
+        if key in update:
+            return update[key]["chat"]["id"]
+    if "callback_query" in update:
+        callback = update["callback_query"]
+        message = callback.get("message")
+        if message:
+            return message["chat"]["id"]
+        return callback["from"]["id"]
+    if "reminder" in update:
+        # Синтетическое обновление от reminders.ReminderScheduler
+        return update["reminder"]["chat_id"]
+    # Служебные обновления без чата обрабатываются в общей очереди
+    return None
+
+
+def update_type(update):
+    """Тип обновления (message, callback_query, ...) для метрик"""
+    for key in update:
+        if key != "update_id":
+            return key
+    return "unknown"
+
+
+class UpdateEngine:
+    def __init__(self, bot, max_workers=None, max_pending=None, checkpoint=None, guard=None):
+        self.bot = bot
+        self.checkpoint = checkpoint  # UpdateCheckpoint или None (без защиты от повторов)
+        self.guard = guard  # FloodGuard или None (без ограничений)
+        self.checkpoint_interval = float(os.getenv('CHECKPOINT_INTERVAL', 1))
+        self.max_workers = max_workers or int(os.getenv('BOT_WORKERS', 32))
+        self.max_pending = max_pending or int(os.getenv('BOT_MAX_PENDING', 1000))
+        self.executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="chat-worker")
+        # Отдельный поток для long polling, чтобы он не конкурировал с обработчиками
+        self.poll_executor = ThreadPoolExecutor(1, thread_name_prefix="poller")
+        self.loop = None
+        self.chat_queues = {}  # Очереди обновлений по chat_id
+        self.pending = 0  # Обновления, принятые, но еще не обработанные
+        self._drained = None
+        self._stopped = None
+        self._stopping = False
+
+    async def run(self, poll=True):
+        """
+        Запускает раздачу обновлений по чатам.
+        При poll=False обновления приходят только через submit (режим webhook).
+        """
+        self.loop = asyncio.get_running_loop()
+        self._drained = asyncio.Event()
+        self._stopped = asyncio.Event()
+        log.info("⚙️ Движок обновлений запущен (%s обработчиков)", self.max_workers)
+
+        if not poll:
+            if self.checkpoint is not None:
+                self.loop.create_task(self._save_checkpoint_periodically())
+            await self._stopped.wait()
+            return
+
+        while not self._stopping:
+            await self._wait_for_capacity()
+            try:
+                updates = await self.loop.run_in_executor(self.poll_executor, self.bot.get_updates)
+            except Exception as e:
+                log.error("❌ Ошибка получения обновлений: %s", e)
+                await asyncio.sleep(1)
+                continue
+
+            for update in updates:
+                self.dispatch(update)
+            # После stop() позицию уже сохранил сам stop(), а пул закрыт
+            if self.checkpoint is not None and not self._stopping:
+                await self.loop.run_in_executor(self.poll_executor, self.checkpoint.save)
+
+    async def _save_checkpoint_periodically(self):
+        while not self._stopping:
+            await asyncio.sleep(self.checkpoint_interval)
+            await self.loop.run_in_executor(self.poll_executor, self.checkpoint.save)
+
+    async def _wait_for_capacity(self):
+        """Не забирает новые обновления, пока обработчики перегружены"""
+        while self.pending >= self.max_pending:
+            self._drained.clear()
+            await self._drained.wait()
+
+    def dispatch(self, update):
+        """Ставит обновление в очередь его чата (вызывается в потоке event loop)"""
+        # Синтетические обновления (без update_id) не проверяются на повтор
+        if self.checkpoint is not None and "update_id" in update and not self.checkpoint.accept(update["update_id"]):
+            UPDATES_DUPLICATE.inc()
+            return
+        kind = update_type(update)
+        UPDATES_RECEIVED.inc(kind)
+        sent_at = update.get(kind, {}).get("date") if kind in ("message", "edited_message") else None
+        if sent_at:
+            UPDATE_LAG_SECONDS.observe(max(time.time() - sent_at, 0.0))
+
+        chat_id = update_chat_id(update)
+        if self.guard is not None and not self.guard.admit(update, chat_id, self.pending):
+            # Отброшенное обновление считается обработанным, чтобы не прийти снова
+            if self.checkpoint is not None and "update_id" in update:
+                self.checkpoint.done(update["update_id"])
+            return
+        queue = self.chat_queues.get(chat_id)
+        if queue is None:
+            queue = deque()
+            self.chat_queues[chat_id] = queue
+            self.loop.create_task(self._chat_worker(chat_id, queue))
+        queue.append(update)
+        self.pending += 1
+
+    def is_running(self):
+        """Движок запущен и принимает обновления через submit"""
+        return self.loop is not None
+
+    def is_overloaded(self):
+        """Очередь обработки заполнена — новые обновления лучше не принимать"""
+        return self.pending >= self.max_pending
+
+    def submit(self, update):
+        """Потокобезопасная передача обновления в движок (например, из webhook)"""
+        self.loop.call_soon_threadsafe(self.dispatch, update)
+
+    async def _chat_worker(self, chat_id, queue):
+        """Последовательно обрабатывает обновления одного чата"""
+        try:
+            while queue:
+                update = queue.popleft()
+                started = time.perf_counter()
+                try:
+                    await self.loop.run_in_executor(self.executor, self.bot.handle_update, update)
+                    UPDATES_HANDLED.inc("ok")
+                except Exception as e:
+                    UPDATES_HANDLED.inc("error")
+                    log.exception("❌ Ошибка обработки обновления %s: %s", update.get('update_id'), e)
+                finally:
+                    UPDATE_SECONDS.observe(time.perf_counter() - started)
+                    if self.checkpoint is not None and "update_id" in update:
+                        self.checkpoint.done(update["update_id"])
+                    self.pending -= 1
+                    if self.pending < self.max_pending:
+                        self._drained.set()
+        finally:
+            # Между проверкой очереди и удалением нет await, поэтому новое
+            # обновление не может потеряться
+            del self.chat_queues[chat_id]
+
+    def stop(self):
+        """Останавливает прием новых обновлений"""
+        self._stopping = True
+        if self.checkpoint is not None:
+            self.checkpoint.save()
+        if self.loop is not None and self._stopped is not None:
+            self.loop.call_soon_threadsafe(self._stopped.set)
+        self.executor.shutdown(wait=False)
+        self.poll_executor.shutdown(wait=False)
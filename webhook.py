@@ -0,0 +1,102 @@
+"""
+Прием обновлений Telegram через webhook.
+
+Telegram отправляет POST на WEBHOOK_PATH с заголовком
+X-Telegram-Bot-Api-Secret-Token. Проверенные обновления передаются в тот же
+UpdateEngine, что и при long polling, поэтому логика опроса не меняется.
+"""
+
+import hmac
+import json
+import logging
+import os
+import secrets
+
+log = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+MAX_BODY_SIZE = 1024 * 1024
+
+# Типы обновлений, которые обрабатывает бот
+ALLOWED_UPDATES = ["message", "edited_message", "callback_query"]
+
+
+class WebhookReceiver:
+    def __init__(self, url, secret=None, path=None):
+        self.path = path or os.getenv('WEBHOOK_PATH', '/telegram/webhook')
+        self.url = url.rstrip('/') + self.path
+        # Секрет можно не задавать: он передается Telegram при каждом setWebhook
+        self.secret = secret or os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+        self.engine = None
+        self.received = 0
+        self.rejected = 0
+
+    def attach(self, engine):
+        """Подключает движок, в который будут передаваться обновления"""
+        self.engine = engine
+
+    def register(self, api, drop_pending_updates=False):
+        """Регистрирует webhook в Telegram"""
+        api.call("setWebhook", {
+            "url": self.url,
+            "secret_token": self.secret,
+            "allowed_updates": ALLOWED_UPDATES,
+            "drop_pending_updates": drop_pending_updates,
+            "max_connections": int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40)),
+        })
+        log.info("🔗 Webhook зарегистрирован: %s", self.url)
+
+    def handle_post(self, path, headers, body):
+        """
+        Проверяет запрос от Telegram и передает обновление в движок.
+        Возвращает (HTTP статус, текст ответа).
+        """
+        if path != self.path:
+            return 404, "Not found"
+
+        token = headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            self.rejected += 1
+            log.warning("⚠️ Webhook: неверный секретный токен")
+            return 403, "Forbidden"
+
+        if self.engine is None or not self.engine.is_running():
+            # Telegram повторит доставку позже
+            return 503, "Not ready"
+        if self.engine.is_overloaded():
+            return 429, "Overloaded"
+
+        try:
+            update = json.loads(body)
+        except ValueError:
+            self.rejected += 1
+            return 400, "Invalid JSON"
+
+        if not is_valid_update(update):
+            self.rejected += 1
+            return 400, "Invalid update"
+
+        self.received += 1
+        self.engine.submit(update)
+        return 200, "OK"
+
+
+def is_valid_update(update):
+    """Проверяет минимальную структуру обновления Telegram"""
+    if not isinstance(update, dict) or not isinstance(update.get("update_id"), int):
+        return False
+    for key in ("message", "edited_message"):
+        if key in update:
+            return _has_int_id(update[key], "chat")
+    if "callback_query" in update:
+        return _has_int_id(update["callback_query"], "from")
+    # Остальные типы обновлений бот игнорирует, но принимает
+    return True
+
+
+def _has_int_id(obj, field):
+    """obj[field]["id"] — целое число; любое другое строение считается некорректным"""
+    if not isinstance(obj, dict):
+        return False
+    inner = obj.get(field)
+    return isinstance(inner, dict) and isinstance(inner.get("id"), int)